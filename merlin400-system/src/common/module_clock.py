@@ -0,0 +1,103 @@
+import datetime
+import threading
+import time as _time
+
+# All control code reads the time and sleeps through this module, so the clock can be swapped for a
+# VirtualClock to run programs in simulations and tests faster than real time.
+
+
+class RealClock:
+    """Wall clock time, sleeps block the calling thread"""
+
+    def time(self):
+        return _time.time()
+
+    def monotonic(self):
+        return _time.monotonic()
+
+    def sleep(self, seconds):
+        _time.sleep(seconds)
+
+    def now(self):
+        return datetime.datetime.now()
+
+    def utcnow(self):
+        return datetime.datetime.utcnow()
+
+
+class VirtualClock:
+    """
+    Clock that only moves when it is told to: sleep() advances the time instantly instead of
+    blocking. time() and monotonic() share the same timeline, so intervals measured with either
+    one agree.
+    """
+
+    def __init__(self, start=None):
+        """
+        :param start: initial epoch time in seconds, the current wall clock time if None.
+        """
+        self._lock = threading.Lock()
+        self._time = _time.time() if start is None else float(start)
+
+    def time(self):
+        return self._time
+
+    def monotonic(self):
+        return self._time
+
+    def sleep(self, seconds):
+        if seconds < 0:
+            raise ValueError("sleep length must be non-negative")
+        self.advance(seconds)
+
+    def advance(self, seconds):
+        """Move the clock forward
+
+        :param seconds: time to move forward in seconds.
+        """
+        with self._lock:
+            self._time += seconds
+
+    def now(self):
+        return datetime.datetime.fromtimestamp(self._time)
+
+    def utcnow(self):
+        return datetime.datetime.utcfromtimestamp(self._time)
+
+
+_clock = RealClock()
+
+
+def get_clock():
+    return _clock
+
+
+def set_clock(clock):
+    """Use clock for all time readings and sleeps from now on, returns the previous clock
+
+    :param clock: RealClock, VirtualClock or an object with the same methods.
+    """
+    global _clock
+    previous = _clock
+    _clock = clock
+    return previous
+
+
+def time():
+    return _clock.time()
+
+
+def monotonic():
+    return _clock.monotonic()
+
+
+def sleep(seconds):
+    _clock.sleep(seconds)
+
+
+def now():
+    return _clock.now()
+
+
+def utcnow():
+    return _clock.utcnow()
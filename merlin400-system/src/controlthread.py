@@ -2,8 +2,6 @@ import enum
 import sqlite3
 import sys
 import threading
-import time
-from datetime import datetime
 
 import system_setup
 from common.settings import HEARTBEAT_TIMEOUT_SECONDS, ALCOHOL_SENSOR_ENABLED
@@ -14,7 +12,9 @@ from hardware.module_HardwareControlSystem import (
 )
 from hardware.components.module_physicalinterface import module_physicalinterface
 from hardware.components.module_fancontrol import NotSupportedFanError, module_fancontrol
-from hardware.module_FSM import FailureMode
+from hardware.module_FSM import FailureMode, StateId
+from hardware.module_statetelemetry import module_statetelemetry
+from common import module_clock as clock
 from common.module_logging import get_app_logger
 from hardware.commands.basecommand import BaseCommand
 
@@ -59,7 +59,7 @@ class ControlThread(threading.Thread):
     _statusDict: any = {
         "machineState": "idle",
         "currentStatus": None,
-        "timestamp": int(time.time()),
+        "timestamp": int(clock.time()),
 
         "deviceInfo" : {
             "machine_id": None,
@@ -91,6 +91,9 @@ class ControlThread(threading.Thread):
             "errorMessage": None,
         },
 
+        # program ids of a program sequence that are still to run
+        "programSequence": [],
+
         "programParameters": {
             "soakTime": None,
             "number_of_flushes":None,
@@ -136,22 +139,22 @@ class ControlThread(threading.Thread):
         except PressureSensorFailure:
             self._logger.error("Pressure sensor initialization error. Entering error state...")
             self._hardwareControlSystem.FSM.fsmData["failure_mode"] = FailureMode.PRESSURE_SENSOR_ERROR
-            self._hardwareControlSystem.FSM.ToTransistion("toStateError")
+            self._hardwareControlSystem.FSM.ToTransistion(StateId.ERROR)
 
         except ElectricalError:
             self._logger.error("Electrical error. Entering error state...")
             self._hardwareControlSystem.do_fast_blink()
-            self._hardwareControlSystem.FSM.ToTransistion("toStateError")
+            self._hardwareControlSystem.FSM.ToTransistion(StateId.ERROR)
 
         except UserPanelError:
             self._logger.error("User panel error. Entering error state...")
             self._hardwareControlSystem.do_slow_blink()
-            self._hardwareControlSystem.FSM.ToTransistion("toStateError")
+            self._hardwareControlSystem.FSM.ToTransistion(StateId.ERROR)
 
         except HardwareFailure:
             self._logger.error("Hardware error. Entering error state...")
             self._hardwareControlSystem.do_fast_blink()
-            self._hardwareControlSystem.FSM.ToTransistion("toStateError")
+            self._hardwareControlSystem.FSM.ToTransistion(StateId.ERROR)
 
         else:
             self._hardwareControlSystem.FSM.SetFSMData("start_flag", False)
@@ -159,6 +162,9 @@ class ControlThread(threading.Thread):
 
         self._selected_program = 1
 
+        # (program id, start command) of the programs of a sequence that are still to run
+        self._program_sequence = []
+
         # counter that counts how many times we have seen a reset request
         self._reset_request_counter = 0
         # counter that counts how many times we have seen a select button request
@@ -169,7 +175,7 @@ class ControlThread(threading.Thread):
         self._play_request_counter = 0
 
         # variable used to limit alcohol logging to once persecond
-        self._alcohollevel_last_log_second = datetime.now().timestamp()
+        self._alcohollevel_last_log_second = clock.now().timestamp()
 
         # distill runtime variables
         self._last_distill_runtime_total = 0.0
@@ -181,6 +187,10 @@ class ControlThread(threading.Thread):
         self._init_stats_db()
         self._load_total_run_minutes()
 
+        # record the duration of every FSM state in the stats db
+        self._state_telemetry = module_statetelemetry()
+        self._hardwareControlSystem.FSM.AddTransitionListener(self._state_telemetry.record_transition)
+
         #Only set at init (never changes)
         self._statusDict["deviceInfo"]["machine_id"] = system_setup.getserial()
         self._statusDict["deviceInfo"]["unique_id"] = system_setup.get_unique_id()
@@ -197,7 +207,7 @@ class ControlThread(threading.Thread):
             row = cur.fetchone()
             if not row:
                 with conn:
-                    now = datetime.utcnow().date().strftime("%Y-%m-%d")
+                    now = clock.utcnow().date().strftime("%Y-%m-%d")
                     conn.execute("insert into stats values (?, ?, ?)", (now, self._distill_mode, 0))
 
     def _load_total_run_minutes(self):
@@ -221,7 +231,7 @@ class ControlThread(threading.Thread):
                 # Incrementally update stats log. This way we keep history of updates and we can double check value
                 # in stats table. This also gives us the history of distill runs.
                 if delta > 0:
-                    now = datetime.utcnow().timestamp()
+                    now = clock.utcnow().timestamp()
                     # Hard coding mode = 1 for distill process. For now there is no need to support other modes.
                     # but we'll be able to do that without schema change.
                     conn.execute("insert into stats_log values (?, ?, ?)", (int(now), 1, int(delta)))
@@ -244,17 +254,17 @@ class ControlThread(threading.Thread):
             return
 
         if (
-            self._hardwareControlSystem.FSM.curHandle == "Ready"
+            self._hardwareControlSystem.FSM.curStateId is StateId.READY
             and not self._hardwareControlSystem.FSM.fsmData["running_flag"]
         ):
             self._hardwareControlSystem._myphysicalinterface.set_state(
                 module_physicalinterface.DeviceState.READY
             )
-        elif self._hardwareControlSystem.FSM.curHandle == "Error":
+        elif self._hardwareControlSystem.FSM.curStateId is StateId.ERROR:
             self._hardwareControlSystem._myphysicalinterface.set_state(
                 module_physicalinterface.DeviceState.ERROR
             )
-        elif self._hardwareControlSystem.FSM.curHandle == "DistillBulk":
+        elif self._hardwareControlSystem.FSM.curStateId is StateId.DISTILL_BULK:
             if self._hardwareControlSystem.FSM.fsmData["pause_flag"]:
                 self._hardwareControlSystem._myphysicalinterface.set_state(
                     module_physicalinterface.DeviceState.PAUSE
@@ -263,7 +273,7 @@ class ControlThread(threading.Thread):
                 self._hardwareControlSystem._myphysicalinterface.set_state(
                     module_physicalinterface.DeviceState.RUNNING_PAUSE_ENABLED
                 )
-        elif self._hardwareControlSystem.FSM.curHandle == "CleanPump":
+        elif self._hardwareControlSystem.FSM.curStateId is StateId.CLEAN_PUMP:
             if self._hardwareControlSystem.FSM.fsmData["pause_flag"]:
                 self._hardwareControlSystem._myphysicalinterface.set_state(
                     module_physicalinterface.DeviceState.PAUSE
@@ -282,15 +292,61 @@ class ControlThread(threading.Thread):
         command.validate_state(self._hardwareControlSystem)
         self._scheduledCommand=command
 
+    # Starts the first program of a sequence now and each of the others as soon as the one before has
+    # completed, stages is a list of (program id, start command)
+    def schedule_program_sequence(self, stages):
+        if not stages:
+            raise Exception("Program sequence is empty.")
+        if self._program_sequence:
+            raise Exception("Can not start new program sequence when a sequence is running.")
+
+        self.schedule_command_for_execution(stages[0][1])
+        self._program_sequence = list(stages[1:])
+        self._logger.info(
+            "Scheduled program sequence {}".format([programId for programId, _ in stages])
+        )
+
+    # Invoked from control thread - starts the next program of a sequence when the machine is idle again.
+    # The sequence is dropped when a program fails or its start command can't be validated.
+    def _start_next_program_in_sequence(self):
+        if not self._program_sequence or self._scheduledCommand is not None:
+            return
+
+        fsm = self._hardwareControlSystem.FSM
+        if fsm.curStateId is StateId.ERROR or fsm.fsmData["failure_mode"] != FailureMode.NONE:
+            self._logger.error(
+                "Program failed, dropping programs {} of the sequence".format(
+                    [programId for programId, _ in self._program_sequence]
+                )
+            )
+            self._program_sequence = []
+            return
+
+        if fsm.curStateId is not StateId.READY or fsm.fsmData["running_flag"] or fsm.fsmData["pause_flag"]:
+            return
+
+        programId, command = self._program_sequence.pop(0)
+        try:
+            self.schedule_command_for_execution(command)
+        except Exception as error:
+            self._logger.error(
+                "Can not start program {} of the sequence: {}. Dropping the sequence.".format(programId, error)
+            )
+            self._program_sequence = []
+            return
+
+        self._logger.info("Starting program {} of the sequence".format(programId))
+
     def get_machine_json_status(self):
         curHandle = self._hardwareControlSystem.FSM.curHandle
-        self._statusDict["timestamp"] = int(time.time())
+        self._statusDict["timestamp"] = int(clock.time())
         self._statusDict["currentStatus"] = curHandle
+        self._statusDict["programSequence"] = [programId for programId, _ in self._program_sequence]
         self._statusDict["deviceInfo"]["runMinutesSince"] = self._distill_runtime_total
 
         activeProgramDict=self._statusDict["activeProgram"]
 
-        if curHandle == "Ready":
+        if self._hardwareControlSystem.FSM.curStateId is StateId.READY:
             self._statusDict["machineState"] = "idle"
             activeProgramDict["progress"] = None
             activeProgramDict["programId"] = None
@@ -299,7 +355,7 @@ class ControlThread(threading.Thread):
             activeProgramDict["timeElapsed"] = None
             activeProgramDict["warning"] = None
             activeProgramDict["errorMessage"] = None
-        elif curHandle == "Error":
+        elif self._hardwareControlSystem.FSM.curStateId is StateId.ERROR:
             self._statusDict["machineState"] = "error"
             activeProgramDict["currentAction"] = "Error"
             activeProgramDict["errorMessage"] = self._hardwareControlSystem.FSM.fsmData["failure_description"]
@@ -326,6 +382,12 @@ class ControlThread(threading.Thread):
         
         return self._statusDict
 
+    def get_state_duration_stats(self, runs=10):
+        return self._state_telemetry.state_durations(runs)
+
+    def get_time_saved_stats(self, runs=10):
+        return self._state_telemetry.time_saved(runs)
+
 
     #Invoked from control thread - Updates statusobject with values read from hardware
     def _update_hardware_status(self):
@@ -418,7 +480,7 @@ class ControlThread(threading.Thread):
 
         if button_press is module_physicalinterface.ButtonPressed.SELECT:
             # may only run if state is ready, otherwise just ignore
-            if self._hardwareControlSystem.FSM.curHandle != "Ready":
+            if self._hardwareControlSystem.FSM.curStateId is not StateId.READY:
                 return
 
             self._select_request_counter += 1
@@ -433,14 +495,14 @@ class ControlThread(threading.Thread):
             self._logger.debug("User pressed play")
             # may only run if state is ready, otherwise just ignore or is in pause mode
             if (
-                self._hardwareControlSystem.FSM.curHandle != "Ready"
-                and self._hardwareControlSystem.FSM.curHandle not in ("DistillBulk", "CleanPump")
+                self._hardwareControlSystem.FSM.curStateId is not StateId.READY
+                and self._hardwareControlSystem.FSM.curStateId not in (StateId.DISTILL_BULK, StateId.CLEAN_PUMP)
             ):
                 # Machine is running, use the buttonpress to toggle LED state
                 self._hardwareControlSystem.toggle_light()
                 return
 
-            if self._hardwareControlSystem.FSM.curHandle == "Ready":
+            if self._hardwareControlSystem.FSM.curStateId is StateId.READY:
                 if self._selected_program == 1:
                     self._logger.debug("Extracting")
                     self.schedule_command_for_execution(Command_StartExtraction(runFull=True))
@@ -461,7 +523,7 @@ class ControlThread(threading.Thread):
                     self._logger.debug("Invalid program %r, ignoring...", self._selected_program)
                     return
 
-            elif self._hardwareControlSystem.FSM.curHandle in ("DistillBulk", "CleanPump"):
+            elif self._hardwareControlSystem.FSM.curStateId in (StateId.DISTILL_BULK, StateId.CLEAN_PUMP):
                 # if distillation is running, toggle white light
                 self._play_request_counter += 1
                 if not self._hardwareControlSystem.FSM.fsmData["pause_flag"]:
@@ -477,7 +539,7 @@ class ControlThread(threading.Thread):
             self._pause_request_counter += 1
             self._logger.debug("User pressed pause")
             # may only run if state is ready, otherwise just ignore or is in pause mode
-            if self._hardwareControlSystem.FSM.curHandle not in ("DistillBulk", "CleanPump"):
+            if self._hardwareControlSystem.FSM.curStateId not in (StateId.DISTILL_BULK, StateId.CLEAN_PUMP):
                 self._logger.debug("Machine is in wrong mode, ignore button press")
                 return
             self._hardwareControlSystem.FSM.SetFSMData("pause_flag", True)
@@ -526,12 +588,12 @@ class ControlThread(threading.Thread):
         _previous_alcohol_level = None
         alcohol_level = None
         try:
-            if self._hardwareControlSystem.FSM.curHandle != "Error":
+            if self._hardwareControlSystem.FSM.curStateId is not StateId.ERROR:
                 alcohol_level = self._hardwareControlSystem.alcohol_level
         except HardwareFailure:
             self._logger.error("Electrical error. Entering error state...")
             self._hardwareControlSystem.do_fast_blink()
-            self._hardwareControlSystem.FSM.ToTransistion("toStateError")
+            self._hardwareControlSystem.FSM.ToTransistion(StateId.ERROR)
 
         # print("Alcohol level message: {}".format(alcohol_level.value))
         # print("Raw alcohol level: {}".format(s))
@@ -541,9 +603,9 @@ class ControlThread(threading.Thread):
         if hasattr(self._hardwareControlSystem, "myalcoholdatalogger"):
             # datalogging is on
             # log once per second
-            if self._last_log_second != int(datetime.now().timestamp()):
-                self._last_log_second = int(datetime.now().timestamp())
-                logdate = "{:%Y-%m-%d-%H:%M:%S}".format(datetime.now())
+            if self._last_log_second != int(clock.now().timestamp()):
+                self._last_log_second = int(clock.now().timestamp())
+                logdate = "{:%Y-%m-%d-%H:%M:%S}".format(clock.now())
 
                 data = {
                     "Time": logdate,
@@ -583,7 +645,7 @@ class ControlThread(threading.Thread):
             # display failure mode in display
             # self._myHardwareControlSystem.show_error_code_in_display()
             # Transition to Error state.
-            self._hardwareControlSystem.FSM.ToTransistion("toStateError")
+            self._hardwareControlSystem.FSM.ToTransistion(StateId.ERROR)
     # # ALCOHOL CHECK STOP
 
     def check_fan_is_off(self):
@@ -597,7 +659,7 @@ class ControlThread(threading.Thread):
                     module_physicalinterface.DeviceState.ERROR
                 )
                 self._hardwareControlSystem.FSM.fsmData["failure_mode"] = FailureMode.FAN_ERROR
-                self._hardwareControlSystem.FSM.ToTransistion("toStateError")
+                self._hardwareControlSystem.FSM.ToTransistion(StateId.ERROR)
                 self._hardwareControlSystem.FSM.fsmData["failure_description"] = (
                     "Error, air fan seems to be defective. Please try again and if it still fails, contact drizzle "
                     "support."
@@ -629,14 +691,14 @@ class ControlThread(threading.Thread):
             while self._running:
                 self._heartbeat.set()
 
-                if (int(time.time()) % 600) == 0 and not _logged_control_loop:
+                if (int(clock.time()) % 600) == 0 and not _logged_control_loop:
                     self._logger.debug("Control loop is running. Device FSM state: {}, FSM handle {}. Pause flag {}.".format(
                         self._hardwareControlSystem.FSM.curState.name,
                         self._hardwareControlSystem.FSM.curHandle,
                         self._hardwareControlSystem.FSM.fsmData["pause_flag"],
                     ))
                     _logged_control_loop = True
-                elif (int(time.time()) % 600) != 0 and _logged_control_loop:
+                elif (int(clock.time()) % 600) != 0 and _logged_control_loop:
                     _logged_control_loop = False
 
                 # check for config changes
@@ -649,7 +711,7 @@ class ControlThread(threading.Thread):
                     self._check_alcohol_level()
 
                 # Capture run time miutes for distill state.
-                if self._hardwareControlSystem.FSM.curHandle == "DistillBulk":
+                if self._hardwareControlSystem.FSM.curStateId is StateId.DISTILL_BULK:
                     counter = self._hardwareControlSystem.FSM.curState.eventDurationWithPause
                     runtime_minutes = int(counter / 60)
                     if (runtime_minutes - self._last_distill_runtime_total) > 0:
@@ -660,6 +722,9 @@ class ControlThread(threading.Thread):
                 self._activeCommand=self._scheduledCommand
                 self._scheduledCommand=None
                 if self._activeCommand!=None:
+                    # a reset also cancels the rest of a program sequence
+                    if isinstance(self._activeCommand, Command_Reset):
+                        self._program_sequence = []
                     self._logger.info("Executing scheduled command")
                     self._activeCommand.validate_state(self._hardwareControlSystem)
                     self._activeCommand.execute(self._hardwareControlSystem)
@@ -673,16 +738,19 @@ class ControlThread(threading.Thread):
                 except HardwareFailure:
                     self._logger.error("Electrical error. Entering error state...")
                     self._hardwareControlSystem.do_fast_blink()
-                    self._hardwareControlSystem.FSM.ToTransistion("toStateError")
+                    self._hardwareControlSystem.FSM.ToTransistion(StateId.ERROR)
 
                 except Exception as e:
                     self._logger.exception("FSM state transition failed: {!r}".format(e))
                     self._hardwareControlSystem.FSM.fsmData["failure_mode"] = FailureMode.UNKNOWN_ERROR
-                    self._hardwareControlSystem.FSM.ToTransistion("toStateError")
+                    self._hardwareControlSystem.FSM.ToTransistion(StateId.ERROR)
+
+                # Continue a program sequence
+                self._start_next_program_in_sequence()
 
                 # self.adjust_logging_level()  # TODO: temporary disable to investigate issues with unresponsiveness.
 
-                if self._hardwareControlSystem.FSM.curHandle == "Ready":
+                if self._hardwareControlSystem.FSM.curStateId is StateId.READY:
                     if self._hardwareControlSystem._PID.PID_running:
                         self._hardwareControlSystem.set_PID_target(self._hardwareControlSystem.FSM.fsmData["target_temp"])
                         # if adjustment period has run, start next cycle
@@ -696,17 +764,20 @@ class ControlThread(threading.Thread):
                 # Hardware error can also happen here because when creating app payload we're reading
                 # some of the sensors: pressure, temperature, etc.
                 try:
-                    if _last_time_update_app_timestamp is None or (time.time() - _last_time_update_app_timestamp) > 10 or hasExecutedCommand:
+                    if _last_time_update_app_timestamp is None or (clock.time() - _last_time_update_app_timestamp) > 10 or hasExecutedCommand:
                         self._logger.info("Updating appstatus deep...")
-                        _last_time_update_app_timestamp = time.time()
+                        _last_time_update_app_timestamp = clock.time()
                         self._update_hardware_status()
                 except HardwareFailure:
                     self._logger.error("Electrical error. Entering error state...")
                     self._hardwareControlSystem.do_fast_blink()
-                    self._hardwareControlSystem.FSM.ToTransistion("toStateError")
+                    self._hardwareControlSystem.FSM.ToTransistion(StateId.ERROR)
+
+                # Write rate limited PWM outputs
+                self._hardwareControlSystem.flush_pwm_outputs()
 
                 # timing signal - 100 ms period
-                time.sleep(.01)
+                clock.sleep(.01)
 
         except Exception as error:
             self._logger.exception("Unhandled exception in control loop: {!r}".format(error))
@@ -17,9 +17,13 @@ class Command_CleanValve(BaseCommand):
 
     def execute(self, hardwareControlSystem: module_HardwareControlSystem):
         self._logger.info("Setting valves positions to clean " + self._valveString)
-        hardwareControlSystem.set_valve("valve1", 0)
-        hardwareControlSystem.set_valve("valve2", 0)
-        hardwareControlSystem.set_valve("valve3", 0)
-        hardwareControlSystem.set_valve("valve4", 0)
-        hardwareControlSystem.set_valve(self._valveString, 100)
+        hardwareControlSystem.set_valves(
+            [
+                ("valve1", 0),
+                ("valve2", 0),
+                ("valve3", 0),
+                ("valve4", 0),
+                (self._valveString, 100),
+            ]
+        )
 
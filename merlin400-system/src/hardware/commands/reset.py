@@ -16,10 +16,7 @@ class Command_Reset(BaseCommand):
         #self._user_feedback = "Command ok, resetting FSM"
         # flash to indicated actual reset
         hardwareControlSystem._myphysicalinterface.do_reset_flash()
-        hardwareControlSystem.set_valve("valve1", 0)
-        hardwareControlSystem.set_valve("valve4", 100)
-        hardwareControlSystem.set_valve("valve3", 100)
-        hardwareControlSystem.set_valve("valve2", 100)
+        hardwareControlSystem.set_valves_in_relax_position()
 
         hardwareControlSystem.bottom_heater_power = 0
         hardwareControlSystem.PID_off()
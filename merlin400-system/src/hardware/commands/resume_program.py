@@ -2,6 +2,7 @@ from common.module_logging import get_app_logger
 from hardware.components.module_physicalinterface import module_physicalinterface
 from hardware.module_HardwareControlSystem import module_HardwareControlSystem
 from hardware.commands.basecommand import BaseCommand
+from hardware.module_FSM import StateId
 
 class Command_ResumeProgram(BaseCommand):
 
@@ -10,7 +11,7 @@ class Command_ResumeProgram(BaseCommand):
 
     def validate_state(self, hardwareControlSystem: module_HardwareControlSystem):
         # may only run if state is DistillBulk, otherwise just ignore or is in pause mode
-        if hardwareControlSystem.FSM.curHandle != "DistillBulk":
+        if hardwareControlSystem.FSM.curStateId is not StateId.DISTILL_BULK:
             raise Exception("Machine is in wrong mode, ignoring resume request")
 
 
@@ -0,0 +1,26 @@
+from common.module_logging import get_app_logger
+from hardware.components.module_physicalinterface import module_physicalinterface
+from hardware.module_HardwareControlSystem import module_HardwareControlSystem
+from hardware.commands.basecommand import BaseCommand
+from hardware.module_FSM import StateId
+
+class Command_StartAutotune(BaseCommand):
+
+    def __init__(self):
+        self._logger = get_app_logger(str(self.__class__))
+
+    def validate_state(self, hardwareControlSystem: module_HardwareControlSystem):
+        device_is_paused: bool = hardwareControlSystem.FSM.fsmData["pause_flag"]
+        device_is_running: bool = hardwareControlSystem.FSM.fsmData["running_flag"]
+
+        if device_is_paused:
+            raise Exception("Can not start new program when device is paused.")
+        if device_is_running:
+            raise Exception("Can not start new program when device is running.")
+        if not hardwareControlSystem.FSM.CanTransition(StateId.AUTOTUNE):
+            raise Exception("Can not start new program in state {}.".format(hardwareControlSystem.FSM.curHandle))
+
+    def execute(self, hardwareControlSystem: module_HardwareControlSystem):
+        hardwareControlSystem._myphysicalinterface.set_state(module_physicalinterface.DeviceState.RUNNING_PAUSE_DISABLED)
+        hardwareControlSystem.FSM.SetFSMData("running_flag", True)
+        hardwareControlSystem.FSM.ToTransistion(StateId.AUTOTUNE)
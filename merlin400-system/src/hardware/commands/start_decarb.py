@@ -2,6 +2,7 @@ from common.module_logging import get_app_logger
 from hardware.components.module_physicalinterface import module_physicalinterface
 from hardware.module_HardwareControlSystem import module_HardwareControlSystem
 from hardware.commands.basecommand import BaseCommand
+from hardware.module_FSM import StateId
 
 class Command_StartDecarb(BaseCommand):
 
@@ -16,9 +17,11 @@ class Command_StartDecarb(BaseCommand):
             raise Exception("Can not start new program when device is paused.")
         if device_is_running:
             raise Exception("Can not start new program when device is running.")
+        if not hardwareControlSystem.FSM.CanTransition(StateId.DECARB):
+            raise Exception("Can not start new program in state {}.".format(hardwareControlSystem.FSM.curHandle))
 
     def execute(self, hardwareControlSystem: module_HardwareControlSystem):
         hardwareControlSystem._myphysicalinterface.set_state(module_physicalinterface.DeviceState.RUNNING_PAUSE_DISABLED)
         #self._user_feedback = "Command ok, Decarboxylating"
         hardwareControlSystem.FSM.SetFSMData("running_flag", True)
-        hardwareControlSystem.FSM.ToTransistion("toStateDecarb")
+        hardwareControlSystem.FSM.ToTransistion(StateId.DECARB)
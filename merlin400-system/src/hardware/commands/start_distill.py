@@ -2,6 +2,7 @@ from common.module_logging import get_app_logger
 from hardware.components.module_physicalinterface import module_physicalinterface
 from hardware.module_HardwareControlSystem import module_HardwareControlSystem
 from hardware.commands.basecommand import BaseCommand
+from hardware.module_FSM import StateId
 
 class Command_StartDistill(BaseCommand):
 
@@ -16,6 +17,8 @@ class Command_StartDistill(BaseCommand):
             raise Exception("Can not start new program when device is paused.")
         if device_is_running:
             raise Exception("Can not start new program when device is running.")
+        if not hardwareControlSystem.FSM.CanTransition(StateId.DISTILL_BULK):
+            raise Exception("Can not start new program in state {}.".format(hardwareControlSystem.FSM.curHandle))
 
     def execute(self, hardwareControlSystem: module_HardwareControlSystem):
         #self._user_feedback = "Command ok, distilling"
@@ -23,4 +26,4 @@ class Command_StartDistill(BaseCommand):
         hardwareControlSystem._myphysicalinterface.set_state(module_physicalinterface.DeviceState.RUNNING_PAUSE_ENABLED)
         hardwareControlSystem.FSM.SetFSMData("running_flag", True)
         hardwareControlSystem.FSM.SetFSMData("run_full_extraction", 0)
-        hardwareControlSystem.FSM.ToTransistion("toStateDistillBulk")
+        hardwareControlSystem.FSM.ToTransistion(StateId.DISTILL_BULK)
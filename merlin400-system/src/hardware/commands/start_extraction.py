@@ -2,6 +2,7 @@ from common.module_logging import get_app_logger
 from hardware.components.module_physicalinterface import module_physicalinterface
 from hardware.module_HardwareControlSystem import module_HardwareControlSystem
 from hardware.commands.basecommand import BaseCommand
+from hardware.module_FSM import StateId
 
 class Command_StartExtraction(BaseCommand):
 
@@ -21,10 +22,12 @@ class Command_StartExtraction(BaseCommand):
             raise Exception("Can not start new program when device is paused.")
         if device_is_running:
             raise Exception("Can not start new program when device is running.")
+        if not hardwareControlSystem.FSM.CanTransition(StateId.SYSTEM_CHECK):
+            raise Exception("Can not start new program in state {}.".format(hardwareControlSystem.FSM.curHandle))
 
     def execute(self, hardwareControlSystem: module_HardwareControlSystem):
         if self._soakTime is not None:
-            hardwareControlSystem._config["SYSTEM"]["soak_time_seconds"] = str(self._soakTime)
+            hardwareControlSystem.set_config_value("SYSTEM", "soak_time_seconds", self._soakTime)
             hardwareControlSystem.store_config()
             self._logger.info("Setting soak time to {} seconds.".format(self._soakTime))
 
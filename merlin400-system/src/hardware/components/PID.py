@@ -1,7 +1,7 @@
+import array
 import time
-import datetime
-import warnings
-import queue
+
+from common import module_clock as clock
 
 
 def _clamp(value, limits):
@@ -15,15 +15,8 @@ def _clamp(value, limits):
     return value
 
 
-try:
-    # get monotonic time to ensure that time deltas are always positive
-    _current_time = time.monotonic
-except AttributeError:
-    # time.monotonic() not available (using python < 3.3), fallback to time.time()
-    _current_time = time.time
-    warnings.warn(
-        "time.monotonic() not available in python < 3.3, using time.time() as fallback"
-    )
+# get monotonic time to ensure that time deltas are always positive
+_current_time = clock.monotonic
 
 
 class PID(object):
@@ -69,8 +62,6 @@ class PID(object):
         self._sample_initial_delay = float(sample_initial_delay)
         self._current_window_size = int(current_window_size)
 
-        self._data_window = queue.Queue(self._current_window_size)
-
         self._min_output, self._max_output = output_limits
         self._auto_mode = auto_mode
         self.proportional_on_measurement = proportional_on_measurement
@@ -79,22 +70,25 @@ class PID(object):
 
         self.reset()
 
-    def __call__(self, input_, dt=None):
+    def __call__(self, input_, dt=None, feed_forward=0, reference=None):
         """
         Call the PID controller with *input_* and calculate and return a control output if sample_time seconds has
         passed since the last update. If no new output is calculated, return the previous output instead (or None if
         no value has been calculated yet).
         :param dt: If set, uses this value for timestep instead of real time. This can be used in simulations when
                    simulation time is different from real time.
+        :param feed_forward: Output added to the PID terms, the PID then only corrects the residual. The integral
+                             term is limited so the sum stays within the output limits.
+        :param reference: If set, the error is calculated against this value instead of the setpoint. Used to
+                          follow a planned trajectory towards the setpoint.
         """
         if not self.auto_mode:
             return self._last_output
 
-        if not self._start_time:
-            # first run - start timing
-            self._start_time = datetime.datetime.now()
-
         now = _current_time()
+        if self._start_time is None:
+            # first run - start timing
+            self._start_time = now
         if dt is None:
             dt = now - self._last_time if now - self._last_time else 1e-16
         elif dt <= 0:
@@ -112,7 +106,7 @@ class PID(object):
             return (self._last_output, False)
 
         # compute error terms
-        error = self._setpoint - input_
+        error = (self._setpoint if reference is None else reference) - input_
         d_input = input_ - (
             self._last_input if self._last_input is not None else input_
         )
@@ -128,44 +122,69 @@ class PID(object):
         # compute integral and derivative terms
         self._integral += self.Ki * error * dt
         self._integral = _clamp(
-            self._integral, self.output_limits
+            self._integral, self._integral_limits(feed_forward)
         )  # avoid integral windup
 
         self._derivative = -self.Kd * d_input / dt
 
         # compute final output
-        output = self._proportional + self._integral + self._derivative
+        output = self._proportional + self._integral + self._derivative + feed_forward
         output = _clamp(output, self.output_limits)
 
         # keep track of state
         self._last_output = output
         self._last_input = input_
+        self._last_error = error
         self._last_time = now
 
         # check if we should start output power window samling
-        if (
-            datetime.datetime.now() - self._start_time
-        ).seconds > self._sample_initial_delay:
-            # add element to data window. If it is full remove oldest element
-            if self._data_window.full():
-                my_element = self._data_window.get()
-
-            self._data_window.put(self._last_output)
+        if (now - self._start_time) > self._sample_initial_delay:
+            self._add_to_data_window(output)
 
         return (output, True)
 
+    def _integral_limits(self, feed_forward):
+        if not feed_forward:
+            return self.output_limits
+        return tuple(None if limit is None else limit - feed_forward for limit in self.output_limits)
+
+    def _add_to_data_window(self, value):
+        # add element to the ring buffer, overwriting the oldest element when it is full
+        index = self._data_window_index
+        self._data_window_sum += value - self._data_window[index]
+        self._data_window[index] = value
+
+        index += 1
+        if index == self._current_window_size:
+            index = 0
+            # recalculate the running sum once per lap to avoid accumulating rounding errors
+            self._data_window_sum = sum(self._data_window)
+        self._data_window_index = index
+
+        if self._data_window_count < self._current_window_size:
+            self._data_window_count += 1
+
     @property
     def current_window_power_average(self):
-        if self._data_window.full():
-            mylist = list(self._data_window.queue)
-            average = sum(mylist) / len(mylist)
-            return average
+        if self._data_window_count == self._current_window_size:
+            return self._data_window_sum / self._current_window_size
         else:
             return False
 
     @property
     def get_data_window(self):
-        return list(self._data_window.queue)
+        if self._data_window_count < self._current_window_size:
+            return list(self._data_window[: self._data_window_count])
+        index = self._data_window_index
+        return list(self._data_window[index:]) + list(self._data_window[:index])
+
+    @property
+    def sample_initial_delay(self):
+        return self._sample_initial_delay
+
+    @property
+    def current_window_size(self):
+        return self._current_window_size
 
     @property
     def PID_running(self):
@@ -193,6 +212,35 @@ class PID(object):
         """Setter for the PID tunings"""
         self.Kp, self.Ki, self.Kd = tunings
 
+    def retune(self, Kp=None, Ki=None, Kd=None, output_limits=None, setpoint=None):
+        """
+        Change gains, output limits and setpoint without resetting the controller. The integral term is adjusted
+        so a change of Kp does not cause a step in the output (bumpless transfer). The integral term is already
+        stored in output units, so a change of Ki is bumpless as it is. The power window is kept.
+        :param Kp: New proportional gain, unchanged if None
+        :param Ki: New integral gain, unchanged if None
+        :param Kd: New derivative gain, unchanged if None
+        :param output_limits: New output limits as (lower, upper), unchanged if None
+        :param setpoint: New setpoint, unchanged if None
+        """
+        if Kp is not None:
+            if not self.proportional_on_measurement and self._last_error is not None:
+                self._integral -= (Kp - self.Kp) * self._last_error
+                self._proportional = Kp * self._last_error
+            self.Kp = Kp
+        if Ki is not None:
+            self.Ki = Ki
+        if Kd is not None:
+            self.Kd = Kd
+
+        if output_limits is not None:
+            self.output_limits = output_limits
+        else:
+            self._integral = _clamp(self._integral, self.output_limits)
+
+        if setpoint is not None:
+            self._setpoint = setpoint
+
     @property
     def auto_mode(self):
         """Whether the controller is currently enabled (in auto mode) or not"""
@@ -268,6 +316,42 @@ class PID(object):
         self._last_time = _current_time()
         self._last_output = None
         self._last_input = None
+        self._last_error = None
+
+        self._start_time = None
+        self._data_window = array.array("d", bytes(8 * self._current_window_size))
+        self._data_window_index = 0
+        self._data_window_count = 0
+        self._data_window_sum = 0.0
+
+
+def benchmark(iterations=100000, current_window_size=100):
+    """
+    Measure the throughput of PID.__call__ with the power window sampling active. Returns the number of
+    updates per second.
+    """
+    pid = PID(
+        1, 0.25, 0.05,
+        setpoint=125,
+        sample_time=None,
+        output_limits=(0, 100),
+        sample_initial_delay=0,
+        current_window_size=current_window_size,
+    )
+
+    start = time.perf_counter()
+    for i in range(iterations):
+        pid(100 + (i % 50) * 0.5, dt=1)
+        pid.current_window_power_average
+    elapsed = time.perf_counter() - start
 
-        self._start_time = False
-        self._data_window = queue.Queue(self._current_window_size)
+    return iterations / elapsed
+
+
+if __name__ == "__main__":
+    for window_size in (100, 1000):
+        print(
+            "PID update throughput, window size {}: {:.0f} updates/s".format(
+                window_size, benchmark(current_window_size=window_size)
+            )
+        )
@@ -10,6 +10,8 @@ import time
 
 import RPi.GPIO as GPIO
 from common.module_logging import get_app_logger
+from hardware.components.module_pwmoutputmanager import module_pwmoutputmanager
+from hardware.components.module_pwmbackend import SoftwarePWMBackend, get_pwm_backend
 
 
 class module_LED_RGBW_control:
@@ -30,11 +32,16 @@ class module_LED_RGBW_control:
     PIN_LEVEL_OFF = 0
     PIN_LEVEL_ON = 100
 
-    def __init__(self):
+    # minimum time between light changes per channel in seconds
+    PWM_MIN_WRITE_INTERVAL = 0.05
+
+    def __init__(self, pwm_manager=None, pwm_backend=None):
         """
         Constructor - pin_fan_pwm is the pin used to connect the fan
         drive circuit. Invert signal indicates if PWM signal is inverted
-        or not.
+        or not. pwm_manager is the shared PWM output manager, a private
+        one is created if not given. pwm_backend drives the pins, software
+        PWM is used if not given.
         """
         self._logger = get_app_logger(str(self.__class__))
 
@@ -51,22 +58,26 @@ class module_LED_RGBW_control:
         # init GPIO's
         GPIO.setwarnings(False)
         GPIO.setmode(GPIO.BCM)
-        GPIO.setup(self._pin_red, GPIO.OUT)
-        GPIO.setup(self._pin_green, GPIO.OUT)
-        GPIO.setup(self._pin_blue, GPIO.OUT)
-        GPIO.setup(self._pin_white, GPIO.OUT)
-
-        # setup pin as PWM output
-        self._pwm_red = GPIO.PWM(self._pin_red, module_LED_RGBW_control.FREQUENCY)
-        self._pwm_green = GPIO.PWM(self._pin_green, module_LED_RGBW_control.FREQUENCY)
-        self._pwm_blue = GPIO.PWM(self._pin_blue, module_LED_RGBW_control.FREQUENCY)
-        self._pwm_white = GPIO.PWM(self._pin_white, module_LED_RGBW_control.FREQUENCY)
-
-        # start system in off state
-        self._pwm_red.start(self.PIN_LEVEL_OFF)
-        self._pwm_green.start(self.PIN_LEVEL_OFF)
-        self._pwm_blue.start(self.PIN_LEVEL_OFF)
-        self._pwm_white.start(self.PIN_LEVEL_OFF)
+
+        # setup pins as PWM output and start system in off state
+        if pwm_backend is None:
+            pwm_backend = get_pwm_backend(SoftwarePWMBackend.NAME)
+        self._pwm_red = pwm_backend.create_output(self._pin_red, module_LED_RGBW_control.FREQUENCY, self.PIN_LEVEL_OFF)
+        self._pwm_green = pwm_backend.create_output(self._pin_green, module_LED_RGBW_control.FREQUENCY, self.PIN_LEVEL_OFF)
+        self._pwm_blue = pwm_backend.create_output(self._pin_blue, module_LED_RGBW_control.FREQUENCY, self.PIN_LEVEL_OFF)
+        self._pwm_white = pwm_backend.create_output(self._pin_white, module_LED_RGBW_control.FREQUENCY, self.PIN_LEVEL_OFF)
+
+        self._pwm_manager = pwm_manager if pwm_manager is not None else module_pwmoutputmanager()
+        self._channels = {
+            "led_white": self._pwm_white,
+            "led_red": self._pwm_red,
+            "led_green": self._pwm_green,
+            "led_blue": self._pwm_blue,
+        }
+        for name, pwm in self._channels.items():
+            self._pwm_manager.register(
+                name, pwm, duty_cycle=self.PIN_LEVEL_OFF, min_interval=self.PWM_MIN_WRITE_INTERVAL
+            )
 
         self._light_status = 0
 
@@ -76,10 +87,10 @@ class module_LED_RGBW_control:
     # method always runs on exit
     def cleanup(self):
         self._logger.debug("Module LED_RGBW_control - Running cleanup")
-        self._pwm_red.start(self.PIN_LEVEL_OFF)
-        self._pwm_green.start(self.PIN_LEVEL_OFF)
-        self._pwm_blue.start(self.PIN_LEVEL_OFF)
-        self._pwm_white.start(self.PIN_LEVEL_OFF)
+        self._pwm_red.ChangeDutyCycle(self.PIN_LEVEL_OFF)
+        self._pwm_green.ChangeDutyCycle(self.PIN_LEVEL_OFF)
+        self._pwm_blue.ChangeDutyCycle(self.PIN_LEVEL_OFF)
+        self._pwm_white.ChangeDutyCycle(self.PIN_LEVEL_OFF)
         GPIO.cleanup()
 
     def light_warm(self):
@@ -105,10 +116,10 @@ class module_LED_RGBW_control:
 
     # method to change light from other modules
     def set_light(self, white, red, green, blue):
-        self._pwm_white.start(white)
-        self._pwm_red.start(red)
-        self._pwm_green.start(green)
-        self._pwm_blue.start(blue)
+        self._pwm_manager.set_duty_cycle("led_white", white)
+        self._pwm_manager.set_duty_cycle("led_red", red)
+        self._pwm_manager.set_duty_cycle("led_green", green)
+        self._pwm_manager.set_duty_cycle("led_blue", blue)
 
 if __name__ == "__main__":
     my_led_rgbw = module_LED_RGBW_control()
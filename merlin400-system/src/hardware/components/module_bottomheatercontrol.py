@@ -8,12 +8,17 @@ import RPi.GPIO as GPIO
 import atexit
 
 from common.module_logging import get_app_logger
+from hardware.components.module_pwmoutputmanager import module_pwmoutputmanager
+from hardware.components.module_pwmbackend import SoftwarePWMBackend, get_pwm_backend
 
 
 class module_bottomheatercontrol:
     FREQUENCY = 500
+    PWM_CHANNEL = "bottom_heater"
+    # the PID controller already limits the update rate of the heater
+    PWM_MIN_WRITE_INTERVAL = 0
 
-    def __init__(self, max_wattage, pwm_pin=12):
+    def __init__(self, max_wattage, pwm_pin=12, pwm_manager=None, pwm_backend=None):
         self._logger = get_app_logger(str(self.__class__))
 
         self._pin_pwm = pwm_pin
@@ -25,9 +30,19 @@ class module_bottomheatercontrol:
         # initialize IO system
         GPIO.setmode(GPIO.BCM)
         GPIO.setwarnings(False)
-        GPIO.setup(self._pin_pwm, GPIO.OUT)
-        self._pwm_output = GPIO.PWM(self._pin_pwm, module_bottomheatercontrol.FREQUENCY)
-        self._pwm_output.start(self._duty_cycle)
+        if pwm_backend is None:
+            pwm_backend = get_pwm_backend(SoftwarePWMBackend.NAME)
+        self._pwm_output = pwm_backend.create_output(
+            self._pin_pwm, module_bottomheatercontrol.FREQUENCY, self._duty_cycle
+        )
+
+        self._pwm_manager = pwm_manager if pwm_manager is not None else module_pwmoutputmanager()
+        self._pwm_manager.register(
+            self.PWM_CHANNEL,
+            self._pwm_output,
+            duty_cycle=self._duty_cycle,
+            min_interval=self.PWM_MIN_WRITE_INTERVAL,
+        )
 
         # add cleanup method
         atexit.register(self.cleanup)
@@ -73,7 +88,7 @@ class module_bottomheatercontrol:
 
             # set actual output level
             self._duty_cycle = power_pct
-            self._pwm_output.ChangeDutyCycle(self._duty_cycle)
+            self._pwm_manager.set_duty_cycle(self.PWM_CHANNEL, self._duty_cycle)
 
     def shutdown(self):
         self._duty_cycle = 0
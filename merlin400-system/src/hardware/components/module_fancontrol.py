@@ -6,6 +6,8 @@ if __name__ == "__main__":
 
 import RPi.GPIO as GPIO
 from hardware.components.module_ADC_driver import module_ADC_driver
+from hardware.components.module_pwmoutputmanager import module_pwmoutputmanager
+from hardware.components.module_pwmbackend import SoftwarePWMBackend, get_pwm_backend
 
 import atexit
 
@@ -28,6 +30,9 @@ class module_fancontrol:
     PWM_LEVEL_MAX = 100
     PWM_LEVEL_MIN = 0
     PWM_LEVEL_DEFAULT = 20
+    PWM_CHANNEL = "fan"
+    # minimum time between fan speed changes in seconds
+    PWM_MIN_WRITE_INTERVAL = 0.5
     ADC_CHANNEL = 1
 
     #ADC threshhold levels
@@ -50,11 +55,13 @@ class module_fancontrol:
     FAN_ADC_LEVEL_ERROR = -1
 
 
-    def __init__(self, device_version, pin_fan_pwm=PWM_LEVEL_DEFAULT, invert_signal=False, i2c_dev=None, chip_adress=None, chip_type=None):
+    def __init__(self, device_version, pin_fan_pwm=PWM_LEVEL_DEFAULT, invert_signal=False, i2c_dev=None, chip_adress=None, chip_type=None, pwm_manager=None, pwm_backend=None):
         """
         Constructor - pin_fan_pwm is the pin used to connect the fan
         drive circuit. Invert signal indicates if PWM signal is inverted
-        or not.
+        or not. pwm_manager is the shared PWM output manager, a private
+        one is created if not given. pwm_backend drives the pin, software
+        PWM is used if not given.
         """
         self.device_version = device_version
         self._logger = get_app_logger(str(self.__class__))
@@ -68,10 +75,15 @@ class module_fancontrol:
         # init GPIO's
         GPIO.setwarnings(False)
         GPIO.setmode(GPIO.BCM)
-        GPIO.setup(self._pin_fan_pwm, GPIO.OUT)
 
-        # setup pin as PWM output
-        self._pwm = GPIO.PWM(self._pin_fan_pwm, module_fancontrol.FREQUENCY)
+        # setup pin as PWM output and start system in off state
+        if pwm_backend is None:
+            pwm_backend = get_pwm_backend(SoftwarePWMBackend.NAME)
+        self._pwm = pwm_backend.create_output(
+            self._pin_fan_pwm,
+            module_fancontrol.FREQUENCY,
+            self._output_level(self.PWM_LEVEL_MIN),
+        )
 
         #init ADC if requested
         if i2c_dev:
@@ -85,11 +97,13 @@ class module_fancontrol:
         else:
             print('No ADC check')
 
-        # start system in off state
-        if self._invert_signal:
-            self._pwm.start(self.PWM_LEVEL_MAX)
-        else:
-            self._pwm.start(self.PWM_LEVEL_MIN)
+        self._pwm_manager = pwm_manager if pwm_manager is not None else module_pwmoutputmanager()
+        self._pwm_manager.register(
+            self.PWM_CHANNEL,
+            self._pwm,
+            duty_cycle=self._output_level(self.PWM_LEVEL_MIN),
+            min_interval=self.PWM_MIN_WRITE_INTERVAL,
+        )
 
         # add cleanup method
         atexit.register(self.cleanup)
@@ -174,11 +188,17 @@ class module_fancontrol:
 
         self._pwm_value = value
 
+        self._pwm_manager.set_duty_cycle(
+            self.PWM_CHANNEL,
+            self._output_level(self._pwm_value),
+            immediate=(self._pwm_value == self.PWM_LEVEL_MIN),
+        )
+
+    def _output_level(self, value):
         if self._invert_signal:
             # set pwm in inverted mode, ie 100-value
-            self._pwm.start(self.PWM_LEVEL_MAX - self._pwm_value)
-        else:
-            self._pwm.start(self._pwm_value)
+            return self.PWM_LEVEL_MAX - value
+        return value
 
     # method always runs on exit
     def cleanup(self):
@@ -7,6 +7,8 @@ if __name__ == "__main__":
 import RPi.GPIO as GPIO
 import atexit
 from common.module_logging import get_app_logger
+from hardware.components.module_pwmoutputmanager import module_pwmoutputmanager
+from hardware.components.module_pwmbackend import SoftwarePWMBackend, get_pwm_backend
 
 class module_pumpcontrol:
     """
@@ -19,12 +21,17 @@ class module_pumpcontrol:
     PUMP_PWM_MIN = 0
     PUMP_PWM_MAX = 100
     PUMP_PWM_DEFAULT = 16
+    PWM_CHANNEL = "pump"
+    # minimum time between pump speed changes in seconds
+    PWM_MIN_WRITE_INTERVAL = 0.1
 
-    def __init__(self, pin_pump_pwm=PUMP_PWM_DEFAULT, invert_signal=False):
+    def __init__(self, pin_pump_pwm=PUMP_PWM_DEFAULT, invert_signal=False, pwm_manager=None, pwm_backend=None):
         """
         Constructor - pin_pump_pwm is the pin used to connect the pump
         drive circuit. Invert signal indicates if PWM signal is inverted
-        or not.
+        or not. pwm_manager is the shared PWM output manager, a private
+        one is created if not given. pwm_backend drives the pin, software
+        PWM is used if not given.
         """
         self._logger = get_app_logger(str(self.__class__))
 
@@ -36,16 +43,23 @@ class module_pumpcontrol:
         # init GPIO's
         GPIO.setwarnings(False)
         GPIO.setmode(GPIO.BCM)
-        GPIO.setup(self._pin_pump_pwm, GPIO.OUT)
 
-        # setup pin as PWM output
-        self._pwm = GPIO.PWM(self._pin_pump_pwm, module_pumpcontrol.FREQUENCY)
-
-        # start system in off state
-        if self._invert_signal:
-            self._pwm.start(self.PUMP_PWM_MAX)
-        else:
-            self._pwm.start(self.PUMP_PWM_MIN)
+        # setup pin as PWM output and start system in off state
+        if pwm_backend is None:
+            pwm_backend = get_pwm_backend(SoftwarePWMBackend.NAME)
+        self._pwm = pwm_backend.create_output(
+            self._pin_pump_pwm,
+            module_pumpcontrol.FREQUENCY,
+            self._output_level(self.PUMP_PWM_MIN),
+        )
+
+        self._pwm_manager = pwm_manager if pwm_manager is not None else module_pwmoutputmanager()
+        self._pwm_manager.register(
+            self.PWM_CHANNEL,
+            self._pwm,
+            duty_cycle=self._output_level(self.PUMP_PWM_MIN),
+            min_interval=self.PWM_MIN_WRITE_INTERVAL,
+        )
 
         # add cleanup method
         atexit.register(self.cleanup)
@@ -68,11 +82,17 @@ class module_pumpcontrol:
 
         self._pwm_value = value
 
+        self._pwm_manager.set_duty_cycle(
+            self.PWM_CHANNEL,
+            self._output_level(self._pwm_value),
+            immediate=(self._pwm_value == self.PUMP_PWM_MIN),
+        )
+
+    def _output_level(self, value):
         if self._invert_signal:
             # set pwm in inverted mode, ie 100-value
-            self._pwm.start(self.PUMP_PWM_MAX - self._pwm_value)
-        else:
-            self._pwm.start(self._pwm_value)
+            return self.PUMP_PWM_MAX - value
+        return value
 
     # method always runs on exit
     def cleanup(self):
@@ -0,0 +1,256 @@
+if __name__ == "__main__":
+  #Add root folder (/src/) to paths for import if this script is run standalone
+  from pathlib import Path
+  import sys
+  sys.path.append(str(Path(__file__).resolve().parent.parent.parent))
+
+import os
+import time
+from abc import ABC, abstractmethod
+
+try:
+    import RPi.GPIO as GPIO
+except ImportError:
+    GPIO = None
+
+from common.module_logging import get_app_logger
+
+
+class NotSupportedPWMError(Exception):
+    """Raise when a PWM backend can't drive the requested pin."""
+
+
+class PWMBackend(ABC):
+    """
+    Base class for PWM backends. A backend creates outputs for pins, the
+    outputs have the same ChangeDutyCycle/stop interface as RPi.GPIO.PWM so
+    they can be used directly by the PWM output manager.
+    """
+
+    NAME = None
+
+    def __init__(self):
+        self._logger = get_app_logger(str(self.__class__))
+
+    @property
+    def available(self):
+        return True
+
+    def supports_pin(self, pin):
+        return self.available
+
+    @abstractmethod
+    def create_output(self, pin, frequency, duty_cycle):
+        pass
+
+    @property
+    def cpu_time(self):
+        """CPU time in seconds used by the backend to drive its outputs"""
+        return 0.0
+
+
+class SoftwarePWMBackend(PWMBackend):
+    """
+    RPi.GPIO software PWM. Every output is driven by a background thread
+    started by the library, the CPU time is read from /proc for those threads.
+    """
+
+    NAME = "software"
+    PROC_TASK_PATH = "/proc/self/task"
+
+    def __init__(self):
+        super().__init__()
+        self._thread_ids = set()
+        # last known cpu time of threads, kept when a thread has stopped
+        self._thread_cpu_time = {}
+
+    @property
+    def available(self):
+        return GPIO is not None
+
+    def _list_threads(self):
+        try:
+            return set(os.listdir(self.PROC_TASK_PATH))
+        except OSError:
+            return set()
+
+    def _read_thread_cpu_time(self, thread_id):
+        with open(os.path.join(self.PROC_TASK_PATH, thread_id, "stat"), "r") as stat_file:
+            # the fields after the command name, utime and stime are field 14 and 15
+            fields = stat_file.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+    def create_output(self, pin, frequency, duty_cycle):
+        if not self.available:
+            raise NotSupportedPWMError("RPi.GPIO is not available")
+
+        GPIO.setwarnings(False)
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setup(pin, GPIO.OUT)
+        output = GPIO.PWM(pin, frequency)
+
+        threads_before = self._list_threads()
+        output.start(duty_cycle)
+        self._thread_ids |= self._list_threads() - threads_before
+
+        return output
+
+    @property
+    def cpu_time(self):
+        for thread_id in self._thread_ids:
+            try:
+                self._thread_cpu_time[thread_id] = self._read_thread_cpu_time(thread_id)
+            except (OSError, IndexError, ValueError):
+                pass
+        return sum(self._thread_cpu_time.values())
+
+
+class SysfsPWMBackend(PWMBackend):
+    """
+    Kernel hardware PWM through /sys/class/pwm. Requires the pwm or
+    pwm-2chan device tree overlay, which routes the PWM channels to the
+    pins in PIN_MAP. Two pins on the same channel can't be used at once.
+    """
+
+    NAME = "sysfs"
+    PWM_CHIP_PATH = "/sys/class/pwm/pwmchip{}"
+    EXPORT_TIMEOUT_SECONDS = 1
+
+    # BCM pin: (pwm chip, pwm channel)
+    PIN_MAP = {
+        12: (0, 0),
+        18: (0, 0),
+        13: (0, 1),
+        19: (0, 1),
+    }
+
+    class Output:
+        def __init__(self, backend, channel_path, frequency, duty_cycle):
+            self._backend = backend
+            self._channel_path = channel_path
+            self._period = int(1e9 / frequency)
+
+            # duty cycle must never exceed the period, so clear it before setting the period
+            self._write("duty_cycle", 0)
+            self._write("period", self._period)
+            self.ChangeDutyCycle(duty_cycle)
+            self._write("enable", 1)
+
+        def _write(self, attribute, value):
+            start = time.thread_time()
+            with open(os.path.join(self._channel_path, attribute), "w") as attribute_file:
+                attribute_file.write(str(value))
+            self._backend._cpu_time += time.thread_time() - start
+
+        def ChangeDutyCycle(self, duty_cycle):
+            self._write("duty_cycle", int(self._period * duty_cycle / 100))
+
+        def stop(self):
+            self._write("enable", 0)
+
+    def __init__(self):
+        super().__init__()
+        self._cpu_time = 0.0
+        self._used_channels = set()
+
+    def supports_pin(self, pin):
+        if pin not in self.PIN_MAP or self.PIN_MAP[pin] in self._used_channels:
+            return False
+        chip, _ = self.PIN_MAP[pin]
+        return os.path.isdir(self.PWM_CHIP_PATH.format(chip))
+
+    def create_output(self, pin, frequency, duty_cycle):
+        if not self.supports_pin(pin):
+            raise NotSupportedPWMError("Pin {} has no free hardware PWM channel".format(pin))
+
+        chip, channel = self.PIN_MAP[pin]
+        chip_path = self.PWM_CHIP_PATH.format(chip)
+        channel_path = os.path.join(chip_path, "pwm{}".format(channel))
+
+        if not os.path.isdir(channel_path):
+            with open(os.path.join(chip_path, "export"), "w") as export_file:
+                export_file.write(str(channel))
+
+            # wait for udev to create the channel attributes
+            start = time.monotonic()
+            while not os.path.isdir(channel_path):
+                if (time.monotonic() - start) > self.EXPORT_TIMEOUT_SECONDS:
+                    raise NotSupportedPWMError("Failed to export PWM channel {}".format(channel_path))
+                time.sleep(0.05)
+
+        output = self.Output(self, channel_path, frequency, duty_cycle)
+        self._used_channels.add(self.PIN_MAP[pin])
+        self._logger.info("Pin {} driven by hardware PWM {}".format(pin, channel_path))
+
+        return output
+
+    @property
+    def cpu_time(self):
+        return self._cpu_time
+
+
+class FakePWMBackend(PWMBackend):
+    """Backend without hardware, outputs only record the duty cycles they were given. For simulations
+    and tests only, the hardware control system refuses it."""
+
+    NAME = "fake"
+
+    class Output:
+        def __init__(self, pin, frequency, duty_cycle):
+            self.pin = pin
+            self.frequency = frequency
+            self.duty_cycle = duty_cycle
+            self.running = True
+            self.history = [duty_cycle]
+
+        def ChangeDutyCycle(self, duty_cycle):
+            self.duty_cycle = duty_cycle
+            self.history.append(duty_cycle)
+
+        def stop(self):
+            self.running = False
+
+    def __init__(self):
+        super().__init__()
+        self.outputs = {}
+
+    def create_output(self, pin, frequency, duty_cycle):
+        output = self.Output(pin, frequency, duty_cycle)
+        self.outputs[pin] = output
+        return output
+
+
+PWM_BACKENDS = {
+    backend.NAME: backend
+    for backend in (SoftwarePWMBackend, SysfsPWMBackend, FakePWMBackend)
+}
+
+_backends = {}
+
+
+def get_pwm_backend(name):
+    """Returns the shared instance of the PWM backend with the given name"""
+    if name not in PWM_BACKENDS:
+        raise NotSupportedPWMError("Unknown PWM backend: {}".format(name))
+
+    if name not in _backends:
+        _backends[name] = PWM_BACKENDS[name]()
+    return _backends[name]
+
+
+def get_pwm_cpu_time():
+    """Returns the CPU time in seconds used by each backend in use"""
+    return {name: backend.cpu_time for name, backend in _backends.items()}
+
+
+def main():
+    backend = get_pwm_backend(FakePWMBackend.NAME)
+    output = backend.create_output(12, 500, 0)
+    for duty_cycle in (10, 50, 0):
+        output.ChangeDutyCycle(duty_cycle)
+    print(output.history)
+    print(get_pwm_cpu_time())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+if __name__ == "__main__":
+  #Add root folder (/src/) to paths for import if this script is run standalone
+  from pathlib import Path
+  import sys
+  sys.path.append(str(Path(__file__).resolve().parent.parent.parent))
+
+import threading
+
+from common import module_clock as clock
+from common.module_logging import get_app_logger
+
+
+class module_pwmoutputmanager:
+    """
+    Central manager for all PWM outputs. It keeps a shadow copy of the duty
+    cycle of every channel and only writes to the hardware when the duty cycle
+    actually changes. Changes can be rate limited per channel, in which case
+    the latest requested value is kept as pending and written by flush(). A
+    timer flushes the channel when its rate limit expires, so pending changes
+    are also written while the control loop blocks in a sleep or a wait.
+    Switching a channel off is never rate limited, channels with an inverted
+    signal pass immediate=True for their off level.
+    """
+
+    DUTY_CYCLE_OFF = 0
+
+    class _Channel:
+        __slots__ = ("pwm", "duty_cycle", "min_interval", "last_write", "pending", "timer")
+
+        def __init__(self, pwm, duty_cycle, min_interval):
+            self.pwm = pwm
+            self.duty_cycle = duty_cycle
+            self.min_interval = min_interval
+            self.last_write = None
+            self.pending = None
+            self.timer = None
+
+    def __init__(self):
+        self._logger = get_app_logger(str(self.__class__))
+        self._lock = threading.Lock()
+        self._channels = {}
+
+        # counters for hardware writes done and saved
+        self._writes = 0
+        self._suppressed_writes = 0
+        self._deferred_writes = 0
+
+    def register(self, name, pwm, duty_cycle=DUTY_CYCLE_OFF, min_interval=0):
+        """
+        Register a started PWM output. duty_cycle is the level the output was
+        started with, min_interval is the minimum time in seconds between two
+        writes to the channel.
+        """
+        with self._lock:
+            if name in self._channels:
+                raise Exception("Error, PWM channel: {} already registered".format(name))
+            self._channels[name] = self._Channel(pwm, duty_cycle, min_interval)
+
+    def get_duty_cycle(self, name):
+        return self._channels[name].duty_cycle
+
+    def set_duty_cycle(self, name, duty_cycle, immediate=False):
+        """
+        Request a new duty cycle for a channel. immediate bypasses the rate
+        limit. Returns True if the hardware was written.
+        """
+        with self._lock:
+            channel = self._channels[name]
+
+            if duty_cycle == channel.duty_cycle:
+                # a pending change is superseded by a request for the current level
+                if channel.pending is not None:
+                    channel.pending = None
+                self._suppressed_writes += 1
+                return False
+
+            now = clock.monotonic()
+            if (
+                not immediate
+                and duty_cycle != self.DUTY_CYCLE_OFF
+                and channel.last_write is not None
+                and (now - channel.last_write) < channel.min_interval
+            ):
+                if channel.pending is not None:
+                    self._suppressed_writes += 1
+                else:
+                    self._deferred_writes += 1
+                    self._start_flush_timer(channel, channel.min_interval - (now - channel.last_write))
+                channel.pending = duty_cycle
+                return False
+
+            self._write(channel, duty_cycle, now)
+            return True
+
+    def flush(self):
+        """Write pending changes on channels where the rate limit has expired"""
+        with self._lock:
+            now = clock.monotonic()
+            for channel in self._channels.values():
+                if channel.pending is None:
+                    continue
+                if (now - channel.last_write) >= channel.min_interval:
+                    self._write(channel, channel.pending, now)
+
+    def close(self):
+        """Stop the flush timers, pending changes are dropped"""
+        with self._lock:
+            for channel in self._channels.values():
+                if channel.timer is not None:
+                    channel.timer.cancel()
+                    channel.timer = None
+                channel.pending = None
+
+    def _start_flush_timer(self, channel, delay):
+        if channel.timer is not None:
+            channel.timer.cancel()
+        channel.timer = threading.Timer(delay, self._flush_channel, (channel,))
+        channel.timer.daemon = True
+        channel.timer.start()
+
+    def _flush_channel(self, channel):
+        # runs in the timer thread once the rate limit of the channel has expired
+        with self._lock:
+            channel.timer = None
+            if channel.pending is not None:
+                self._write(channel, channel.pending, clock.monotonic())
+
+    def _write(self, channel, duty_cycle, now):
+        if channel.timer is not None:
+            channel.timer.cancel()
+            channel.timer = None
+        channel.pwm.ChangeDutyCycle(duty_cycle)
+        channel.duty_cycle = duty_cycle
+        channel.last_write = now
+        channel.pending = None
+        self._writes += 1
+
+    @property
+    def statistics(self):
+        return {
+            "writes": self._writes,
+            "suppressed_writes": self._suppressed_writes,
+            "deferred_writes": self._deferred_writes,
+        }
+
+    def log_statistics(self):
+        self._logger.info(
+            "PWM outputs - writes: {writes}, saved: {suppressed_writes}, deferred: {deferred_writes}".format(
+                **self.statistics
+            )
+        )
+
+
+def main():
+    class PrintPWM:
+        def __init__(self, name):
+            self._name = name
+
+        def ChangeDutyCycle(self, duty_cycle):
+            print("{} -> {}".format(self._name, duty_cycle))
+
+    manager = module_pwmoutputmanager()
+    manager.register("pump", PrintPWM("pump"), min_interval=0.5)
+
+    for value in (100, 100, 50, 60, 70, 0, 0, 100):
+        manager.set_duty_cycle("pump", value)
+        clock.sleep(0.1)
+
+    # the pending 100 is written by the flush timer
+    clock.sleep(0.5)
+    print(manager.statistics)
+    manager.close()
+
+
+if __name__ == "__main__":
+    main()
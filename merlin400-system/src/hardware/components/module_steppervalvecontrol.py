@@ -6,6 +6,8 @@ if __name__ == "__main__":
   
 import atexit
 import enum
+import json
+import os
 import time
 
 import RPi.GPIO as GPIO
@@ -37,6 +39,16 @@ class module_steppervalvecontrol:
     STEPPER_POS_START = 0
     STEPPER_POS_END = 100
 
+    # Valve positions are journaled to this file after every completed move, so
+    # a clean restart can skip the full homing sequence.
+    POSITION_JOURNAL_FILE = "valve_positions.json"
+    # Number of extra half steps used to re-seat a valve that was journaled in the
+    # home position, instead of running the full HOME_STEPS.
+    VERIFY_STEPS = 20
+    # Whether the journal on disk marks a clean shutdown. Until the journal is
+    # written it may be clean from the last run, so the first move marks it dirty.
+    _journal_clean = True
+
     class ValveList(enum.Enum):
         VALVE1 = "valve1"
         VALVE2 = "valve2"
@@ -119,14 +131,97 @@ class module_steppervalvecontrol:
             GPIO.setup(self._pin_enable[valve], GPIO.OUT)
             GPIO.output(self._pin_enable[valve], GPIO.LOW)
 
-        # home all valves
-        for valve in self._valve_list:
-            self._logger.info("Homing {}".format(valve))
-            self.home_motor(valve)
+        # restore valve positions from the journal if the last shutdown was clean,
+        # otherwise home all valves
+        if self._restore_positions():
+            for valve in self._valve_list:
+                self._verify_position(valve)
+        else:
+            for valve in self._valve_list:
+                self._logger.info("Homing {}".format(valve))
+                self.home_motor(valve)
+
+        # positions are only trusted after a clean shutdown, so mark the journal as
+        # dirty until shutdown() is called.
+        self._write_journal(clean_shutdown=False)
 
         # add cleanup method
         atexit.register(self.cleanup)
 
+    def _load_journal(self):
+        try:
+            with open(self.POSITION_JOURNAL_FILE, "r") as fp:
+                return json.load(fp)
+        except FileNotFoundError:
+            self._logger.info("No valve position journal found")
+        except Exception as error:
+            self._logger.warning("Failed to read valve position journal: {!r}".format(error))
+        return None
+
+    def _restore_positions(self):
+        """Load valve positions from the journal. Returns True if all positions could be
+        restored, which is only the case after a clean shutdown."""
+        journal = self._load_journal()
+        if not journal:
+            return False
+
+        if not journal.get("clean_shutdown"):
+            self._logger.info("Last shutdown was not clean, homing all valves")
+            return False
+
+        positions = journal.get("positions", {})
+        restored = {}
+        for valve in self._valve_list:
+            entry = positions.get(valve.value)
+            if entry is None:
+                self._logger.info("No journaled position for {}, homing all valves".format(valve))
+                return False
+            steps, pct = entry
+            if not (0 <= steps <= self._steps_per_full_swing) or not (self.STEPPER_POS_START <= pct <= self.STEPPER_POS_END):
+                self._logger.warning("Invalid journaled position for {}: {}".format(valve, entry))
+                return False
+            restored[valve] = (int(steps), pct)
+
+        for valve, (steps, pct) in restored.items():
+            self._current_position[valve] = steps
+            self._current_position_pct[valve] = pct
+            self._logger.info("Restored {} to journaled position {}%".format(valve, pct))
+
+        return True
+
+    def _verify_position(self, valve_name):
+        # A valve resting in the home position can be re-seated against the end stop
+        # with a short move. Valves in any other position are trusted as journaled.
+        if self._current_position[valve_name] == self._steps_per_full_swing:
+            self._mark_journal_dirty()
+            self._backwards(self.VERIFY_STEPS, valve_name)
+
+    def _write_journal(self, clean_shutdown):
+        """Atomically write current valve positions to the journal file."""
+        journal = {
+            "clean_shutdown": clean_shutdown,
+            "positions": {
+                valve.value: [self._current_position[valve], self._current_position_pct[valve]]
+                for valve in self._valve_list
+            },
+        }
+        tmp_file = self.POSITION_JOURNAL_FILE + ".tmp"
+        try:
+            with open(tmp_file, "w") as fp:
+                json.dump(journal, fp)
+                fp.flush()
+                os.fsync(fp.fileno())
+            os.replace(tmp_file, self.POSITION_JOURNAL_FILE)
+            self._journal_clean = clean_shutdown
+        except Exception as error:
+            self._logger.error("Failed to write valve position journal: {!r}".format(error))
+
+    def _mark_journal_dirty(self):
+        """Mark the journal dirty before a move, so a move interrupted after a clean
+        shutdown, eg. the emergency stop, can't restore a wrong position."""
+        if self._journal_clean:
+            self._write_journal(clean_shutdown=False)
+
     def _enable_motor(self, valve):
         if valve == self.ValveList.VALVE1:
             # print('Motor 1')
@@ -259,6 +354,7 @@ class module_steppervalvecontrol:
         GPIO.setup(self.coil_B_1_pin, GPIO.OUT)
         GPIO.setup(self.coil_B_2_pin, GPIO.OUT)
         self._motor_off()
+        self._write_journal(clean_shutdown=True)
 
     # method always runs on exit
     def cleanup(self):
@@ -267,6 +363,7 @@ class module_steppervalvecontrol:
 
     def home_motor(self, valve_name):
         self._check_valve(valve_name)
+        self._mark_journal_dirty()
 
         # reverse for defined number of steps
         self._backwards(self._home_steps, valve_name)
@@ -288,7 +385,9 @@ class module_steppervalvecontrol:
 
         if self._current_position[valve_name] == absolute_pos:
             return
-        elif self._current_position[valve_name] < absolute_pos:
+
+        self._mark_journal_dirty()
+        if self._current_position[valve_name] < absolute_pos:
             steps = absolute_pos - self._current_position[valve_name]
             self._backwards(steps, valve_name)
         else:
@@ -297,6 +396,7 @@ class module_steppervalvecontrol:
 
         self._current_position[valve_name] = absolute_pos
         self._current_position_pct[valve_name] = pos
+        self._write_journal(clean_shutdown=False)
 
         return
 
@@ -310,7 +410,9 @@ class module_steppervalvecontrol:
 
         if self._current_position[valve_name] == absolute_pos:
             return
-        elif self._current_position[valve_name] < absolute_pos:
+
+        self._mark_journal_dirty()
+        if self._current_position[valve_name] < absolute_pos:
             steps = absolute_pos - self._current_position[valve_name]
             self._backwardsFullStep(steps, valve_name)
         else:
@@ -319,10 +421,65 @@ class module_steppervalvecontrol:
 
         self._current_position[valve_name] = absolute_pos
         self._current_position_pct[valve_name] = pos
+        self._write_journal(clean_shutdown=False)
 
         return
 
 
+    def estimate_move_time(self, steps):
+        """Estimated time in seconds to move the given number of full steps"""
+        return steps * self.StepCountFullStep * self._fullstep_delay
+
+    def plan_moves(self, targets):
+        """Build a move plan from a sequence of (valve, position) targets.
+
+        Targets are applied in order, so a later target for a valve overrides an
+        earlier one. Moves that do not change the position of a valve are dropped.
+        The remaining moves are ordered with closing moves first, so no flow path is
+        opened before the others are shut, and shortest travel first within each group.
+
+        :param targets: iterable of (ValveList, position in pct) tuples
+        :return: list of (valve, position, absolute position, steps) tuples
+        """
+        final_targets = {}
+        for valve_name, pos in targets:
+            self._check_valve(valve_name)
+            self._check_position(pos)
+            # re-insert to keep the order of the latest request for the valve
+            final_targets.pop(valve_name, None)
+            final_targets[valve_name] = self._normalize_pos(pos)
+
+        plan = []
+        for valve_name, pos in final_targets.items():
+            absolute_pos = int(pos * module_steppervalvecontrol.STEPS_PER_FULL_SWING / 100)
+            steps = abs(absolute_pos - self._current_position[valve_name])
+            if steps == 0:
+                continue
+            plan.append((valve_name, pos, absolute_pos, steps))
+
+        # serial moves make the total travel independent of the order, so the order
+        # is chosen for safety: close before open, short moves first
+        plan.sort(key=lambda move: (move[2] > self._current_position[move[0]], move[3]))
+        return plan
+
+    def move_batch(self, targets):
+        """Move several valves to their target positions as one transaction.
+
+        :param targets: iterable of (ValveList, position in pct) tuples
+        :return: estimated time in seconds to complete the moves
+        """
+        plan = self.plan_moves(targets)
+        estimated_time = self.estimate_move_time(sum(move[3] for move in plan))
+        self._logger.debug(
+            "Valve batch: {} moves, estimated {:.02f}s".format(len(plan), estimated_time)
+        )
+
+        for valve_name, pos, _, _ in plan:
+            self.move_to_pos_fullstep(valve_name, pos)
+
+        return estimated_time
+
+
 if __name__ == "__main__":
     mycontrol = module_steppervalvecontrol(motor_5v=False, reverse_direction=True)
     valves = module_steppervalvecontrol.ValveList
@@ -0,0 +1,804 @@
+"""
+Hardware independent part of the control system for drizzle extractor. It holds the
+config, PID, valve and sensor logic that works on the component drivers, the drivers
+themselves are created by the subclass: module_HardwareControlSystem for the real
+machine and module_simulator for the headless simulation.
+"""
+if __name__ == "__main__":
+  #Add root folder (/src/) to paths for import if this script is run standalone
+  from pathlib import Path
+  import sys
+  sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+import os
+from pathlib import Path
+
+import hardware.module_math as math
+import hardware.components.PID as PID  # PID control module
+from hardware.module_thermalmodel import ThermalModel  # Heater model for feed-forward control
+from hardware.module_config import ConfigError, load_config  # Typed configuration
+from hardware.module_flowcontrol import FlowController, ValveModel  # PI control of the aspiration flow
+from hardware.module_FSM import Machine
+from hardware.module_FSM import FailureMode
+from common.settings import ALCOHOL_SENSOR_ENABLED
+from common import module_clock as clock
+
+
+INIT_STATUS_OK = 0
+INIT_STATUS_PRESSURE_SENSOR_ERROR = 1
+INIT_STATUS_VALVE_CONTROLLER_ERROR = 2
+INIT_STATUS_I2C_BUS_ERROR = 3
+INIT_STATUS_ADC_CHIP_ERROR = 4
+INIT_STATUS_THERMISTOR_ERROR = 5
+INIT_STATUS_USER_PANEL_ERROR = 6
+INIT_STATUS_ALCOHOL_SENSOR_ERROR = 7
+
+
+class HardwareFailure(Exception):
+    """Raise when hardware failure encointered."""
+
+class ElectricalError(HardwareFailure):
+    """Raise when there is a problem with i2c or other electrical error."""
+
+class UserPanelError(HardwareFailure):
+    """Raise when there is a problem with user panel."""
+
+class PressureSensorFailure(HardwareFailure):
+    """Raise when problem with pressure sensor detected."""
+
+
+class module_ControlSystemBase(Machine):
+    """
+    Base class of the control systems. Subclasses create the component drivers before
+    the FSM: _valve_controller, _myvalves, _valves, _mythermistors, _mypressuresensor,
+    _mybottomheater, _mypump, _fan_control, _my_rgbw_light and _myphysicalinterface.
+    """
+
+    ENTRIES_IN_FLOW_ADJUST_DATA = 10
+    CONFIG_FILE = "config.ini"
+
+    MAX_PRESSURE_CHECK_TIME_SECONDS = 30
+
+    #Limiter for the PID algorithm
+    MAX_PID_POWER_OUTPUT = 65
+
+    # Preheat is stopped when the plate gets this much above the preheat setpoint
+    PREHEAT_OVERSHOOT_LIMIT = 10
+    _preheat_running = False
+    # config section versions the derived data was built from
+    _derived_config_versions = None
+
+    def update_config(self):
+        config_file = Path(self.CONFIG_FILE)
+
+        # only execute if file exists
+        if config_file.is_file():
+            try:
+                # get time since last change
+                config_file_change = os.path.getmtime(
+                    self.CONFIG_FILE
+                )
+
+                if self._last_config_change != config_file_change:
+                    self._logger.info("Config was changed, reloading...")
+                    # reload config
+                    self.init_config()
+            except Exception:
+                self._logger.exception("config not loaded yet")
+
+    # Change a setting in both the raw and the typed config, the file is only written by store_config
+    def set_config_value(self, section, key, value):
+        self._config[section][key] = self.config.set(section, key, value)
+
+    def store_config(self):
+        # write config to file
+        with open(self.CONFIG_FILE, "w") as configfile:
+            self._config.write(configfile)
+
+    # Control exposure of the RGBW light
+    def light_warm(self):
+        self._my_rgbw_light.light_warm()
+
+    def light_off(self):
+        self._my_rgbw_light.light_off()
+
+    def light_red(self):
+        self._my_rgbw_light.light_red()
+
+    def toggle_red_light(self):
+        self._myphysicalinterface.toggle_reg_light()
+
+    def toggle_light(self):
+        self._my_rgbw_light.toggle_white_light()
+
+    def do_fast_blink(self):
+        for _ in range(0, 30):
+            self.light_off()
+            clock.sleep(0.1)
+            self.light_warm()
+            clock.sleep(0.1)
+        self.light_off()
+
+    def do_slow_blink(self):
+        for _ in range(0, 10):
+            self.light_off()
+            clock.sleep(0.3)
+            self.light_warm()
+            clock.sleep(0.7)
+        self.light_off()
+
+    def show_error_code_in_display(self):
+        # use the program indicators to show the error mode the machine is in
+        myfailuremode = self.FSM.fsmData["failure_mode"]
+        self._logger.debug("Failure mode is: {}".format(myfailuremode))
+        if not self._myphysicalinterface:
+            return
+        self._myphysicalinterface.set_error_indicator(False, False, False, False)
+        if myfailuremode == FailureMode.NONE:
+            self._myphysicalinterface.set_error_indicator(False, False, False, False)
+            self._logger.debug("No error, but still in error mode")
+        elif myfailuremode == FailureMode.EVC_LEAK:
+            self._myphysicalinterface.set_error_indicator(True, False, False, False)
+            self._logger.debug(
+                "Error, Leak in distillation chamber"
+            )
+        elif myfailuremode == FailureMode.EXC_LEAK:
+            self._myphysicalinterface.set_error_indicator(False, True, False, False)
+            self._logger.debug(
+                "Error, Leak in extraction chamber"
+            )
+        elif myfailuremode == FailureMode.ALCOHOL_GASLEVEL_ERROR:
+            self._myphysicalinterface.set_error_indicator(False, False, True, False)
+            self._logger.debug(
+                "Error, IPA gas level too high"
+            )
+        elif myfailuremode == FailureMode.VALVE_3_BLOCKED:
+            self._myphysicalinterface.set_error_indicator(False, False, False, True)
+            self._logger.debug(
+                "Error, Valve 3 blocked (Extractor -> Distiller)"
+            )
+        elif myfailuremode == FailureMode.HEATER_ERROR:
+            self._myphysicalinterface.set_error_indicator(True, True, False, False)
+            self._logger.debug(
+                "Error, Heater or heater cable defective"
+            )
+        elif myfailuremode == FailureMode.PUMP_NEEDS_CLEAN_OR_REPLACEMENT:
+            self._myphysicalinterface.set_error_indicator(True, False, True, False)
+            self._logger.debug(
+                "Error, Pump needs cleaning or replacement"
+            )
+        elif myfailuremode == FailureMode.VALVE_2_BLOCKED:
+            self._myphysicalinterface.set_error_indicator(False, True, True, False)
+            self._logger.debug(
+                "Error, Valve 2 blocked (Air -> Extraction)"
+            )
+        elif myfailuremode == FailureMode.VALVE_4_BLOCKED:
+            self._myphysicalinterface.set_error_indicator(False, False, True, True)
+            self._logger.debug("Error, Valve 4 blocked (Air -> Distiller)")
+
+        elif myfailuremode == FailureMode.VALVE_1_OR_VALVE_3_BLOCKED:
+            self._myphysicalinterface.set_error_indicator(True, False, False, True)
+            self._logger.debug(
+                "Error, Valve 1 or valve 3 is blocked, difficult aspirating alcohol"
+            )
+        elif myfailuremode == FailureMode.FAN_ERROR:
+            self._myphysicalinterface.set_error_indicator(False, True, False, True)
+            self._logger.debug(
+                "Error, Fan error"
+            )
+        elif myfailuremode == FailureMode.PRESSURE_SENSOR_ERROR:
+            self._myphysicalinterface.set_error_indicator(False, True, True, True)
+            self._logger.debug(
+                "Error, Pressure sensor error"
+            )
+
+        elif myfailuremode == FailureMode.UNKNOWN_ERROR:
+            self._myphysicalinterface.set_error_indicator(True, True, True, True)
+            self._logger.debug("Error, Unknown error")
+
+    def init_FSM(self):
+        self.FSM.init_FSM()
+
+    def init_config(self):
+        # Fetch config file, self._config holds the raw settings as written to the file
+        # and self.config the typed settings compiled from it
+        previous = getattr(self, "config", None)
+        try:
+            self._config, self.config = load_config(self.CONFIG_FILE, previous)
+        except ConfigError:
+            # an invalid file is never run or stored, on a reload the previous settings are kept
+            if previous is None:
+                raise
+            self._logger.exception("Config not reloaded, keeping config version {}".format(previous.version))
+            self._last_config_change = os.path.getmtime(self.CONFIG_FILE)
+            return
+        self._logger.info("Loaded config version {}".format(self.config.version))
+        self.store_config()
+
+        # store last change time
+        self._last_config_change = os.path.getmtime(
+            self.CONFIG_FILE
+        )
+
+        # flow adjustment table, PID settings and heater model
+        self.update_derived_config()
+
+    # Rebuild the data derived from a config section, only when the section version has changed since it was built
+    def update_derived_config(self):
+        if self._derived_config_versions is None:
+            self._derived_config_versions = {}
+
+        for section, build in (
+            ("FLOW_ADJ", self.process_flow_adjustment_input),
+            ("PID", self._load_PID_settings),
+            ("HEATER_MODEL", self._load_heater_model),
+        ):
+            version = self.config.versions[section]
+            if self._derived_config_versions.get(section) != version:
+                build()
+                self._derived_config_versions[section] = version
+
+    # Compile the flow adjustment stages into a sorted table once per config load
+    def process_flow_adjustment_input(self):
+        settings = self.config.FLOW_ADJ
+        self._flow_adj_table = math.compile_flow_adjustment_table(
+            (
+                getattr(settings, "pct_stage_{}".format(i)),
+                getattr(settings, "step_size_stage_{}".format(i)),
+                getattr(settings, "step_period_stage_{}".format(i)),
+            )
+            for i in range(1, self.ENTRIES_IN_FLOW_ADJUST_DATA + 1)
+        )
+
+    # Method returns desired step size and period based on the actual flow error
+    def get_step_and_period(self, error):
+        return list(math.get_step_and_period(self._flow_adj_table, error))
+
+    # PI controller for the aspiration flow, None when the FLOW_ADJ table is used
+    def get_flow_controller(self, target, initial_position):
+        settings = self.config.FLOW_PI
+        if not settings.enabled:
+            return None
+        return FlowController(
+            ValveModel(settings.valve_dead_band, settings.valve_exponent),
+            Kp=settings.kp,
+            Ki=settings.ki,
+            target=target,
+            initial_position=initial_position,
+            max_step=settings.max_step,
+        )
+
+    # Sequential leak test against max_pressure_loss_evc, None when the fixed leak windows are used
+    def get_leak_test(self):
+        settings = self.config.FSM_EX
+        if not settings.leak_test_sequential:
+            return None
+        return math.SequentialLeakTest(
+            settings.max_pressure_loss_evc,
+            pass_fraction=settings.leak_test_pass_fraction,
+            alpha=settings.leak_test_alpha,
+            beta=settings.leak_test_beta,
+            noise=settings.leak_test_noise,
+        )
+
+    # Exponential pump-down model towards target, None when the pressure is only compared to the target
+    def get_pump_down_model(self, target):
+        settings = self.config.FSM_EX
+        if not settings.pump_down_model:
+            return None
+        return math.PumpDownModel(
+            target,
+            interval=settings.pump_down_sample_interval,
+            forgetting=settings.pump_down_forgetting,
+        )
+
+    # CUSUM detectors of the end of the bulk boil-off for heater power, pressure and plate temperature, None when
+    # only the power window average is compared to wattage_decrease_limit
+    def get_distill_change_detectors(self):
+        settings = self.config.FSM_EV
+        if not settings.distill_change_point:
+            return None
+        return tuple(
+            math.Cusum(
+                noise,
+                direction=direction,
+                drift=settings.distill_change_point_drift,
+                threshold=settings.distill_change_point_threshold,
+                reference_filter=settings.distill_change_point_reference_filter,
+            )
+            for noise, direction in (
+                (settings.distill_power_noise, -1),
+                (settings.distill_pressure_noise, -1),
+                (settings.distill_temperature_noise, 1),
+            )
+        )
+
+    # True when a pump-down that started at start_time is predicted to miss max_time. Without max_time, for
+    # pump-downs that have no time limit, only when the pressure has been predicted not to reach the target for
+    # pump_down_stall_confirm_time seconds.
+    def is_pump_down_stalled(self, pump_down, start_time, max_time=None):
+        elapsed_time = clock.time() - start_time
+        if elapsed_time < self.config.FSM_EX.pump_down_stall_time:
+            return False
+        if max_time is None:
+            return pump_down.is_unreachable(self.config.FSM_EX.pump_down_stall_confirm_time)
+        return pump_down.is_stalled(elapsed_time, max_time)
+
+    # Waits until predicate returns True, but at least min_time and at most max_time seconds, returns the seconds
+    # waited. The time saved against max_time is added to the wait_time_saved of the run. Without condition waits
+    # the whole max_time is waited.
+    def wait_until(self, predicate, min_time, max_time, interval=None):
+        settings = self.config.SYSTEM
+        if not settings.condition_waits:
+            clock.sleep(max_time)
+            return max_time
+
+        interval = settings.settle_sample_interval if interval is None else interval
+        start_time = clock.time()
+        clock.sleep(min_time)
+        while not predicate():
+            remaining_time = max_time - (clock.time() - start_time)
+            if remaining_time <= 0:
+                break
+            clock.sleep(min(interval, remaining_time))
+
+        waited_time = clock.time() - start_time
+        self.FSM.fsmData["wait_time_saved"] += max(0, max_time - waited_time)
+        return waited_time
+
+    # Predicate for wait_until, True once the pressure slope over the last settle_window_seconds is below max_rate
+    # mbar/s, settle_pressure_rate by default
+    def pressure_settled(self, max_rate=None):
+        settings = self.config.SYSTEM
+        max_rate = settings.settle_pressure_rate if max_rate is None else max_rate
+        window = math.SlidingWindow(settings.settle_window_seconds)
+        start_time = clock.time()
+
+        def settled():
+            now = clock.time()
+            window.add(now, self.pressure)
+            if now - start_time < settings.settle_window_seconds:
+                return False
+            slope = window.slope
+            return slope is not None and abs(slope) <= max_rate
+
+        return settled
+
+    # Predicate for wait_until, True once the fan draws its running current or the fan can't be checked
+    def fan_running(self):
+        status = self._fan_control.fan_adc_check
+        return status is None or status == self._fan_control.FAN_ADC_LEVEL_ON
+
+    # Step sizes and periods for an array of flow errors, used for offline tuning
+    def get_steps_and_periods(self, errors):
+        return math.get_steps_and_periods(self._flow_adj_table, errors)
+
+    # Conversion between the measured air volume and the required air displacement volume to fill the EXC
+    def convert_air_volume_to_plant_and_liquid_volume(self, air_volume):
+        air_volume_calib_data = self.config.FSM_EX.calculated_exc_volume_calibration_data
+        actual_volume_calib_data = self.config.FSM_EX.calculated_aspirated_volume_calibration_data
+
+        return math.convert_air_volume_to_plant_and_liquid_volume(
+            air_volume_calib_data, actual_volume_calib_data, air_volume
+        )
+
+    # Sets the bottom heaters heating target
+    def set_PID_target(self, value):
+        self._PID.setpoint = value
+
+    # Turns PID heater control on
+    def PID_on(self, pid_max_output_limit=MAX_PID_POWER_OUTPUT):
+        self.reload_PID(pid_max_output_limit=pid_max_output_limit)
+        self._PID.reset()
+        self._heatup_plan_key = None
+        self._preheat_running = False
+        self._PID.PID_running = True
+        self._logger.info("PID on")
+
+    # Turns PID heater control off
+    def PID_off(self, pid_max_output_limit=MAX_PID_POWER_OUTPUT):
+        self.reload_PID(pid_max_output_limit=pid_max_output_limit)
+        self._PID.reset()
+        self._heatup_plan_key = None
+        self._preheat_running = False
+        self._PID.setpoint = 0
+        self._PID.PID_running = False
+        self._logger.info("PID off")
+
+    # Changes the PID output limit while it is running, integral term and power window are kept
+    def set_PID_output_limit(self, pid_max_output_limit):
+        self._PID.output_limits = (0, pid_max_output_limit)
+
+    @property
+    def preheat_running(self):
+        return self._preheat_running
+
+    # Starts heating the plate towards the preheat setpoint while the extraction is still running, with the
+    # output limited to preheat_max_output. The PID is restarted when the distillation takes over.
+    def preheat_on(self):
+        settings = self.config.FSM_EV
+        self.PID_on(pid_max_output_limit=min(settings.preheat_max_output, self.MAX_PID_POWER_OUTPUT))
+        self.set_PID_target(min(settings.preheat_temperature, settings.distillation_temperature))
+        self._preheat_running = True
+        self._logger.info(
+            "Preheat on, target {:.1f}, max output {:.0f}%".format(self._PID.setpoint, self._PID.output_limits[1])
+        )
+
+    # Stops the preheat and turns the heater off
+    def preheat_off(self, reason=None):
+        if not self._preheat_running:
+            return
+        self.PID_off()
+        self.bottom_heater_percent = 0
+        self._logger.info("Preheat off{}".format(": " + reason if reason else ""))
+
+    # Runs the preheat PID. The interlocks are checked every time the PID updates, when one trips the
+    # heater stays off until the next preheat_on. Returns True while preheating.
+    def update_preheat(self):
+        if not self._preheat_running:
+            return False
+
+        if not self.update_PID(log=False):
+            return True
+
+        settings = self.config.FSM_EV
+        temperature = self.bottom_temperature
+        pressure = self.pressure
+        if not settings.min_temp <= temperature <= settings.max_temp:
+            self.preheat_off("temperature {:.1f} is out of range".format(temperature))
+        elif temperature > self._PID.setpoint + self.PREHEAT_OVERSHOOT_LIMIT:
+            self.preheat_off("temperature {:.1f} is above the preheat target".format(temperature))
+        elif pressure < settings.preheat_min_pressure:
+            # the solvent in the distiller would boil and spoil the pressure based volume measurement
+            self.preheat_off("pressure {:.1f} mbar is below the preheat limit".format(pressure))
+
+        return self._preheat_running
+
+    # Returns the feed-forward output and reference temperature of the heat-up plan. A new plan
+    # is made when the setpoint or output limit changes. At or above the setpoint the plan holds
+    # the steady state output of the setpoint right away, so a new output limit during the hold
+    # does not drop the feed-forward.
+    def _get_feed_forward(self, temperature):
+        if self._heater_model is None:
+            return 0, None
+
+        setpoint = self._PID.setpoint
+        max_output = self._PID.output_limits[1]
+        if self._heatup_plan_key != (setpoint, max_output):
+            self._heatup_plan_key = (setpoint, max_output)
+            self._heatup_plan = self._heater_model.plan(temperature, setpoint, max_output)
+            self._heatup_plan_start_time = clock.time()
+            self._logger.info(
+                "Heat-up plan to {:.1f}: full power for {:.0f}s, then {:.1f}%".format(
+                    setpoint, self._heatup_plan.switch_time, self._heatup_plan.hold_output
+                )
+            )
+
+        elapsed = clock.time() - self._heatup_plan_start_time
+        return self._heatup_plan.output(elapsed), self._heatup_plan.reference(elapsed)
+
+    # PID Function that updates the heating value based on the current target
+    def update_PID(self, log=True):
+        temperature = self.bottom_temperature
+        feed_forward, reference = self._get_feed_forward(temperature)
+
+        # invoke PID controller
+        (output, did_run) = self._PID.__call__(temperature, feed_forward=feed_forward, reference=reference)
+        (Kp, Ki, Kd) = self._PID.components
+        self.bottom_heater_percent = output
+
+        # only log when PID controller updates, every update when the samples are logged for fitting the heater model
+        if did_run:
+            status_due = log and (
+                not self._pid_last_log_time or ((clock.time() - self._pid_last_log_time) > self._pid_status_log_interval)
+            )
+            if status_due or self.config.HEATER_MODEL.log_samples:
+                self._logger.info(
+                    "PID: Kp: {:.02f}; Ki: {:.02f}; Kd: {:.02f}; output: {:.02f}; current temperature: {:.02f}; target: {:.02f}".format(
+                        Kp, Ki, Kd, output, self.bottom_temperature, self._PID.setpoint
+                    )
+                )
+                self._pid_last_log_time = clock.time()
+
+        return did_run
+
+    # Store new PID gains in the config file and apply them to the PID
+    def store_PID_gains(self, Kp, Ki, Kd):
+        self.set_config_value("PID", "Pterm", "{:.4f}".format(Kp))
+        self.set_config_value("PID", "Iterm", "{:.4f}".format(Ki))
+        self.set_config_value("PID", "Dterm", "{:.4f}".format(Kd))
+        self.store_config()
+        self._last_config_change = os.path.getmtime(self.CONFIG_FILE)
+
+        self.update_derived_config()
+        self._PID.retune(Kp=self._PID_settings["Kp"], Ki=self._PID_settings["Ki"], Kd=self._PID_settings["Kd"])
+        self._logger.info("Stored PID gains Kp: {:.4f}; Ki: {:.4f}; Kd: {:.4f}".format(Kp, Ki, Kd))
+
+    # Load the heater model used for feed-forward control, None when disabled
+    def _load_heater_model(self):
+        self._heater_model = None
+        self._heatup_plan = None
+        self._heatup_plan_key = None
+
+        settings = self.config.HEATER_MODEL
+        if settings.enabled:
+            self._heater_model = ThermalModel(
+                gain=settings.gain,
+                time_constant=settings.time_constant,
+                dead_time=settings.dead_time,
+                ambient=settings.ambient,
+            )
+
+    # Parse the PID settings once per config load
+    def _load_PID_settings(self):
+        self._PID_settings = {
+            "Kp": self.config.PID.pterm,
+            "Ki": self.config.PID.iterm,
+            "Kd": self.config.PID.dterm,
+            "sample_time": self.config.PID.sample_time,
+            "sample_initial_delay": self.config.PID.initial_window_delay,
+            "current_window_size": self.config.PID.current_window,
+        }
+
+    # Refresh PID parameters based on input from the config file. Gains and output limit are
+    # changed in place, the PID is only rebuilt when the power window settings have changed.
+    def reload_PID(self, pid_max_output_limit=MAX_PID_POWER_OUTPUT):
+        settings = self._PID_settings
+        if (
+            getattr(self, "_PID", None) is not None
+            and self._PID.sample_initial_delay == settings["sample_initial_delay"]
+            and self._PID.current_window_size == settings["current_window_size"]
+        ):
+            self._PID.sample_time = settings["sample_time"]
+            self._PID.retune(
+                Kp=settings["Kp"],
+                Ki=settings["Ki"],
+                Kd=settings["Kd"],
+                output_limits=(0, pid_max_output_limit),
+            )
+            return
+
+        # init PID
+        self._PID = PID.PID(
+            Kp=settings["Kp"],
+            Ki=settings["Ki"],
+            Kd=settings["Kd"],
+            sample_time=settings["sample_time"],
+            output_limits=(0, pid_max_output_limit),
+            sample_initial_delay=settings["sample_initial_delay"],
+            current_window_size=settings["current_window_size"],
+        )
+
+    ###---===HARDWARE INTERFACING METHODS===---###
+
+    # thermistor interfacing - read all thermistor values
+    @property
+    def thermistor_status(self):
+        #try:
+        return self._mythermistors.get_all_temperatures
+        #except Exception:
+            #raise HardwareFailure("Can't read temperature")
+
+    # Valve interfacing - get all valve settings
+    @property
+    def valve_status(self):
+        myvalves = {
+            valve.value: self._valve_controller.get_valve_position(valve)
+            for valve in self._myvalves
+        }
+
+        return myvalves
+
+    def _get_valve(self, valve):
+        if isinstance(valve, str):
+            if not hasattr(self._valves, valve.upper()):
+                raise AttributeError(
+                    "Error, valve dict does not have a valve with the name: {}".format(
+                        valve
+                    )
+                )
+
+            valve = self._valves[valve.upper()]
+
+        return valve
+
+    # Valve interfacing - set valve position
+    def set_valve(self, valve, position):
+        # set the valve
+        self._valve_controller.move_to_pos_fullstep(self._get_valve(valve), position)
+
+    # Valve interfacing - set several valve positions in one batch. Superseded and no-op
+    # moves are dropped, returns the estimated time to complete the moves.
+    def set_valves(self, targets):
+        if isinstance(targets, dict):
+            targets = targets.items()
+
+        return self._valve_controller.move_batch(
+            [(self._get_valve(valve), position) for valve, position in targets]
+        )
+
+    # Estimated time in seconds for set_valves to complete the moves to targets
+    def estimate_valve_move_time(self, targets):
+        if isinstance(targets, dict):
+            targets = targets.items()
+
+        steps_per_pct = self._valve_controller.STEPS_PER_FULL_SWING / 100
+        steps = sum(
+            abs(position - self._valve_controller.get_valve_position(self._get_valve(valve))) * steps_per_pct
+            for valve, position in dict(targets).items()
+        )
+        return self._valve_controller.estimate_move_time(steps)
+
+    #Sets valve in a position ok for switching off machine
+    def set_valves_in_relax_position(self):
+        return self.set_valves(
+            [("valve1", 0), ("valve4", 100), ("valve3", 100), ("valve2", 100)]
+        )
+
+
+    def set_alcohol_sensor_on(self):
+        if ALCOHOL_SENSOR_ENABLED:
+            self._myalcoholsensor.heater_on()
+            self._logger.info("Alcohol sensor on")
+        else:
+            self._logger.info("Alcohol sensor is disabled")
+
+    def set_alcohol_sensor_off(self):
+        if ALCOHOL_SENSOR_ENABLED:
+            self._myalcoholsensor.heater_off()
+            self._logger.info("Alcohol sensor off")
+        else:
+            self._logger.info("Alcohol sensor is disabled")
+
+    @property
+    def alcohol_level(self):
+        try:
+            return self._myalcoholsensor.get_alcohol_level()
+        except Exception:
+            raise HardwareFailure("Can't read alcohol level.")
+
+    @property
+    def alcohol_level_raw(self):
+        return self._myalcoholsensor.get_raw_alcohol_level
+
+    @property
+    def selected_program(self):
+        return self._selected_program
+
+    @selected_program.setter
+    def selected_program(self, value):
+        self._selected_program = value
+        self._myphysicalinterface.set_state(self._selected_program)
+
+    @property
+    def button_press(self):
+        if self._myphysicalinterface:
+            return self._myphysicalinterface.button_pressed
+
+    @property
+    def button_press_force(self):
+        if self._myphysicalinterface:
+            return self._myphysicalinterface.button_pressed_force
+
+    @property
+    def gas_temperature(self):
+        return self._mypressuresensor.temperature
+
+    @property
+    def exc_volume(self):
+        return self._exc_volume  # TODO: There is no such attribute in this class.
+
+    @property
+    def bottom_temperature(self):
+        try:
+            return self._mythermistors.get_temperature("thermistor0")
+        except Exception:
+            raise HardwareFailure("Can't read temperature.")
+
+    @property
+    def fan_ADC_value(self):
+        return 0
+
+    @property
+    def fan_value(self):
+        return self._fan_control.fan_pwm
+
+    @fan_value.setter
+    def fan_value(self, value):
+        self._fan_control.fan_pwm = value
+
+    @property
+    def bottom_heater_percent(self):
+        return self._mybottomheater.power_percent
+
+    @bottom_heater_percent.setter
+    def bottom_heater_percent(self, value):
+        self._mybottomheater.power_percent = value
+
+    @property
+    def bottom_heater_power(self):
+        return self._mybottomheater.wattage
+
+    @bottom_heater_power.setter
+    def bottom_heater_power(self, value):
+        self._mybottomheater.wattage = value
+
+    @property
+    def pump_value(self):
+        return self._mypump.pump_pwm
+
+    @pump_value.setter
+    def pump_value(self, value):
+        self._mypump.pump_pwm = value
+
+    @property
+    def pressure(self):
+        if self.init_status != INIT_STATUS_OK:
+            raise PressureSensorFailure("Failed to read pressure sensor")
+
+        self._end_timer = clock.monotonic()
+
+        if self._first_run:
+            # setup variables for detectic pressure changes as function of time
+            self._logger.debug("starting time measurement")
+            self._first_run = False
+            self._start_timer = clock.monotonic()
+
+            # fetch current pressure
+            self._current_pressure = self._mypressuresensor.pressure
+            self._last_pressure = self._current_pressure
+            return self._current_pressure
+
+        # fetch current pressure
+        _start_time = clock.time()
+        while (clock.time() - _start_time) < self.MAX_PRESSURE_CHECK_TIME_SECONDS:
+            try:
+                self._current_pressure = self._mypressuresensor.pressure
+                break
+            except Exception:
+                self._logger.error("Failed to read pressure sensor. Retrying...")
+        else:
+            raise PressureSensorFailure("Failed to read pressure sensor")
+        #log temperature of sensor
+        #self._logger.debug('Pressure sensor temperature: {} C'.format(self._mypressuresensor.temperature))
+
+        # calculate time since last measurement
+        if ((self._end_timer - self._start_timer) * 1000) > self.config.SYSTEM.pressure_slope_sample_time:
+            # calculate elapsed time
+            self._time_elapsed = self._end_timer - self._start_timer
+            # and pressure difference in that time
+            self._pressure_diff = self._current_pressure - self._last_pressure
+
+            # restart time measurement
+            self._start_timer = clock.monotonic()
+            # store pressure measurement for later use
+            self._last_pressure = self._current_pressure
+
+        return self._current_pressure
+
+    @property
+    def pressure_slope(self):
+        pressure_slope = 0
+
+        try:
+            math.get_pressure_slope(self._pressure_diff, self._time_elapsed)
+        except Exception:
+            pressure_slope = 0
+
+        return pressure_slope
+
+    ###---===SIMPLE HARDWARE MACROS===---###
+
+    # Method drains the liquid backwards out of the EXC
+    def drain_system(self):
+        return self.set_valves(
+            [
+                ("valve1", 0),
+                ("valve2", 0),
+                ("valve4", 100),
+                ("valve3", 100),
+                ("valve1", 100),  # TODO: is this ok?
+            ]
+        )
+
+
@@ -5,13 +5,12 @@ if __name__ == "__main__":
   sys.path.append(str(Path(__file__).resolve().parent.parent))
   print(sys.path)
 
-import time
 import enum
 import hardware.module_math as math
+from hardware.module_autotune import RelayAutotuner, AutotuneError
+from common import module_clock as clock
 from common.module_logging import get_app_logger
 
-from hardware.components.module_fancontrol import NotSupportedFanError
-from hardware.components.module_fancontrol import module_fancontrol
 from common.settings import ALCOHOL_SENSOR_ENABLED
 
 if ALCOHOL_SENSOR_ENABLED:
@@ -36,6 +35,42 @@ class FailureMode(enum.Enum):
     UNKNOWN_ERROR = 15
 
 
+# State definitions, the value is the state name used by FSM.SetState
+class StateId(enum.Enum):
+    ERROR = "stateError"
+    READY = "stateReady"
+    SYSTEM_CHECK = "stateSystemCheck"
+    PRE_FILL_TUBES = "statePreFillTubes"
+    FIRST_DEPRESSURIZE = "stateFirstDepressurize"
+    MEASURE_EXC_VOLUME = "stateMeasureEXCVolume"
+    SECOND_DEPRESSURIZE = "stateSecondDepressurize"
+    SECOND_LEAK_CHECK = "stateSecondLeakCheck"
+    TOP_UP_EXC = "stateTopUpEXC"
+    SOAK = "stateSoak"
+    THIRD_DEPRESSURIZE = "stateThirdDepressurize"
+    ASPIRATE = "stateAspirate"
+    FLUSH = "stateFlush"
+    EXTRA_FLUSH_DEPRESSURIZE = "stateExtraFlushDepressurize"
+    DISTILL_BULK = "stateDistillBulk"
+    AFTER_DISTILL = "stateAfterDistill"
+    FINAL_SOLVENT_REMOVAL = "stateFinalSolventRemoval"
+    DECARB = "stateDecarb"
+    AUTOTUNE = "stateAutotune"
+    COOLDOWN = "stateCooldown"
+    MIX_OIL = "stateMixOil"
+    VENT_PUMP = "stateVentPump"
+    CLEAN_PUMP = "stateCleanPump"
+
+    @property
+    def transition(self):
+        """Name of the transition to this state, eg. toStateReady"""
+        return "to" + self.value[0].upper() + self.value[1:]
+
+
+class InvalidTransitionError(Exception):
+    """Raise when a transition is not an edge of the state graph."""
+
+
 # Base type for machine object
 Machine = type("Machine", (object,), {"day": 0})
 
@@ -47,7 +82,9 @@ Machine = type("Machine", (object,), {"day": 0})
 ##TRANSITION CLASS, used to move from one state to another
 class Transition(object):
     def __init__(self, toState):
-        self.toState = toState
+        # toState may be a StateId or its state name
+        self.toStateId = StateId(toState)
+        self.toState = self.toStateId.value
 
     def Execute(self):
         pass
@@ -74,14 +111,14 @@ class State(object):
 
     def Enter(self):
         self._logger.info("*** Enter ***")
-        self.startTime = time.time()
+        self.startTime = clock.time()
         self.eventDuration = 0
         self.eventDurationWithPause = 0.0
         self._eventTimePreviousMeasurement = self.startTime
         self.warning = None
 
     def Execute(self):
-        now = time.time()
+        now = clock.time()
         self.eventDuration = now - self.startTime
         delta = 0.0
         if not self.onPause:
@@ -90,6 +127,46 @@ class State(object):
         self._eventTimePreviousMeasurement = now
         self.eventDurationWithPause += delta
 
+    # Adds a pressure reading to a sequential leak test, at most one per leak_test_sample_interval.
+    # Returns True on a leak, False on a tight system and None while the readings are inconclusive.
+    def sample_leak_test(self, leak_test, allow_fail=True):
+        now = clock.time()
+        interval = self.FSM.machine.config.FSM_EX.leak_test_sample_interval
+        if leak_test.last_sample_time is None or now - leak_test.last_sample_time >= interval:
+            leak_test.add(now, self.FSM.machine.pressure)
+        return leak_test.decide(allow_fail)
+
+    # Adds a pressure reading to a pump-down model and updates the time left with its prediction. Returns True
+    # when the pump-down that started at start_time is predicted to miss max_time, or without max_time, to never
+    # reach the target.
+    def update_pump_down(self, pump_down, pressure, start_time, max_time=None):
+        pump_down.add(clock.time(), pressure)
+        time_to_target = pump_down.time_to_target()
+        if time_to_target is None or time_to_target == float("inf"):
+            self.estimatedTimeLeftSeconds = None
+        else:
+            self.estimatedTimeLeftSeconds = time_to_target
+
+        if not self.FSM.machine.is_pump_down_stalled(pump_down, start_time, max_time):
+            return False
+        self._logger.warning(
+            "Pump-down stalled at {:.02f} mbar, fitted end pressure is {} mbar".format(
+                pressure, pump_down.end_pressure
+            )
+        )
+        return True
+
+    # Go to error state when a depressurization won't reach maximum_vacuum_pressure
+    def fail_pump_down(self):
+        self._logger.error(
+            "Error, pump-down stalled, will not reach required vacuum of {} mbar".format(
+                self.FSM.machine.config.FSM_EX.maximum_vacuum_pressure,
+            )
+        )
+        self.FSM.ToTransistion(StateId.ERROR)
+        self.FSM.fsmData["failure_mode"] = FailureMode.PUMP_NEEDS_CLEAN_OR_REPLACEMENT
+        self.FSM.fsmData["failure_description"] = "Pump seems to be dirty or damaged. Please run the extended cleaning, as described in the manual, and check our knowledgebase online for further tips."
+
     def Exit(self):
         self._logger.info("*** Exit ***")
         self.warning = None
@@ -114,7 +191,7 @@ class StateError(State):
 
         # error state indication
         self._blink_interval = 0.5
-        self._blink_time = time.time()
+        self._blink_time = clock.time()
 
         # show error in display
         self.FSM.machine.show_error_code_in_display()
@@ -123,9 +200,9 @@ class StateError(State):
         super(StateError, self).Execute()
         self.FSM.FSMOutputText = "System error - please reset system!"
         # blink red light
-        if (time.time() - self._blink_time) > self._blink_interval:
+        if (clock.time() - self._blink_time) > self._blink_interval:
             self.FSM.machine.toggle_red_light()
-            self._blink_time = time.time()
+            self._blink_time = clock.time()
 
     def Exit(self):
         super(StateError, self).Exit()
@@ -161,10 +238,12 @@ class StateReady(State):
         if self.FSM.fsmData["start_flag"]:
             # got start signal - start FSM
             self.FSM.fsmData["start_flag"] = False
-            self.FSM.ToTransistion("toStateSystemCheck")
+            self.FSM.ToTransistion(StateId.SYSTEM_CHECK)
 
     def Exit(self):
         super(StateReady, self).Exit()
+        # a program starts
+        self.FSM.fsmData["wait_time_saved"] = 0
 
 
 # System Check State
@@ -172,11 +251,11 @@ class StateSystemCheck(State):
     def check_fan_is_on(self):
         status = self.FSM.machine._fan_control.fan_adc_check
         self._logger.info("Checking fan status... Fan status is {}".format(status))
-        if status == module_fancontrol.FAN_ADC_LEVEL_ON:
+        if status == self.FSM.machine._fan_control.FAN_ADC_LEVEL_ON:
             self._fan_ok = True
         elif status is not None:
             self.FSM.fsmData["failure_mode"] = FailureMode.FAN_ERROR
-            self.FSM.ToTransistion("toStateError")
+            self.FSM.ToTransistion(StateId.ERROR)
             self.FSM.fsmData["failure_description"] = (
                 "Error, air fan seems to be defective. Please try again and if it still fails, contact "
                 "drizzle support."
@@ -188,6 +267,12 @@ class StateSystemCheck(State):
     def __init__(self, FSM):
         super(StateSystemCheck, self).__init__(FSM)
 
+    # Leak rate in mbar/s since start_pressure was read, the fitted slope of the sequential leak test if it has one
+    def get_pressure_leak(self, stop_pressure):
+        if self._leak_test is not None and self._leak_test.slope is not None:
+            return self._leak_test.slope
+        return math.get_pressure_leak(stop_pressure, self.start_pressure, clock.time(), self.start_time)
+
     def Enter(self):
         super(StateSystemCheck, self).Enter()
         # Check heater (checks physical heater and thermistor and ADC)
@@ -202,7 +287,7 @@ class StateSystemCheck(State):
         self.FSM.machine.drain_system()
 
         # allow system to depressurize
-        time.sleep(2)
+        self.FSM.machine.wait_until(self.FSM.machine.pressure_settled(), 0, 2)
 
         # If we already measured alcohol level, we can skip turning on sensor and checking again.
         # If not, we need to turn on the sensor and it will be checked as first step.
@@ -214,6 +299,12 @@ class StateSystemCheck(State):
 
         self._pressure_last_log_time = None
 
+        # sequential leak test of the current leak check, None when the fixed windows are used
+        self._leak_test = None
+
+        # pump-down model of the current depressurization, None when the pressure is only compared to the target
+        self._pump_down = None
+
         # system_check_state == 0:   Check alcohol level -> Throw ALCOHOL_GASLEVEL_ERROR
         # system_check_state == 1:   Close all valves
         # system_check_state == 2:   Reduce pressure to MAXIMUM, test for pump error
@@ -251,7 +342,7 @@ class StateSystemCheck(State):
 
                     if alcohol_level is module_alcoholsensor.AlcoholLevelMessage.DANGER:
                         self._logger.error("DANGER - High alcohol level.")
-                        self.FSM.ToTransistion("toStateError")
+                        self.FSM.ToTransistion(StateId.ERROR)
                         self.FSM.fsmData["failure_mode"] = FailureMode.ALCOHOL_GASLEVEL_ERROR
                         self.FSM.fsmData["failure_description"] = "Alcohol gas level is too high. Unplug Merlin400, make sure there is no spilled alcohol on it. Open side covers and make sure there is no alcohol inside Merlin400. Try again after cleaning it."
                     else:
@@ -266,18 +357,18 @@ class StateSystemCheck(State):
             # start fan
             self.FSM.machine.fan_value = 100
             # check fan
-            time.sleep(2)
+            self.FSM.machine.wait_until(self.FSM.machine.fan_running, 0, 2, interval=0.5)
             self.check_fan_is_on()
 
             #Chech the sanity of the pressure sensor
-            pressure_lower_bound = float(self.FSM.machine._config["FSM_EV"]["ambient_pressure_lower_bound"])
-            pressure_upper_bound = float(self.FSM.machine._config["FSM_EV"]["ambient_pressure_upper_bound"])
+            pressure_lower_bound = self.FSM.machine.config.FSM_EV.ambient_pressure_lower_bound
+            pressure_upper_bound = self.FSM.machine.config.FSM_EV.ambient_pressure_upper_bound
 
             # open all valves
             for valve in self.FSM.machine._myvalves:
                 self.FSM.machine.set_valve(valve, 100)
 
-            time.sleep(2)
+            self.FSM.machine.wait_until(self.FSM.machine.pressure_settled(), 0, 2)
             current_pressure = self.FSM.machine.pressure
             self._logger.info(
                 "Checking ambient pressure at the start of distill proces. Current pressure is {}".format(
@@ -287,7 +378,7 @@ class StateSystemCheck(State):
             if (current_pressure > pressure_upper_bound) or (current_pressure < pressure_lower_bound):
                 self._logger.info("Error, bad ambient pressure level. Entering error state.")
                 self.FSM.fsmData["failure_mode"] = FailureMode.PRESSURE_SENSOR_ERROR
-                self.FSM.ToTransistion("toStateError")
+                self.FSM.ToTransistion(StateId.ERROR)
                 self.FSM.fsmData["failure_description"] = "Error, ambient pressure is either too low or too high. Pressure sensor is defective."
                 return
 
@@ -306,7 +397,11 @@ class StateSystemCheck(State):
             self.FSM.machine.pump_value = 100
 
             # fetch starting time
-            self.start_time = time.time()
+            self.start_time = clock.time()
+
+            self._pump_down = self.FSM.machine.get_pump_down_model(
+                self.FSM.machine.config.FSM_EX.maximum_vacuum_pressure
+            )
 
             self._logger.info(
                 "System state: {} completed, reducing pressure".format(
@@ -322,26 +417,26 @@ class StateSystemCheck(State):
             pressure = self.FSM.machine.pressure
 
             _pressure_log_interval = 10 # log every ten seconds
-            if not self._pressure_last_log_time or ((time.time() - self._pressure_last_log_time) > _pressure_log_interval):
+            if not self._pressure_last_log_time or ((clock.time() - self._pressure_last_log_time) > _pressure_log_interval):
                 self._logger.info("Pressure: {} mbar".format(pressure))
-                self._pressure_last_log_time = time.time()
+                self._pressure_last_log_time = clock.time()
 
 
-            if pressure < float(
-                self.FSM.machine._config["FSM_EX"]["maximum_vacuum_pressure"]
-            ):
+            if pressure < self.FSM.machine.config.FSM_EX.maximum_vacuum_pressure:
                 # reached pressure target
 
                 # turn off pump
                 self.FSM.machine.pump_value = 0
 
                 # restart timer
-                self.start_time = time.time()
+                self.start_time = clock.time()
+
+                self._leak_test = self.FSM.machine.get_leak_test()
 
                 self._logger.info(
                     "System state: {} completed, pressure reduced, waiting {} seconds before checking for leaks".format(
                         self.system_check_state,
-                        self.FSM.machine._config["FSM_EX"]["leak_delay_time"],
+                        self.FSM.machine.config.FSM_EX.leak_delay_time,
                     )
                 )
 
@@ -350,20 +445,17 @@ class StateSystemCheck(State):
 
                 return
 
-            # check for timeout
-            if time.time() - self.start_time > float(
-                self.FSM.machine._config["FSM_EX"]["maximum_vacuum_time"]
+            # check for timeout, a stalled pump-down times out as soon as it is detected
+            if (
+                clock.time() - self.start_time > self.FSM.machine.config.FSM_EX.maximum_vacuum_time
+                or self._pump_down is not None and self.update_pump_down(
+                    self._pump_down, pressure, self.start_time, self.FSM.machine.config.FSM_EX.maximum_vacuum_time
+                )
             ):
                 self._logger.info(
                     "Error, did not reach required vacuum of {} mbar, in {} seconds".format(
-                        float(
-                            self.FSM.machine._config["FSM_EX"][
-                                "maximum_vacuum_pressure"
-                            ]
-                        ),
-                        float(
-                            self.FSM.machine._config["FSM_EX"]["maximum_vacuum_time"]
-                        ),
+                        self.FSM.machine.config.FSM_EX.maximum_vacuum_pressure,
+                        self.FSM.machine.config.FSM_EX.maximum_vacuum_time,
                     )
                 )
 
@@ -374,7 +466,7 @@ class StateSystemCheck(State):
                     self.FSM.fsmData["failure_mode"] = FailureMode.EVC_LEAK
                     self.FSM.fsmData["failure_description"] = "Unable to pull proper vacuum (pressure: {} mbar) in the distillation chamber. You most likely have a very high leak. Please check and clean top and bottom gaskets, make sure the glass is properly in place, the lid is closed and try again. If that fails contact support@drizzle.life".format(round(mypressure,2))
                     self._logger.debug(self.FSM.fsmData["failure_description"])
-                    self.FSM.ToTransistion("toStateError")
+                    self.FSM.ToTransistion(StateId.ERROR)
                     return
 
                 #Start by checking for leaks
@@ -390,7 +482,7 @@ class StateSystemCheck(State):
                     self.FSM.machine.pump_value = 0
 
                     #let pressure stabilize just a bit before
-                    time.sleep(2)
+                    clock.sleep(2)
 
                     #check that pressure has not just jumped like crazy
                     pressure_check_2 = self.FSM.machine.pressure
@@ -401,11 +493,11 @@ class StateSystemCheck(State):
                         self._logger.debug('Error, pressure increased {} mbar during a two second period. Limit is 5 mbar. Leak detected'.format(pressure_increase))
                         self.FSM.fsmData["failure_mode"] = FailureMode.EVC_LEAK
                         self.FSM.fsmData["failure_description"] = 'High leak ({} mbar/s) in the distillation chamber. Please check and clean top and bottom gaskets and make sure glass is properly in place. Try again after cleaning.'.format(leak_quant)
-                        self.FSM.ToTransistion("toStateError")
+                        self.FSM.ToTransistion(StateId.ERROR)
                         return
                     else:
                         #retest with stable pressure
-                        time.sleep(4)
+                        clock.sleep(4)
                         pressure_check_3 = self.FSM.machine.pressure
                         pressure_increase = pressure_check_3 - pressure_check_2
                         if pressure_increase > 10:
@@ -414,14 +506,14 @@ class StateSystemCheck(State):
                             self._logger.debug('Error, pressure increased {} mbar during a four second period. Limit is 10 mbar. Leak detected'.format(pressure_increase))
                             self.FSM.fsmData["failure_mode"] = FailureMode.EVC_LEAK
                             self.FSM.fsmData["failure_description"] = 'High leak ({} mbar/s) in the distillation chamber. Please check and clean top and bottom gaskets and make sure glass is properly in place. Try again after cleaning.'.format(leak_quant)
-                            self.FSM.ToTransistion("toStateError")
+                            self.FSM.ToTransistion(StateId.ERROR)
                             return
 
 
                 # attempt to correct pressure loss problem before going into error
                 if self.FSM.numberOfVentingRetries >= 3:
                     self._logger.info("Error, venting did not work")
-                    self.FSM.ToTransistion("toStateError")
+                    self.FSM.ToTransistion(StateId.ERROR)
                     self.FSM.fsmData["failure_mode"] = FailureMode.PUMP_NEEDS_CLEAN_OR_REPLACEMENT
                     self.FSM.fsmData["failure_description"] = "Pump could not pull enough vacuum. Please refer to website for guide to cleaning your pump. If you have allready done so, the pump may be defective. Please contact support@drizzle.life"
                 else:
@@ -432,20 +524,29 @@ class StateSystemCheck(State):
                     )
                     self.FSM.numberOfVentingRetries += 1
                     self.FSM.startExtractAfterVent = True
-                    self.FSM.ToTransistion("toStateVentPump")
+                    self.FSM.ToTransistion(StateId.VENT_PUMP)
                 return
 
         # Check for leaks, test for evc leak error - part one - wait for pressure to stabilize and get first pressure reading
         elif self.system_check_state == 3:
+            # the sequential leak test can pass the EVC while the pressure is still settling, a settling
+            # transient looks like a leak so only the sample window can fail it
+            leak_test_passed = (
+                self._leak_test is not None
+                and self.sample_leak_test(self._leak_test, allow_fail=False) is False
+            )
+
             # wait pressure_sample_delay seconds before starting measurement
-            if time.time() - self.start_time > float(
-                self.FSM.machine._config["FSM_EX"]["leak_delay_time"]
-            ):
+            if leak_test_passed or clock.time() - self.start_time > self.FSM.machine.config.FSM_EX.leak_delay_time:
                 # read initial pressure
                 self.start_pressure = self.FSM.machine.pressure
 
+                # judge the sample window on its own readings, like the fixed window test
+                if self._leak_test is not None and not leak_test_passed:
+                    self._leak_test.reset()
+
                 # reset timer
-                self.start_time = time.time()
+                self.start_time = clock.time()
 
                 self._logger.info(
                     "System state: {} completed, pressure reduced, checking for leaks".format(
@@ -459,42 +560,35 @@ class StateSystemCheck(State):
 
         # Check for leaks, test for evc leak error - part two - wait for predefined time before taking second leak measurement
         elif self.system_check_state == 4:
+            leak_detected = None
+            if self._leak_test is not None:
+                leak_detected = self.sample_leak_test(self._leak_test)
+
             # wait leak_sample_time before processing
-            if time.time() > self.start_time + float(
-                self.FSM.machine._config["FSM_EX"]["leak_sample_time"]
-            ):
+            if leak_detected is not None or clock.time() > self.start_time + self.FSM.machine.config.FSM_EX.leak_sample_time:
                 self.stop_pressure = self.FSM.machine.pressure
                 self._logger.info(
                     "Pressure leak: {:.02f} mbar, time is: {:.02f} seconds".format(
                         self.stop_pressure - self.start_pressure,
-                        float(self.FSM.machine._config["FSM_EX"]["leak_sample_time"]),
+                        clock.time() - self.start_time,
                     )
                 )
                 # caculate pressure leak
-                self.pressure_leak = math.get_pressure_leak(
-                    self.stop_pressure,
-                    self.start_pressure,
-                    time.time(),
-                    self.start_time,
-                )
+                self.pressure_leak = self.get_pressure_leak(self.stop_pressure)
+                if leak_detected is None:
+                    leak_detected = self.pressure_leak > self.FSM.machine.config.FSM_EX.max_pressure_loss_evc
 
-                if self.pressure_leak > float(
-                    self.FSM.machine._config["FSM_EX"]["max_pressure_loss_evc"]
-                ):
+                if leak_detected:
                     self._logger.warning(
                         "Leak is too high: {:.02f} mbar/sec, max allowed is: {:.02f} mbar/sec".format(
                             self.pressure_leak,
-                            float(
-                                self.FSM.machine._config["FSM_EX"][
-                                    "max_pressure_loss_evc"
-                                ]
-                            ),
+                            self.FSM.machine.config.FSM_EX.max_pressure_loss_evc,
                         )
                     )
                     self.FSM.FSMOutputText = "Error - EVC has leaks"
 
                     # go to error state
-                    self.FSM.ToTransistion("toStateError")
+                    self.FSM.ToTransistion(StateId.ERROR)
                     self.FSM.fsmData["failure_mode"] = FailureMode.EVC_LEAK
                     self.FSM.fsmData["failure_description"] = 'Small leak ({} mbar/s) in the distillation chamber. Please check and clean top and bottom gaskets and make sure glass is properly in place. Try again after cleaning.'.format(round(self.pressure_leak, 2))
                     return
@@ -503,11 +597,7 @@ class StateSystemCheck(State):
                     self._logger.info(
                         "Leak is ok: {:.02f} mbar/sec, max allowed is: {:.02f} mbar/sec".format(
                             self.pressure_leak,
-                            float(
-                                self.FSM.machine._config["FSM_EX"][
-                                    "max_pressure_loss_evc"
-                                ]
-                            ),
+                            self.FSM.machine.config.FSM_EX.max_pressure_loss_evc,
                         )
                     )
                     self.FSM.fsmData["system_leak"] = self.pressure_leak
@@ -519,7 +609,7 @@ class StateSystemCheck(State):
                     self.FSM.machine.set_valve("valve3", 100)
 
                     # reset timer
-                    self.start_time = time.time()
+                    self.start_time = clock.time()
 
                     self._logger.info(
                         "System state: {}, checking for EXC volume".format(
@@ -536,10 +626,8 @@ class StateSystemCheck(State):
         elif self.system_check_state == 5:
 
             # wait for pressure to stabilize
-            if time.time() - self.start_time > float(
-                self.FSM.machine._config["FSM_EX"]["pressure_eq_time"]
-            ):
-                evc_volume = float(self.FSM.machine._config["FSM_EX"]["evc_volume"])
+            if clock.time() - self.start_time > self.FSM.machine.config.FSM_EX.pressure_eq_time:
+                evc_volume = self.FSM.machine.config.FSM_EX.evc_volume
 
                 # get new pressure
                 full_system_pressure = self.FSM.machine.pressure
@@ -550,7 +638,7 @@ class StateSystemCheck(State):
                         "Error, pressure did not increase enough. Please check valve 3."
                     )
                     # pressure did not increase enough. Something is wrong!
-                    self.FSM.ToTransistion("toStateError")
+                    self.FSM.ToTransistion(StateId.ERROR)
                     self.FSM.fsmData["failure_mode"] = FailureMode.VALVE_3_BLOCKED
                     self.FSM.fsmData["failure_description"] = "Valve 3 (Extractor -> Distiller) seems stuck or clogged. Please refer to the article on cleaning the valves on our website."
 
@@ -579,7 +667,7 @@ class StateSystemCheck(State):
                 # calculate total runtime (seconds)
                 self.FSM.fsmData["total_runtime_theoretical"] = self.FSM.fsmData[
                     "total_liquid_volume_to_aspirate"
-                ] / float(self.FSM.machine._config["FSM_EX"]["aspirate_speed"])
+                ] / self.FSM.machine.config.FSM_EX.aspirate_speed
                 self._logger.info(
                     "Theoretical runtime is: {} seconds".format(
                         self.FSM.fsmData["total_runtime_theoretical"]
@@ -601,15 +689,17 @@ class StateSystemCheck(State):
                     self._logger.error(
                         "Initialization error, EXC is probably leaking. Please check gaskets"
                     )
-                    self.FSM.ToTransistion("toStateError")
+                    self.FSM.ToTransistion(StateId.ERROR)
                     self.FSM.fsmData["failure_mode"] = FailureMode.EXC_LEAK
                     self.FSM.fsmData["failure_description"] = "There is a leak in the extraction chamber. Please check that the upper and lower gaskets are in place and try again. If the error persists, please check that the front of the lid is not broken and contact support@drizzle.life"
 
                 # reset timer
-                self.start_time = time.time()
+                self.start_time = clock.time()
 
                 self.start_pressure = full_system_pressure
 
+                self._leak_test = self.FSM.machine.get_leak_test()
+
                 self._logger.info(
                     "System state: {} complete, checking for leaks".format(
                         self.system_check_state
@@ -623,37 +713,33 @@ class StateSystemCheck(State):
 
         # Check for leaks -> Throw EXC leak error
         elif self.system_check_state == 6:
+            leak_detected = None
+            if self._leak_test is not None:
+                leak_detected = self.sample_leak_test(self._leak_test)
 
             # wait pressure_sample_delay seconds before starting measurement
-            if time.time() > self.start_time + float(
-                self.FSM.machine._config["FSM_EX"]["leak_sample_time"]
-            ):
+            if leak_detected is not None or clock.time() > self.start_time + self.FSM.machine.config.FSM_EX.leak_sample_time:
                 # read initial pressure
                 stop_pressure = self.FSM.machine.pressure
 
                 # calculate pressure leak
-                self.pressure_leak = (stop_pressure - self.start_pressure) / (
-                    time.time() - self.start_time
-                )
+                self.pressure_leak = self.get_pressure_leak(stop_pressure)
 
                 # check against config
-                if self.pressure_leak > float(
-                    self.FSM.machine._config["FSM_EX"]["max_pressure_loss_evc"]
-                ):
+                if leak_detected is None:
+                    leak_detected = self.pressure_leak > self.FSM.machine.config.FSM_EX.max_pressure_loss_evc
+
+                if leak_detected:
                     self._logger.warning(
                         "Leak is too high: {:.02f} mbar/sec, max allowed is: {:.02f} mbar/sec".format(
                             self.pressure_leak,
-                            float(
-                                self.FSM.machine._config["FSM_EX"][
-                                    "max_pressure_loss_evc"
-                                ]
-                            ),
+                            self.FSM.machine.config.FSM_EX.max_pressure_loss_evc,
                         )
                     )
                     self.FSM.FSMOutputText = "Error - EXC has leaks"
 
                     # go to error state
-                    self.FSM.ToTransistion("toStateError")
+                    self.FSM.ToTransistion(StateId.ERROR)
                     self.FSM.fsmData["failure_mode"] = FailureMode.EXC_LEAK
                     self.FSM.fsmData["failure_description"] = "Leaks from extraction chamber detected, check gaskets, check that the tubes are in the valves, and check the EXC lid for signs of cracks or stretches."
 
@@ -663,18 +749,13 @@ class StateSystemCheck(State):
                     self._logger.info(
                         "Leak is ok: {:.02f} mbar/sec, max allowed is: {:.02f} mbar/sec".format(
                             self.pressure_leak,
-                            float(
-
-                                self.FSM.machine._config["FSM_EX"][
-                                    "max_pressure_loss_evc"
-                                ]
-                            ),
+                            self.FSM.machine.config.FSM_EX.max_pressure_loss_evc,
                         )
                     )
                     self.FSM.fsmData["system_leak"] = self.pressure_leak
 
                     # reset timer
-                    self.start_time = time.time()
+                    self.start_time = clock.time()
 
                     # pressure loss ok, move on!
                     self.system_check_state += 1
@@ -689,7 +770,7 @@ class StateSystemCheck(State):
             self.start_pressure = self.FSM.machine.pressure
 
             self.FSM.machine.set_valve("valve4", 100)
-            self.start_time = time.time()
+            self.start_time = clock.time()
             self.system_check_state += 1
 
             return
@@ -698,9 +779,7 @@ class StateSystemCheck(State):
         elif self.system_check_state == 8:
 
             # wait for pressure to stabilize
-            if time.time() - self.start_time > float(
-                self.FSM.machine._config["FSM_EX"]["pressure_eq_time"]
-            ):
+            if clock.time() - self.start_time > self.FSM.machine.config.FSM_EX.pressure_eq_time:
                 # do check here
                 pressure = self.FSM.machine.pressure
 
@@ -720,7 +799,11 @@ class StateSystemCheck(State):
                     self.FSM.machine.pump_value = 100
 
                     # reset timer
-                    self.start_time = time.time()
+                    self.start_time = clock.time()
+
+                    self._pump_down = self.FSM.machine.get_pump_down_model(
+                        self.FSM.machine.config.FSM_EX.maximum_vacuum_pressure
+                    )
                     self._logger.info(
                         "System state: {} comlpete, reducing pressure".format(
                             self.system_check_state
@@ -729,7 +812,7 @@ class StateSystemCheck(State):
                     # go to next substate
                     self.system_check_state += 1
                 else:
-                    self.FSM.ToTransistion("toStateError")
+                    self.FSM.ToTransistion(StateId.ERROR)
                     self.FSM.fsmData["failure_mode"] = FailureMode.VALVE_4_BLOCKED
                     self.FSM.fsmData["failure_description"] = "Valve 4 (Air -> Distiller) seems stuck or clogged. Please refer to the article on cleaning the valves on our website."
 
@@ -737,13 +820,11 @@ class StateSystemCheck(State):
         elif self.system_check_state == 9:
             pressure = self.FSM.machine.pressure
             _pressure_log_interval = 10 # log every ten seconds
-            if not self._pressure_last_log_time or ((time.time() - self._pressure_last_log_time) > _pressure_log_interval):
+            if not self._pressure_last_log_time or ((clock.time() - self._pressure_last_log_time) > _pressure_log_interval):
                 self._logger.info("Pressure: {} mbar".format(pressure))
-                self._pressure_last_log_time = time.time()
+                self._pressure_last_log_time = clock.time()
 
-            if pressure < float(
-                self.FSM.machine._config["FSM_EX"]["maximum_vacuum_pressure"]
-            ):
+            if pressure < self.FSM.machine.config.FSM_EX.maximum_vacuum_pressure:
                 # reached pressure target
                 self._logger.info(
                     "System state: {} completed, reducing pressure".format(
@@ -758,7 +839,7 @@ class StateSystemCheck(State):
                 self.FSM.machine.set_valve("valve2", 100)
 
                 # restart timer
-                self.start_time = time.time()
+                self.start_time = clock.time()
 
                 # go to next stage of system init
                 self.system_check_state += 1
@@ -771,25 +852,22 @@ class StateSystemCheck(State):
 
                 return
 
-            # check for timeout
-            if (time.time() - self.start_time) > float(
-                self.FSM.machine._config["FSM_EX"]["maximum_vacuum_time"]
+            # check for timeout, a stalled pump-down times out as soon as it is detected
+            if (
+                (clock.time() - self.start_time) > self.FSM.machine.config.FSM_EX.maximum_vacuum_time
+                or self._pump_down is not None and self.update_pump_down(
+                    self._pump_down, pressure, self.start_time, self.FSM.machine.config.FSM_EX.maximum_vacuum_time
+                )
             ):
                 self._logger.error(
                     "Error, did not reach required vacuum of {} mbar, in {} seconds".format(
-                        float(
-                            self.FSM.machine._config["FSM_EX"][
-                                "maximum_vacuum_pressure"
-                            ]
-                        ),
-                        float(
-                            self.FSM.machine._config["FSM_EX"]["maximum_vacuum_time"]
-                        ),
+                        self.FSM.machine.config.FSM_EX.maximum_vacuum_pressure,
+                        self.FSM.machine.config.FSM_EX.maximum_vacuum_time,
                     )
                 )
 
                 # go to error state
-                self.FSM.ToTransistion("toStateError")
+                self.FSM.ToTransistion(StateId.ERROR)
                 self.FSM.fsmData["failure_mode"] = FailureMode.PUMP_NEEDS_CLEAN_OR_REPLACEMENT
                 self.FSM.fsmData["failure_description"] = "Pump seems to be dirty or damaged. Please run the extended cleaning, as described in the manual, and check our knowledgebase online for further tips."
                 return
@@ -798,9 +876,7 @@ class StateSystemCheck(State):
         elif self.system_check_state == 10:
 
             # wait for pressure to stabilize
-            if time.time() - self.start_time > float(
-                self.FSM.machine._config["FSM_EX"]["pressure_eq_time"]
-            ):
+            if clock.time() - self.start_time > self.FSM.machine.config.FSM_EX.pressure_eq_time:
                 # do check here
                 pressure = self.FSM.machine.pressure
 
@@ -823,13 +899,13 @@ class StateSystemCheck(State):
                             self.FSM.fsmData["atm_pressure"], pressure
                         )
                     )
-                    self.FSM.ToTransistion("toStateError")
+                    self.FSM.ToTransistion(StateId.ERROR)
                     self.FSM.fsmData["failure_mode"] = FailureMode.VALVE_2_BLOCKED
                     self.FSM.fsmData["failure_description"] = "Valve 2 (Air -> Extraction) seems stuck or clogged. Please refer to the article on cleaning the valves on our website."
 
         # Check heater
         elif self.system_check_state == 11:
-            self.start_time = time.time()
+            self.start_time = clock.time()
 
             # Read heater temperature
             self.start_temp = self.FSM.machine.bottom_temperature
@@ -857,13 +933,13 @@ class StateSystemCheck(State):
                 self.system_check_state += 1
             else:
                 # Max time to heat is 20 seconds
-                if (time.time() - self.start_time) > 20:
+                if (clock.time() - self.start_time) > 20:
                     # Heater off
                     self.FSM.machine.bottom_heater_percent = 0
 
                     # got a heater error
                     self._logger.error("Heater error, please check")
-                    self.FSM.ToTransistion("toStateError")
+                    self.FSM.ToTransistion(StateId.ERROR)
                     self.FSM.fsmData["failure_mode"] = FailureMode.HEATER_ERROR
                     self.FSM.fsmData["failure_description"] = "Heater error. Please swtich off machine completely, wait 1 minute and turn it back on and try again. If the problem persists your heater cable is damaged or the thermal fuse is blown. Conact support@drizzle.life for help."
 
@@ -875,7 +951,7 @@ class StateSystemCheck(State):
                 self._logger.debug("Alcohol level - {}.".format(alcohol_level))
                 if alcohol_level is module_alcoholsensor.AlcoholLevelMessage.NOT_READY:
                     self._logger.error("Failed to read alcohol level.")
-                    self.FSM.ToTransistion("toStateError")
+                    self.FSM.ToTransistion(StateId.ERROR)
                     self.FSM.fsmData["failure_mode"] = FailureMode.ALCOHOL_GASLEVEL_ERROR
                     self.FSM.fsmData["failure_description"] = "Failed to read alcohol gas level, please contact support@drizzle.life"
 
@@ -884,17 +960,17 @@ class StateSystemCheck(State):
                     module_alcoholsensor.AlcoholLevelMessage.WARNING
                 ):
                     self._logger.error("DANGER - Alcohol level is still too high.")
-                    self.FSM.ToTransistion("toStateError")
+                    self.FSM.ToTransistion(StateId.ERROR)
                     self.FSM.fsmData["failure_mode"] = FailureMode.ALCOHOL_GASLEVEL_ERROR
                     self.FSM.fsmData["failure_description"] = "Error, alcohol gas level is too high. If you have spilled in or around the machine, please wipe it off with a cloth. Wait a few more minutes and try again. If the problem persists, drain the machine completely of alcohol and leave the machine for a day at room temperature or slightly higher."
                 else:
                     self._logger.info("Alcohol level is ok. Starting full extraction.")
                     self.system_check_state += 1
-                    self.FSM.ToTransistion("toStatePreFillTubes")
+                    self.FSM.ToTransistion(StateId.PRE_FILL_TUBES)
             else:
                 self._logger.info("Alcohol sensor is disabled. Starting full extraction.")
                 self.system_check_state += 1
-                self.FSM.ToTransistion("toStatePreFillTubes")
+                self.FSM.ToTransistion(StateId.PRE_FILL_TUBES)
 
     def Exit(self):
         super(StateSystemCheck, self).Exit()
@@ -920,10 +996,9 @@ class StatePreFillTubes(State):
 
         self._logger.info("Setting valves in tube filling position")
         # open valve 3 and close valves 1+2+4
-        self.FSM.machine.set_valve("valve1", 0)
-        self.FSM.machine.set_valve("valve2", 0)
-        self.FSM.machine.set_valve("valve3", 100)
-        self.FSM.machine.set_valve("valve4", 0)
+        self.FSM.machine.set_valves(
+            [("valve1", 0), ("valve2", 0), ("valve3", 100), ("valve4", 0)]
+        )
 
         # turn on warm light
         self.FSM.machine.light_warm()
@@ -938,21 +1013,19 @@ class StatePreFillTubes(State):
         self.FSM.FSMOutputText = "System depressuring: {:.02f} mbar".format(pressure)
 
         # Condition to see if we need to change state
-        if pressure < float(self.FSM.machine._config["FSM_EX"]["tube_filling_vacuum"]):
+        if pressure < self.FSM.machine.config.FSM_EX.tube_filling_vacuum:
             # Turn off pump
             self.FSM.machine.pump_value = 0
 
             # do fast liquid flush
             self.FSM.machine.set_valve(
                 "valve1",
-                float(self.FSM.machine._config["FSM_EX"]["valve_start_close_value"]),
+                self.FSM.machine.config.FSM_EX.valve_start_close_value,
             )
 
-            time.sleep(
-                float(self.FSM.machine._config["FSM_EX"]["valve_start_close_time"])
-            )
+            clock.sleep(self.FSM.machine.config.FSM_EX.valve_start_close_time)
 
-            self.FSM.ToTransistion("toStateFirstDepressurize")
+            self.FSM.ToTransistion(StateId.FIRST_DEPRESSURIZE)
             self._logger.info("maximum vacuum pressure achieved")
 
 
@@ -976,22 +1049,25 @@ class StateFirstDepressurize(State):
 
         # Start pump at 100#
         self.FSM.machine.pump_value = 100
+        self._pump_down = self.FSM.machine.get_pump_down_model(
+            self.FSM.machine.config.FSM_EX.maximum_vacuum_pressure
+        )
 
     def Execute(self):
         super(StateFirstDepressurize, self).Execute()
         pressure = self.FSM.machine.pressure
         self.FSM.FSMOutputText = "System depressuring: {:.02f} mbar".format(pressure)
         _pressure_log_interval = 10 # log every ten seconds
-        if not self._pressure_last_log_time or ((time.time() - self._pressure_last_log_time) > _pressure_log_interval):
+        if not self._pressure_last_log_time or ((clock.time() - self._pressure_last_log_time) > _pressure_log_interval):
             self._logger.info(self.FSM.FSMOutputText)
-            self._pressure_last_log_time = time.time()
+            self._pressure_last_log_time = clock.time()
 
         # Condition to see if we need to change state
-        if pressure < float(
-            self.FSM.machine._config["FSM_EX"]["maximum_vacuum_pressure"]
-        ):
-            self.FSM.ToTransistion("toStateMeasureEXCVolume")
+        if pressure < self.FSM.machine.config.FSM_EX.maximum_vacuum_pressure:
+            self.FSM.ToTransistion(StateId.MEASURE_EXC_VOLUME)
             self._logger.info("maximum vacuum pressure achieved")
+        elif self._pump_down is not None and self.update_pump_down(self._pump_down, pressure, self.startTime):
+            self.fail_pump_down()
 
     def Exit(self):
         super(StateFirstDepressurize, self).Exit()
@@ -1021,12 +1097,10 @@ class StateMeasureEXCVolume(State):
     def Execute(self):
         super(StateMeasureEXCVolume, self).Execute()
         self.FSM.FSMOutputText = "Measuring exc volume"
-        evc_volume = float(self.FSM.machine._config["FSM_EX"]["evc_volume"])
+        evc_volume = self.FSM.machine.config.FSM_EX.evc_volume
 
         # Wait a period of time untill pressure has stabilized
-        if float(self.eventDuration) > float(
-            self.FSM.machine._config["FSM_EX"]["pressure_eq_time"]
-        ):
+        if float(self.eventDuration) > self.FSM.machine.config.FSM_EX.pressure_eq_time:
             # get new pressure
             full_system_pressure = self.FSM.machine.pressure
 
@@ -1050,7 +1124,7 @@ class StateMeasureEXCVolume(State):
             self.FSM.fsmData["exc_volume"] = exc_volume_raw
             self.FSM.fsmData["total_volume"] = tot_volume
             self.FSM.fsmData["exc_volume_liquid"] = exc_volume_converted_to_liquid
-            self.FSM.ToTransistion("toStateSecondDepressurize")
+            self.FSM.ToTransistion(StateId.SECOND_DEPRESSURIZE)
 
     def Exit(self):
         super(StateMeasureEXCVolume, self).Exit()
@@ -1071,6 +1145,9 @@ class StateSecondDepressurize(State):
 
         # Start pump at 100#
         self.FSM.machine.pump_value = 100
+        self._pump_down = self.FSM.machine.get_pump_down_model(
+            self.FSM.machine.config.FSM_EX.maximum_vacuum_pressure
+        )
 
     def Execute(self):
         super(StateSecondDepressurize, self).Execute()
@@ -1082,10 +1159,12 @@ class StateSecondDepressurize(State):
         # wait for atleast two seconds before measuring
         if self.eventDuration > 2:
             # if pressure is below requirement, proceed
-            if pressure < float(
-                self.FSM.machine._config["FSM_EX"]["maximum_vacuum_pressure"]
-            ):
-                self.FSM.ToTransistion("toStateSecondLeakCheck")
+            if pressure < self.FSM.machine.config.FSM_EX.maximum_vacuum_pressure:
+                self.FSM.ToTransistion(StateId.SECOND_LEAK_CHECK)
+                return
+
+        if self._pump_down is not None and self.update_pump_down(self._pump_down, pressure, self.startTime):
+            self.fail_pump_down()
 
     def Exit(self):
         super(StateSecondDepressurize, self).Exit()
@@ -1103,47 +1182,62 @@ class StateSecondLeakCheck(State):
         self.humanReadableLabel = "Checking for leaks"
         self._first_measurement = True
         self.FSM.machine.pump_value = 0
+        self._leak_test = self.FSM.machine.get_leak_test()
         self._logger.info("Entering state 6")
 
     def Execute(self):
         super(StateSecondLeakCheck, self).Execute()
 
-        leak_delay_time = float(self.FSM.machine._config["FSM_EX"]["leak_delay_time"])
-        leak_sample_time = float(self.FSM.machine._config["FSM_EX"]["leak_sample_time"])
+        leak_delay_time = self.FSM.machine.config.FSM_EX.leak_delay_time
+        leak_sample_time = self.FSM.machine.config.FSM_EX.leak_sample_time
 
         self.FSM.FSMOutputText = "{} sec delay before full system leak check".format(
             leak_delay_time
         )
 
-        if self._first_measurement and (self.eventDuration > leak_delay_time):
+        # the sequential leak test can pass the system while the pressure is still settling, only the
+        # sample window can fail it
+        leak_detected = None
+        if self._leak_test is not None:
+            leak_detected = self.sample_leak_test(self._leak_test, allow_fail=not self._first_measurement)
+
+        if self._first_measurement and (leak_detected is False or self.eventDuration > leak_delay_time):
             self._first_measurement = False
             # read initial pressure
             self._start_pressure = self.FSM.machine.pressure
+            self._start_time = self.eventDuration
+
+            # judge the sample window on its own readings, like the fixed window test
+            if self._leak_test is not None and leak_detected is None:
+                self._leak_test.reset()
 
         if not self._first_measurement and (
-            self.eventDuration > (leak_delay_time + leak_sample_time)
+            leak_detected is not None or self.eventDuration > (leak_delay_time + leak_sample_time)
         ):
             self._stop_pressure = self.FSM.machine.pressure
             self._logger.info(
                 "Pressure leak: {:.02f} mbar, time is: {:.02f} seconds".format(
                     self._stop_pressure - self._start_pressure,
-                    leak_sample_time,
+                    self.eventDuration - self._start_time,
                 )
             )
-            self._pressure_leak = math.get_pressure_leak_by_sample_time(
-                self._stop_pressure,
-                self._start_pressure,
-                leak_sample_time,
-            )
+            if self._leak_test is not None and self._leak_test.slope is not None:
+                self._pressure_leak = self._leak_test.slope
+            else:
+                self._pressure_leak = math.get_pressure_leak_by_sample_time(
+                    self._stop_pressure,
+                    self._start_pressure,
+                    leak_sample_time,
+                )
             self._logger.info(
                 "Leak is: {:.02f} mbar/sec, max allowed is: {:.02f} mbar/sec".format(
                     self._pressure_leak,
-                    float(self.FSM.machine._config["FSM_EX"]["max_pressure_loss_evc"]),
+                    self.FSM.machine.config.FSM_EX.max_pressure_loss_evc,
                 )
             )
             # store pressure leak for future use
             self.FSM.fsmData["system_leak"] = self._pressure_leak
-            self.FSM.ToTransistion("toStateTopUpEXC")
+            self.FSM.ToTransistion(StateId.TOP_UP_EXC)
 
     def Exit(self):
         super(StateSecondLeakCheck, self).Exit()
@@ -1165,7 +1259,7 @@ class StateTopUpEXC(State):
         for valve in self.FSM.machine._myvalves:
             self.FSM.machine.set_valve(valve, 0)
 
-        self.start_time = time.time()
+        self.start_time = clock.time()
 
     def Execute(self):
         super(StateTopUpEXC, self).Execute()
@@ -1175,19 +1269,17 @@ class StateTopUpEXC(State):
         self.FSM.machine.set_valve("valve1", 100)
 
         # TODO: Add as a config.ini variable
-        top_up_time = float(self.FSM.machine._config["FSM_EX"]["top_up_time"])
-        top_up_afterfill_valve_setting = float(
-            self.FSM.machine._config["FSM_EX"]["top_up_afterfill_valve_setting"]
-        )
+        top_up_time = self.FSM.machine.config.FSM_EX.top_up_time
+        top_up_afterfill_valve_setting = self.FSM.machine.config.FSM_EX.top_up_afterfill_valve_setting
 
         # and wait for chamber to fully fill
-        if (time.time() - self.start_time) < top_up_time:
+        if (clock.time() - self.start_time) < top_up_time:
             pass
         else:
             # fill tubes from exc to evc
             self.FSM.machine.set_valve("valve3", top_up_afterfill_valve_setting)
             self.FSM.machine.set_valve("valve3", 0)
-            self.FSM.ToTransistion("toStateSoak")
+            self.FSM.ToTransistion(StateId.SOAK)
 
     def Exit(self):
         super(StateTopUpEXC, self).Exit()
@@ -1210,18 +1302,18 @@ class StateSoak(State):
         self.humanReadableLabel = "Soak state"
         self.FSM.machine.set_valve("valve1", 0)
         self.FSM.machine.set_valve("valve3", 0)
-        self._start_time = time.time()
-        self._wait_time_seconds = float(self.FSM.machine._config["SYSTEM"]["soak_time_seconds"])
+        self._start_time = clock.time()
+        self._wait_time_seconds = self.FSM.machine.config.SYSTEM.soak_time_seconds
         self.FSM.FSMOutputText = "Waiting for {} seconds.".format(self._wait_time_seconds)
         self._logger.info(self.FSM.FSMOutputText)
 
     def Execute(self):
         super(StateSoak, self).Execute()
-        elapsed_time = time.time() - self._start_time
+        elapsed_time = clock.time() - self._start_time
         if elapsed_time > self._wait_time_seconds:
             self._logger.info("Finished waiting.")
-            self.FSM.ToTransistion("toStateThirdDepressurize")
-        time.sleep(1)
+            self.FSM.ToTransistion(StateId.THIRD_DEPRESSURIZE)
+        clock.sleep(1)
 
     def Exit(self):
         super(StateSoak, self).Exit()
@@ -1249,6 +1341,9 @@ class StateThirdDepressurize(State):
 
         # Start pump at 100#
         self.FSM.machine.pump_value = 100
+        self._pump_down = self.FSM.machine.get_pump_down_model(
+            self.FSM.machine.config.FSM_EX.maximum_vacuum_pressure
+        )
 
     def Execute(self):
         super(StateThirdDepressurize, self).Execute()
@@ -1256,23 +1351,24 @@ class StateThirdDepressurize(State):
         self.FSM.FSMOutputText = "System depressuring: {:.02f} mbar".format(pressure)
 
         _pressure_log_interval = 10 # log every ten seconds
-        if not self._pressure_last_log_time or ((time.time() - self._pressure_last_log_time) > _pressure_log_interval):
+        if not self._pressure_last_log_time or ((clock.time() - self._pressure_last_log_time) > _pressure_log_interval):
             self._logger.info(self.FSM.FSMOutputText)
-            self._pressure_last_log_time = time.time()
+            self._pressure_last_log_time = clock.time()
 
         # Condition to see if we need to change state
-        if pressure < float(
-            self.FSM.machine._config["FSM_EX"]["maximum_vacuum_pressure"]
-        ):
-            self.FSM.ToTransistion("toStateAspirate")
+        if pressure < self.FSM.machine.config.FSM_EX.maximum_vacuum_pressure:
+            self.FSM.ToTransistion(StateId.ASPIRATE)
             self._logger.info("maximum vacuum pressure achieved")
+        elif self._pump_down is not None and self.update_pump_down(self._pump_down, pressure, self.startTime):
+            self.fail_pump_down()
 
     def Exit(self):
         super(StateThirdDepressurize, self).Exit()
         # Turn off pump
         self.FSM.machine.pump_value = 0
-        # wait for pressure to stabilize
-        time.sleep(float(self.FSM.machine._config["FSM_EX"]["leak_delay_time"]))
+        # wait for pressure to stabilize, fixed because the system leak is measured next and the rebound after
+        # the pump stops is slower than the leak
+        clock.sleep(self.FSM.machine.config.FSM_EX.leak_delay_time)
         self.FSM.FSMOutputText = "Exiting depressuring state"
         self._logger.info(self.FSM.FSMOutputText)
 
@@ -1282,17 +1378,15 @@ class StateAspirate(State):
     def __init__(self, FSM):
         super(StateAspirate, self).__init__(FSM)
 
+    # interval to calculate average flowrate
+    FLOWRATE_AVERAGE_INTERVAL_SECONDS = 60
+
     def add_flowrate(self, flowrate):
-        interval_seconds = 60  # interval to calculate average flowrate.
-        curr_time = time.time()
-        for idx, (ts, _) in enumerate(self._flowrate_container):
-            if (curr_time - ts) > interval_seconds:
-                self._flowrate_container.pop(idx)
-        self._flowrate_container.append((curr_time, flowrate))
+        self._flowrate_window.add(clock.time(), flowrate)
 
     @property
     def flowrate_avg(self):
-        return sum([item[1] for item in self._flowrate_container])/len(self._flowrate_container)
+        return self._flowrate_window.mean
 
     def Enter(self):
         self.FSM.FSMOutputText = "Init Aspirate"
@@ -1300,18 +1394,14 @@ class StateAspirate(State):
         super(StateAspirate, self).Enter()
 
         # start with a small delay to allow pressure to stabilize
-        time.sleep(2)
+        clock.sleep(2)
 
         # fetch variables for dictionary
-        self._total_volume = float(self.FSM.machine._config["FSM_EX"]["evc_volume"])
-        self._aspirate_volume_target = float(
-            self.FSM.machine._config["FSM_EX"]["aspirate_volume"]
-        )
+        self._total_volume = self.FSM.machine.config.FSM_EX.evc_volume
+        self._aspirate_volume_target = self.FSM.machine.config.FSM_EX.aspirate_volume
 
         # this does not compensate for flow speed error over time, and uses the aspirate_speed variable instead of the corrected one
-        self._aspirate_speed_target = float(
-            self.FSM.machine._config["FSM_EX"]["aspirate_speed"]
-        )
+        self._aspirate_speed_target = self.FSM.machine.config.FSM_EX.aspirate_speed
         # assume flow is zero and fetch values from there
         (
             self._current_step_size,
@@ -1325,7 +1415,7 @@ class StateAspirate(State):
         # read initial pressure
         self._pressure_test_start = self.FSM.machine.pressure
 
-        self._current_time_start = time.time()
+        self._current_time_start = clock.time()
         self._last_known_valve_setting_measured = False
 
         # calculate pv contant for volume measuremnts
@@ -1335,8 +1425,15 @@ class StateAspirate(State):
 
         # set valve to last know run setting - the hardcoded 2 is the amount we want the valve to start under the target - add as config number later
         self._valve_setting = (
-            float(self.FSM.machine._config["FSM_EV"]["valve_last_known_setting"]) - 2
+            self.FSM.machine.config.FSM_EV.valve_last_known_setting - 2
+        )
+
+        # the PI flow controller starts at the last known setting, it models the valve and needs no undershoot
+        self._flow_controller = self.FSM.machine.get_flow_controller(
+            self._aspirate_speed_target, self.FSM.machine.config.FSM_EV.valve_last_known_setting
         )
+        if self._flow_controller is not None:
+            self._valve_setting = self._flow_controller.position
         self.FSM.machine.set_valve("valve3", 0)
         self.FSM.machine.set_valve("valve1", 0)
 
@@ -1344,38 +1441,48 @@ class StateAspirate(State):
         self._total_volume_aspirated_start = 0
 
         # Get flowrate fall limit from the config, measured in ml/sec
-        self._flowrate_fall_limit = float(
-            self.FSM.machine._config["FSM_EX"]["flowrate_fall_limit"]
-        )
+        self._flowrate_fall_limit = self.FSM.machine.config.FSM_EX.flowrate_fall_limit
         self._flowrate_warning_limit = self._aspirate_speed_target / 2
         # variable to hold flowrate values for avg calculation.
-        self._flowrate_container = []
+        self._flowrate_window = math.SlidingWindow(StateAspirate.FLOWRATE_AVERAGE_INTERVAL_SECONDS)
 
         # wait a second before detecting leaks
-        time.sleep(1)
+        clock.sleep(1)
+
+        leak_test = self.FSM.machine.get_leak_test()
 
         # get starting pressure and time
         pressure_leak_detect_start = self.FSM.machine.pressure
-        time_leak_detect_start = time.time()
-        time.sleep(float(self.FSM.machine._config["FSM_EV"]["leak_detect_duration"]))
+        time_leak_detect_start = clock.time()
+        if leak_test is None:
+            clock.sleep(self.FSM.machine.config.FSM_EV.leak_detect_duration)
+        else:
+            # no pass or fail here, but the fitted slope over dense readings is a better estimate than two readings
+            leak_test.add(time_leak_detect_start, pressure_leak_detect_start)
+            while clock.time() - time_leak_detect_start < self.FSM.machine.config.FSM_EV.leak_detect_duration:
+                clock.sleep(self.FSM.machine.config.FSM_EX.leak_test_sample_interval)
+                leak_test.add(clock.time(), self.FSM.machine.pressure)
 
         # get pressure and time at stop
         pressure_leak_detect_stop = self.FSM.machine.pressure
-        time_leak_detect_stop = time.time()
+        time_leak_detect_stop = clock.time()
 
         # calculate corrected leak
-        self._system_leak = math.get_pressure_leak(
-            pressure_leak_detect_stop,
-            pressure_leak_detect_start,
-            time_leak_detect_stop,
-            time_leak_detect_start,
-        )
+        if leak_test is not None and leak_test.slope is not None:
+            self._system_leak = leak_test.slope
+        else:
+            self._system_leak = math.get_pressure_leak(
+                pressure_leak_detect_stop,
+                pressure_leak_detect_start,
+                time_leak_detect_stop,
+                time_leak_detect_start,
+            )
         self.FSM.fsmData["system_leak"] = self._system_leak
 
         # setup timing variables
-        self._last_run_time = time.time()
-        self._last_leak_detect = time.time()
-        self._last_pressure_loss_time = time.time()
+        self._last_run_time = clock.time()
+        self._last_leak_detect = clock.time()
+        self._last_pressure_loss_time = clock.time()
 
         self._aspirate_last_log_time = None
 
@@ -1383,25 +1490,53 @@ class StateAspirate(State):
         self.FSM.machine.set_valve("valve1", 100)
 
         # wait a little while before opening valve3
-        time.sleep(1)
+        clock.sleep(1)
 
         # open valve3 to initial setting
         self.FSM.machine.set_valve("valve3", self._valve_setting)
 
+        # start heating the distiller already when the distillation follows the extraction
+        if self.FSM.machine.config.FSM_EV.preheat_enabled and self.FSM.fsmData["run_full_extraction"] == 1:
+            self.FSM.machine.preheat_on()
+
+    # Warns about a low flowrate and goes to the error state if valve3 is fully open and the flow is still
+    # below the limit, returns True on error.
+    def check_flow_with_valve_open(self):
+        # Check if current average flowrate is 2 times lower than the target flowrate.
+        # In case if it is, send a warning.
+        if self.eventDuration > 60 and self.flowrate_avg <= self._flowrate_warning_limit:
+            self._logger.warning("Current avg flowrate ({} mL/s) is 2 times lower than the target {} mL/s".format(self.flowrate_avg, self._flowrate_warning_limit))
+            self.warning = "Flow rate is lower than expected, try cleaning the machine and packing it less tight."
+
+        # Check if actual flowrate is lower than the limit. In case it is, trigger VALVE_1_OR_VALVE_3_BLOCKED error.
+        # This check happens after first 60 seconds of the run time.
+        if self.eventDuration > 60 and self.flowrate_avg <= self._flowrate_fall_limit:
+            self._logger.error("Error, valve is clogged, failure_mode=VALVE_1_OR_VALVE_3_BLOCKED.")
+            self.FSM.ToTransistion(StateId.ERROR)
+            self.FSM.fsmData["failure_mode"] = FailureMode.VALVE_1_OR_VALVE_3_BLOCKED
+            self.FSM.fsmData["failure_description"] = (
+                "Valve 1 is clogged and needs to be cleaned. Please reset the machine, pull out your herb "
+                "tube and follow the guideline to clear valves from our knowledgebase on drizzle.life"
+            )
+            return True
+
+        return False
+
     def Execute(self):
         super(StateAspirate, self).Execute()
 
         self.FSM.FSMOutputText = "Aspirating solvent"
+        self.FSM.machine.update_preheat()
 
         # if valve adjustment period has run, start next cycle
         if (
             self._last_run_time
-            + float(self.FSM.machine._config["FSM_EV"]["valve_adjust_delay"])
-        ) < time.time():
-            self._last_run_time = time.time()
+            + self.FSM.machine.config.FSM_EV.valve_adjust_delay
+        ) < clock.time():
+            self._last_run_time = clock.time()
 
             # sample time and pressure
-            self._current_time_stop = time.time()
+            self._current_time_stop = clock.time()
             self._pressure_test_stop = self.FSM.machine.pressure
 
             # calculate total aspiration volume based on volumechange, using a derived ideal gas equation
@@ -1409,7 +1544,7 @@ class StateAspirate(State):
             # historic_leak is an artifact from an attemp to implement on the fly leak testing. It is simply set to zero.
             # system_leak is kept static throughout the aspiration.
             leakfactor = math.get_leakfactor(
-                time.time(),
+                clock.time(),
                 self._last_leak_detect,
                 self._system_leak,
                 self._historic_leak,
@@ -1455,7 +1590,7 @@ class StateAspirate(State):
             self.FSM.SetFSMData("current_sample_period", self._current_sample_period)
 
             _aspirate_log_interval = 10 # log every ten seconds
-            if not self._aspirate_last_log_time or ((time.time() - self._aspirate_last_log_time) > _aspirate_log_interval):
+            if not self._aspirate_last_log_time or ((clock.time() - self._aspirate_last_log_time) > _aspirate_log_interval):
                 self._logger.info(
                     "Total aspirated: {} mL, Flow: {} mL/s, Actual Pressure Loss: {} mbar / sec, Total Calculated Pressure Loss: {} mbar, error_pct: {}%, step_size: {} steps, sample_period: {}s, flowrate avg {} mL/s".format(
                         self._total_volume_aspirated_stop,
@@ -1468,11 +1603,12 @@ class StateAspirate(State):
                         self.flowrate_avg,
                     )
                 )
-                self._aspirate_last_log_time = time.time()
+                self._aspirate_last_log_time = clock.time()
 
 
             # remeasure volume
-            self._current_time_start = time.time()
+            flow_sample_time = self._current_time_stop - self._current_time_start
+            self._current_time_start = clock.time()
             self._pressure_test_start = self.FSM.machine.pressure
             self._total_volume_aspirated_start = math.get_total_volume_aspiration(
                 self._total_volume,
@@ -1481,8 +1617,16 @@ class StateAspirate(State):
             )
 
             # adjust flow
+            if self._flow_controller is not None:
+                self._valve_setting = self._flow_controller.update(self._flowrate_actual, flow_sample_time)
+                if self._flowrate_actual > self._aspirate_speed_target:
+                    self.warning = None
+                elif self._valve_setting >= 100 and self.check_flow_with_valve_open():
+                    return
+                self.FSM.machine.set_valve("valve3", self._valve_setting)
+
             # adjust speed
-            if self._flowrate_actual > self._aspirate_speed_target:
+            elif self._flowrate_actual > self._aspirate_speed_target:
                 # decrease opening
                 self._valve_setting = self._valve_setting - self._current_step_size
                 if self._valve_setting < 0:
@@ -1490,36 +1634,18 @@ class StateAspirate(State):
                 self.FSM.machine.set_valve("valve3", self._valve_setting)
                 self.warning = None
 
-            if self._flowrate_actual < self._aspirate_speed_target:
+            elif self._flowrate_actual < self._aspirate_speed_target:
                 # increase opening
                 self._valve_setting = self._valve_setting + self._current_step_size
                 if self._valve_setting >= 100:
                     self._valve_setting = 100
-
-                    # Check if current average flowrate is 2 times lower than the target flowrate.
-                    # In case if it is, send a warning.
-                    if self.eventDuration > 60 and self.flowrate_avg <= self._flowrate_warning_limit:
-                        self._logger.warning("Current avg flowrate ({} mL/s) is 2 times lower than the target {} mL/s".format(self.flowrate_avg, self._flowrate_warning_limit))
-                        self.warning = "Flow rate is lower than expected, try cleaning the machine and packing it less tight."
-
-                    # Check if actual flowrate is lower than the limit. In case it is, trigger VALVE_1_OR_VALVE_3_BLOCKED error.
-                    # This check happens after first 60 seconds of the run time.
-                    if self.eventDuration > 60 and self.flowrate_avg <= self._flowrate_fall_limit:
-                        self._logger.error("Error, valve is clogged, failure_mode=VALVE_1_OR_VALVE_3_BLOCKED.")
-                        self.FSM.ToTransistion("toStateError")
-                        self.FSM.fsmData["failure_mode"] = FailureMode.VALVE_1_OR_VALVE_3_BLOCKED
-                        self.FSM.fsmData["failure_description"] = (
-                            "Valve 1 is clogged and needs to be cleaned. Please reset the machine, pull out your herb "
-                            "tube and follow the guideline to clear valves from our knowledgebase on drizzle.life"
-                        )
+                    if self.check_flow_with_valve_open():
                         return
 
                 self.FSM.machine.set_valve("valve3", self._valve_setting)
 
             # check if we should store last known good valve setting
-            valve_adjust_hysteresis = float(
-                self.FSM.machine._config["FSM_EV"]["valve_adjust_hysteresis"]
-            )
+            valve_adjust_hysteresis = self.FSM.machine.config.FSM_EV.valve_adjust_hysteresis
             if (
                 self._flowrate_actual
                 < (self._aspirate_speed_target + valve_adjust_hysteresis)
@@ -1530,35 +1656,29 @@ class StateAspirate(State):
                 # We are on target here, check if the value should be stored for later use
                 if not self._last_known_valve_setting_measured:
                     # store last known valve setting for later use
-                    self.FSM.machine._config["FSM_EV"][
-                        "valve_last_known_setting"
-                    ] = str("{:.02f}".format(self._valve_setting))
+                    self.FSM.machine.set_config_value(
+                        "FSM_EV", "valve_last_known_setting", "{:.02f}".format(self._valve_setting)
+                    )
                     self._last_known_valve_setting_measured = True
                     self._logger.info(
-                        "Stored last known valve setting: {}".format(
-                            self.FSM.machine._config["FSM_EV"][
-                                "valve_last_known_setting"
-                            ]
-                        )
+                        "Stored last known valve setting: {}".format(self.FSM.machine.config.FSM_EV.valve_last_known_setting)
                     )
 
             self._logger.info("Valve setting: {}".format(self._valve_setting))
 
             # check if evc chamber is filled
-            if self._total_volume_aspirated_stop > float(
-                self.FSM.machine._config["FSM_EX"]["aspirate_volume"]
-            ):
+            if self._total_volume_aspirated_stop > self.FSM.machine.config.FSM_EX.aspirate_volume:
                 # save config
                 self.FSM.machine.store_config()
 
                 # transit to either flush, distill or ready
-                if int(self.FSM.machine._config["FSM_EX"]["number_of_flushes"]) >= 1:
-                    self.FSM.ToTransistion("toStateFlush")
+                if self.FSM.machine.config.FSM_EX.number_of_flushes >= 1:
+                    self.FSM.ToTransistion(StateId.FLUSH)
                 else:
                     if self.FSM.fsmData["run_full_extraction"] == 1:
-                        self.FSM.ToTransistion("toStateDistillBulk")
+                        self.FSM.ToTransistion(StateId.DISTILL_BULK)
                     else:
-                        self.FSM.ToTransistion("toStateReady")
+                        self.FSM.ToTransistion(StateId.READY)
 
     def Exit(self):
         super(StateAspirate, self).Exit()
@@ -1582,73 +1702,90 @@ class StateFlush(State):
         self.pressure_achieved = False
         self.valves_opened = False
 
-        self.flush_start_time = time.time()
+        self.flush_start_time = clock.time()
 
         # depressurize
         self.FSM.FSMOutputText = "Flushing EXC - Depressurizing"
         self.humanReadableLabel = "Flushing"
 
         # close all valves
-        time.sleep(0.5)
+        clock.sleep(0.5)
         for valve in self.FSM.machine._myvalves:
             self.FSM.machine.set_valve(valve, 0)
 
         # Start pump at 100#
         self.FSM.machine.pump_value = 100
+        self._pump_down = self.FSM.machine.get_pump_down_model(
+            self.FSM.machine.config.FSM_EX.maximum_vacuum_pressure
+        )
 
     def Execute(self):
         super(StateFlush, self).Execute()
 
+        self.FSM.machine.update_preheat()
         pressure = self.FSM.machine.pressure
 
+        if self._pump_down is not None and not self.pressure_achieved:
+            if self.update_pump_down(self._pump_down, pressure, self.startTime):
+                self.fail_pump_down()
+                return
+
+            # valve2 only lets air into the EXC while valve3 is closed, so it opens during the last part of the
+            # pump-down and only valve3 is left to move once the pressure is reached
+            time_to_target = self._pump_down.time_to_target()
+            if time_to_target is not None and time_to_target <= self.FSM.machine.estimate_valve_move_time(
+                [("valve2", 100)]
+            ):
+                self.FSM.machine.set_valve("valve2", 100)
+
         # wait untill pressure is low enough
         if (
             pressure
-            < float(self.FSM.machine._config["FSM_EX"]["maximum_vacuum_pressure"])
+            < self.FSM.machine.config.FSM_EX.maximum_vacuum_pressure
             and not self.pressure_achieved
         ):
             self._logger.info("maximum vacuum pressure achieved")
-            self.flush_start_time = time.time()
+            self.flush_start_time = clock.time()
             self.pressure_achieved = True
 
         if self.pressure_achieved and not self.valves_opened:
             self.FSM.machine.set_valve("valve2", 100)
             self.FSM.machine.set_valve("valve3", 100)
             self.valves_opened = True
-            self.flush_start_time = time.time()
+            self.flush_start_time = clock.time()
 
         if self.valves_opened:
             # flush for seven seconds flush_time
-            if (time.time() - self.flush_start_time) > float(self.FSM.machine._config["FSM_EX"]["flush_time"]):
+            if (clock.time() - self.flush_start_time) > self.FSM.machine.config.FSM_EX.flush_time:
                 # add one to actual number of flushes performed
                 self.FSM.fsmData["flushes_performed"] = (
                     int(self.FSM.fsmData["flushes_performed"]) + 1
                 )
 
                 # Check if we need more flushes
-                if int(self.FSM.fsmData["flushes_performed"]) < int(
-                    self.FSM.machine._config["FSM_EX"]["number_of_flushes"]
-                ):
+                if int(self.FSM.fsmData["flushes_performed"]) < self.FSM.machine.config.FSM_EX.number_of_flushes:
                     self._logger.info(
                         "I have performed {} flushes, performing another flush!".format(
                             int(self.FSM.fsmData["flushes_performed"])
                         )
                     )
-                    self.FSM.ToTransistion("toStateExtraFlushDepressurize")
+                    # the heater is not regulated while topping up, preheat starts again with the next aspirate
+                    self.FSM.machine.preheat_off("extra flush")
+                    self.FSM.ToTransistion(StateId.EXTRA_FLUSH_DEPRESSURIZE)
                 else:
                     self._logger.info("Enought with the flushing allready!")
                     # check for full extraction cycle
                     if self.FSM.fsmData["run_full_extraction"] == 1:
-                        self.FSM.ToTransistion("toStateDistillBulk")
+                        self.FSM.ToTransistion(StateId.DISTILL_BULK)
                     else:
-                        self.FSM.ToTransistion("toStateReady")
+                        self.FSM.ToTransistion(StateId.READY)
 
 
 def Exit(self):
     super(StateFlush, self).Exit()
     # Turn off pump
     self.FSM.machine.pump_value = 0
-    time.sleep(1)
+    clock.sleep(1)
 
     # close all valves
     self._logger.info("Closing all valves")
@@ -1669,13 +1806,15 @@ class StateExtraFlushDepressurize(State):
         self.humanReadableLabel = "Flushing"
 
         # close all valves except 3
-        self.FSM.machine.set_valve("valve1", 0)
-        self.FSM.machine.set_valve("valve2", 0)
-        self.FSM.machine.set_valve("valve3", 100)
-        self.FSM.machine.set_valve("valve4", 0)
+        self.FSM.machine.set_valves(
+            [("valve1", 0), ("valve2", 0), ("valve3", 100), ("valve4", 0)]
+        )
 
         # Start pump at 100#
         self.FSM.machine.pump_value = 100
+        self._pump_down = self.FSM.machine.get_pump_down_model(
+            self.FSM.machine.config.FSM_EX.maximum_vacuum_pressure
+        )
 
     def Execute(self):
         super(StateExtraFlushDepressurize, self).Execute()
@@ -1684,11 +1823,11 @@ class StateExtraFlushDepressurize(State):
         self._logger.info(self.FSM.FSMOutputText)
 
         # Condition to see if we need to change state
-        if pressure < float(
-            self.FSM.machine._config["FSM_EX"]["maximum_vacuum_pressure"]
-        ):
-            self.FSM.ToTransistion("toStateTopUpEXC")
+        if pressure < self.FSM.machine.config.FSM_EX.maximum_vacuum_pressure:
+            self.FSM.ToTransistion(StateId.TOP_UP_EXC)
             self._logger.info("maximum vacuum pressure achieved")
+        elif self._pump_down is not None and self.update_pump_down(self._pump_down, pressure, self.startTime):
+            self.fail_pump_down()
 
     def Exit(self):
         super(StateExtraFlushDepressurize, self).Exit()
@@ -1696,10 +1835,9 @@ class StateExtraFlushDepressurize(State):
         self.FSM.machine.pump_value = 0
 
         # seal off EXC and equalize EVC
-        self.FSM.machine.set_valve("valve1", 0)
-        self.FSM.machine.set_valve("valve2", 0)
-        self.FSM.machine.set_valve("valve3", 0)
-        self.FSM.machine.set_valve("valve4", 100)
+        self.FSM.machine.set_valves(
+            [("valve1", 0), ("valve2", 0), ("valve3", 0), ("valve4", 100)]
+        )
 
         # wait for pressure to stabilize
         self.FSM.FSMOutputText = "Exiting depressuring state"
@@ -1713,8 +1851,8 @@ class StateDistillBulk(State):
 
     def get_progress(self):
         """Calculates progress percentage and ETA in seconds."""
-        now = time.time()
-        time_delta = time.time() - self._last_time_measure_time
+        now = clock.time()
+        time_delta = clock.time() - self._last_time_measure_time
         self._last_time_measure_time = now
         power_uptake = (self.FSM.machine._PID.current_window_power_average or self.FSM.machine.bottom_heater_percent) / 100
         if not self.FSM.fsmData["pause_flag"]:
@@ -1724,7 +1862,7 @@ class StateDistillBulk(State):
 
     def heater_temperature_increase_check(self):
         temperature = self.FSM.machine.bottom_temperature
-        elapsed_time = time.time() - self._temperature_capture_time
+        elapsed_time = clock.time() - self._temperature_capture_time
 
         # in case heater is already hot - skip check.
         if temperature >= self._temperature_check_threshold:
@@ -1741,18 +1879,18 @@ class StateDistillBulk(State):
                 self.FSM.fsmData["failure_mode"] = FailureMode.HEATER_ERROR
                 # TODO: @peter - add more details, mention cable issue?
                 self.FSM.fsmData["failure_description"] = "The heater stopped heating during the distill process."
-                self.FSM.ToTransistion("toStateError")
+                self.FSM.ToTransistion(StateId.ERROR)
             else:
                 self._temperature_check_required = False
 
     def check_fan_is_on(self):
         status = self.FSM.machine._fan_control.fan_adc_check
         self._logger.info("Checking fan status... Fan status is {}".format(status))
-        if status == module_fancontrol.FAN_ADC_LEVEL_ON:
+        if status == self.FSM.machine._fan_control.FAN_ADC_LEVEL_ON:
             self._fan_ok = True
         elif status is not None:
             self.FSM.fsmData["failure_mode"] = FailureMode.FAN_ERROR
-            self.FSM.ToTransistion("toStateError")
+            self.FSM.ToTransistion(StateId.ERROR)
             self.FSM.fsmData["failure_description"] = (
                 "Error, air fan seems to be defective. Please try again and if it still fails, contact "
                 "drizzle support."
@@ -1761,6 +1899,48 @@ class StateDistillBulk(State):
             # Fan not supported.
             self._fan_ok = True
 
+    # Restarts the change detection, the levels during the boil-off are learned again once the plate is back at the
+    # distillation temperature
+    def reset_change_detectors(self):
+        if self._change_detectors is None:
+            return
+        for detector in self._change_detectors:
+            detector.reset()
+        self._change_detection_start_time = None
+
+    # Called after every PID update, True when the heater power has dropped and either the pressure has dropped or
+    # the plate temperature has risen, the boil-off no longer takes the heat
+    def is_boil_off_ended(self):
+        if self._change_detectors is None:
+            return False
+
+        now = clock.time()
+        temperature = self.FSM.machine.bottom_temperature
+        if self._change_detection_start_time is None:
+            if temperature < self._distillation_temperature - 1:
+                return False
+            self._change_detection_start_time = now + self.FSM.machine.config.FSM_EV.distill_change_point_settle_time
+        if now < self._change_detection_start_time:
+            return False
+
+        power = self.FSM.machine.bottom_heater_percent
+        pressure = self.FSM.machine.pressure
+        power_detector, pressure_detector, temperature_detector = self._change_detectors
+        power_changed = power_detector.add(now, power)
+        pressure_changed = pressure_detector.add(now, pressure)
+        temperature_changed = temperature_detector.add(now, temperature)
+        if not (power_changed and (pressure_changed or temperature_changed)):
+            return False
+
+        self._logger.info(
+            "End of boil-off detected, heater power {:.02f}% (level {:.02f}%), pressure {:.02f} (level {:.02f}), "
+            "temperature {:.02f} (level {:.02f}), power started dropping {:.0f} seconds ago".format(
+                power, power_detector.reference, pressure, pressure_detector.reference,
+                temperature, temperature_detector.reference, now - power_detector.change_time,
+            )
+        )
+        return True
+
     def Enter(self):
         super(StateDistillBulk, self).Enter()
         self.FSM.FSMOutputText = "Init distillation"
@@ -1771,14 +1951,14 @@ class StateDistillBulk(State):
 
         # turn on alcohol sensor
         self.FSM.machine.set_alcohol_sensor_on()
-        self._alcohol_sensor_start_time = int(time.time())
+        self._alcohol_sensor_start_time = int(clock.time())
         self._alcohol_sensor_level_phase_one_passed = False
 
         # ambient pressure check
-        pressure_lower_bound = float(self.FSM.machine._config["FSM_EV"]["ambient_pressure_lower_bound"])
-        pressure_upper_bound = float(self.FSM.machine._config["FSM_EV"]["ambient_pressure_upper_bound"])
+        pressure_lower_bound = self.FSM.machine.config.FSM_EV.ambient_pressure_lower_bound
+        pressure_upper_bound = self.FSM.machine.config.FSM_EV.ambient_pressure_upper_bound
         self.FSM.machine.set_valve("valve4", 100)
-        time.sleep(3)
+        self.FSM.machine.wait_until(self.FSM.machine.pressure_settled(), 0, 3)
         current_pressure = self.FSM.machine.pressure
         self._logger.info(
             "Checking ambient pressure at the start of distill proces. Current pressure is {}".format(current_pressure)
@@ -1786,21 +1966,18 @@ class StateDistillBulk(State):
         if (current_pressure > pressure_upper_bound) or (current_pressure < pressure_lower_bound):
             self._logger.info("Error, bad ambient pressure level. Entering error state.")
             self.FSM.fsmData["failure_mode"] = FailureMode.PRESSURE_SENSOR_ERROR
-            self.FSM.ToTransistion("toStateError")
+            self.FSM.ToTransistion(StateId.ERROR)
             self.FSM.fsmData["failure_description"] = "Error, ambient pressure is either too low or too high. Pressure sensor is defective."
 
         # close all valves
-        self.FSM.machine.set_valve("valve1", 0)
-        self.FSM.machine.set_valve("valve2", 0)
-        self.FSM.machine.set_valve("valve3", 0)
-        self.FSM.machine.set_valve("valve4", 0)
+        self.FSM.machine.set_valves(
+            [("valve1", 0), ("valve2", 0), ("valve3", 0), ("valve4", 0)]
+        )
 
         self.FSM.machine.PID_on()
 
         # set PID target temp to 90 degrees
-        self.FSM.machine.set_PID_target(
-            float(self.FSM.machine._config["FSM_EV"]["distillation_temperature"])
-        )
+        self.FSM.machine.set_PID_target(self.FSM.machine.config.FSM_EV.distillation_temperature)
 
         self.FSM.fsmData["pressure_failure_counter"] = 0
 
@@ -1811,14 +1988,12 @@ class StateDistillBulk(State):
         self.FSM.machine.pump_value = 100
 
         # store start times
-        self._start_time = time.time()
+        self._start_time = clock.time()
         self._elapsed_time_seconds = 0
         self._last_time_measure_time = self._start_time
-        self._last_run_time = time.time()
-        self._last_heatplate_temperature_regulation = time.time()
-        self._distillation_temperature = float(
-            self.FSM.machine._config["FSM_EV"]["distillation_temperature"]
-        )
+        self._last_run_time = clock.time()
+        self._last_heatplate_temperature_regulation = clock.time()
+        self._distillation_temperature = self.FSM.machine.config.FSM_EV.distillation_temperature
         self._fan_check_interval_seconds = 180
         self._fan_last_check_time = None
         self._last_log_time = None
@@ -1828,11 +2003,11 @@ class StateDistillBulk(State):
         self._temperature_critical_level_start = None
         # temp check
         self._temperature_check_required = True
-        self._temperature_check_interval = int(self.FSM.machine._config["FSM_EV"]["temperature_check_interval"])
-        self._temperature_increase_threshold = int(self.FSM.machine._config["FSM_EV"]["temperature_increase_threshold"])
-        self._temperature_check_threshold = int(self.FSM.machine._config["FSM_EV"]["temperature_check_threshold"])
+        self._temperature_check_interval = self.FSM.machine.config.FSM_EV.temperature_check_interval
+        self._temperature_increase_threshold = self.FSM.machine.config.FSM_EV.temperature_increase_threshold
+        self._temperature_check_threshold = self.FSM.machine.config.FSM_EV.temperature_check_threshold
         self._temperature = self.FSM.machine.bottom_temperature
-        self._temperature_capture_time = time.time()
+        self._temperature_capture_time = clock.time()
         # fan check flag:
         self._fan_ok = None
 
@@ -1841,22 +2016,17 @@ class StateDistillBulk(State):
         self._pressure_reached_peak = 0
         self._pressure_peak_handling_start_time = None
         self._pressure_peak_detected_start_time = None
-        self._peak_pressure_detection_interval = float(
-            self.FSM.machine._config["FSM_EV"]["peak_pressure_detection_interval_seconds"]
-        )
-        self._peak_pressure_during_distill = float(
-            self.FSM.machine._config["FSM_EV"]["peak_pressure_during_distill"]
-        )
-        self._pressure_peak_handle_time_seconds =  float(
-            self.FSM.machine._config["FSM_EV"]["pressure_peak_handle_time_seconds"]
-        )
-        self._pressure_peak_max_pressure =  float(
-            self.FSM.machine._config["FSM_EV"]["pressure_peak_max_pressure"]
-        )
+        self._peak_pressure_detection_interval = self.FSM.machine.config.FSM_EV.peak_pressure_detection_interval_seconds
+        self._peak_pressure_during_distill = self.FSM.machine.config.FSM_EV.peak_pressure_during_distill
+        self._pressure_peak_handle_time_seconds =  self.FSM.machine.config.FSM_EV.pressure_peak_handle_time_seconds
+        self._pressure_peak_max_pressure =  self.FSM.machine.config.FSM_EV.pressure_peak_max_pressure
         self._pressure_peak_warning_sent = None
         self._new_cycle_started_time = None
-        # wait just two seconds to allow the fan to start
-        time.sleep(2)
+        # end of the bulk boil-off detected from heater power, pressure and plate temperature
+        self._change_detectors = self.FSM.machine.get_distill_change_detectors()
+        self._change_detection_start_time = None
+        # wait at most two seconds to allow the fan to start
+        self.FSM.machine.wait_until(self.FSM.machine.fan_running, 0, 2, interval=0.5)
 
     def Execute(self):
         super(StateDistillBulk, self).Execute()
@@ -1869,10 +2039,11 @@ class StateDistillBulk(State):
             self.FSM.machine.set_PID_target(0)
             self.FSM.machine.bottom_heater_percent = 0
             self.FSM.machine.pump_value = 0
-            self._last_run_time = time.time()
-            self._last_heatplate_temperature_regulation = time.time()
-            self._pause_time_start = time.time()
+            self._last_run_time = clock.time()
+            self._last_heatplate_temperature_regulation = clock.time()
+            self._pause_time_start = clock.time()
             self.onPause = True
+            self.reset_change_detectors()
         else:
             self.FSM.machine.set_PID_target(self._distillation_temperature)
             self.FSM.machine.pump_value = 100
@@ -1890,21 +2061,21 @@ class StateDistillBulk(State):
         # Log bottom heater temperature, bottom heater power (pct), gas sensor temperature, pressure
         # every 10 seconds when device is runnning and every minute when device is paused.
         _temperature_log_interval = self._temperature_log_interval if not self.FSM.fsmData["pause_flag"] else self._temperature_log_interval * 6
-        if not self._temperature_last_log_time or ((time.time() - self._temperature_last_log_time) > _temperature_log_interval):
+        if not self._temperature_last_log_time or ((clock.time() - self._temperature_last_log_time) > _temperature_log_interval):
             self._logger.info(
                 "Heater temperature: {:.02f}, Heater power: {:.02f}%, gas sensor temperature: {:.02f}, pressure: {:.02f}, PID target {}".format(
                     self.FSM.machine.bottom_temperature, self.FSM.machine.bottom_heater_percent, self.FSM.machine.gas_temperature,
                     self.FSM.machine.pressure, self.FSM.machine._PID.setpoint
                 )
             )
-            self._temperature_last_log_time = time.time()
+            self._temperature_last_log_time = clock.time()
 
         if self._handle_pressure_peak:
             # when pressure raises above 300mbar again - we turn off the heater for 10 mins and turn it on
             # after 10 mins and reduce output by 10% and send warning to device.
             # when pressure raises above 300mbar again - go into error state
             if self._pressure_peak_handling_start_time is None:
-                self._pressure_peak_handling_start_time = time.time()
+                self._pressure_peak_handling_start_time = clock.time()
 
             # send warning
             if self._pressure_peak_warning_sent is None:
@@ -1924,10 +2095,10 @@ class StateDistillBulk(State):
                     )
                 self.FSM.fsmData["failure_mode"] = FailureMode.PUMP_NEEDS_CLEAN_OR_REPLACEMENT
                 self.FSM.fsmData["failure_description"] = "Pump could not pull enough vacuum. Please refer to website for guide to cleaning your pump. If you have allready done so, the pump may be defective. Please contact support@drizzle.life"
-                self.FSM.ToTransistion("toStateError")
+                self.FSM.ToTransistion(StateId.ERROR)
                 return
 
-            handling_time = time.time() - self._pressure_peak_handling_start_time
+            handling_time = clock.time() - self._pressure_peak_handling_start_time
             if handling_time < self._pressure_peak_handle_time_seconds:
                 # turn off the heater for 10 mins
                 self.FSM.machine.set_PID_target(0)
@@ -1936,18 +2107,18 @@ class StateDistillBulk(State):
                 # venting at the start the cooldown sequence
                 if (handling_time < 5):
                     self.FSM.machine.set_valve("valve4", 100)
-                    time.sleep(5)
+                    clock.sleep(5)
                     self.FSM.machine.set_valve("valve4", 0)
                 # don't do anything else until pressure_peak_handle_time_seconds interval passes.
                 return
             else:
                 # venting at the end of the cooldown sequence
                 self.FSM.machine.set_valve("valve4", 100)
-                time.sleep(5)
+                clock.sleep(5)
                 self.FSM.machine.set_valve("valve4", 0)
                 # after waiting for 10 mins with heater off, reduce output by 10% and continue distill.
                 new_output_limit = self.FSM.machine.MAX_PID_POWER_OUTPUT - 10 * self._pressure_reached_peak
-                self.FSM.machine.reload_PID(pid_max_output_limit=new_output_limit)
+                self.FSM.machine.set_PID_output_limit(new_output_limit)
                 self.FSM.machine.set_PID_target(self._distillation_temperature)
                 self.FSM.machine.pump_value = 100
                 # reset peak handling state
@@ -1955,21 +2126,20 @@ class StateDistillBulk(State):
                 self._pressure_peak_handling_start_time = None
                 self._pressure_peak_warning_sent = None
                 self.warning = None
-                self._new_cycle_started_time = time.time()
+                self._new_cycle_started_time = clock.time()
+                self.reset_change_detectors()
 
         # check for pressure drop absolute limits
-        if (time.time() - self._last_run_time) > float(
-            self.FSM.machine._config["FSM_EV"]["time_delay_before_pressure_check"]
-        ):
+        if (clock.time() - self._last_run_time) > self.FSM.machine.config.FSM_EV.time_delay_before_pressure_check:
             pressure = self.FSM.machine.pressure
 
             # If the pressure rises above 300 mbar for 1 minute during distillation, we need to shut down the heating
             # element for 10 minutes, reduce the max output by 10% and then start again.
-            elapsed_time = time.time() - self._start_time
+            elapsed_time = clock.time() - self._start_time
             # when cooldown period to handle pressure peak is finished, we need to wait 30 seconds before starting measuring pressure again.
-            if self._new_cycle_started_time and (time.time() - self._new_cycle_started_time) > 30:
+            if self._new_cycle_started_time and (clock.time() - self._new_cycle_started_time) > 30:
                 self._new_cycle_started_time = None
-            new_cycle = (time.time() - self._new_cycle_started_time) < 30 if self._new_cycle_started_time else False
+            new_cycle = (clock.time() - self._new_cycle_started_time) < 30 if self._new_cycle_started_time else False
 
             if elapsed_time < 120 or new_cycle:
                 # wait before starting to check pressure.
@@ -1977,16 +2147,16 @@ class StateDistillBulk(State):
             elif 120 < elapsed_time < 600:
                 if pressure > self._pressure_peak_max_pressure:
                     if self._pressure_peak_detected_start_time is None:
-                        self._pressure_peak_detected_start_time = time.time()
+                        self._pressure_peak_detected_start_time = clock.time()
 
-                    if ((time.time() - self._pressure_peak_detected_start_time) > self._peak_pressure_detection_interval):
+                    if ((clock.time() - self._pressure_peak_detected_start_time) > self._peak_pressure_detection_interval):
                         self.FSM.machine.pump_value = 0
                         self.FSM.machine.set_PID_target(0)
                         self.FSM.machine.bottom_heater_percent = 0
                         self.FSM.machine.set_valve("valve4", 100)
                         self._logger.error("Error, pressure reached {:.02f} during distillation".format(pressure))
                         self.FSM.fsmData["failure_mode"] = FailureMode.PUMP_NEEDS_CLEAN_OR_REPLACEMENT
-                        self.FSM.ToTransistion("toStateError")
+                        self.FSM.ToTransistion(StateId.ERROR)
                         self.FSM.fsmData["failure_description"] = "Error, pressure is way to high during distillation. Pump could not pull enough vacuum. Please refer to website for guide to cleaning your pump. If you have allready done so, the pump may be defective. Please contact support@drizzle.life"
                         return
                 else:
@@ -1995,9 +2165,9 @@ class StateDistillBulk(State):
             else:
                 if pressure > self._peak_pressure_during_distill:
                     if self._pressure_peak_detected_start_time is None:
-                        self._pressure_peak_detected_start_time = time.time()
+                        self._pressure_peak_detected_start_time = clock.time()
 
-                    if not self._handle_pressure_peak and ((time.time() - self._pressure_peak_detected_start_time) > self._peak_pressure_detection_interval):
+                    if not self._handle_pressure_peak and ((clock.time() - self._pressure_peak_detected_start_time) > self._peak_pressure_detection_interval):
                         self._logger.warning("Warning - pressure peak {:.02f} detected.".format(pressure))
                         self._handle_pressure_peak = True
                         self._pressure_reached_peak += 1
@@ -2006,7 +2176,7 @@ class StateDistillBulk(State):
                     self._pressure_peak_detected_start_time = None
 
             # this checks that we are below the absolute maximum permissible target for pressure during distillation
-            if not new_cycle and pressure > float(self.FSM.machine._config["FSM_EV"]["error_pressure_during_distill"]):
+            if not new_cycle and pressure > self.FSM.machine.config.FSM_EV.error_pressure_during_distill:
                 self.FSM.fsmData["pressure_failure_counter"] += 1
                 self._logger.warning(
                     "Warning - critical distillation pressure, waiting a little before triggering error"
@@ -2024,43 +2194,41 @@ class StateDistillBulk(State):
                     self.FSM.machine.pump_value = 0
                     self.FSM.machine.set_PID_target(0)
                     self.FSM.machine.bottom_heater_percent = 0
-                    time.sleep(3)
-                    time_before = time.time()
+                    clock.sleep(3)
+                    time_before = clock.time()
                     pressure_before = self.FSM.machine.pressure
-                    time.sleep(3)
+                    clock.sleep(3)
                     pressure_after = self.FSM.machine.pressure
-                    time_after = time.time()
-                    pressure_increase_threshold = float(self.FSM.machine._config["FSM_EV"]["error_pressure_increase_threshold"])
+                    time_after = clock.time()
+                    pressure_increase_threshold = self.FSM.machine.config.FSM_EV.error_pressure_increase_threshold
                     pressure_increase = (pressure_after - pressure_before) / (time_after - time_before)
                     if pressure_increase > pressure_increase_threshold:
                         self._logger.error("Error, pressure reached {} during distillation".format(pressure))
                         self.FSM.fsmData["failure_mode"] = FailureMode.EVC_LEAK
-                        self.FSM.ToTransistion("toStateError")
+                        self.FSM.ToTransistion(StateId.ERROR)
                         self.FSM.fsmData["failure_description"] = "Error, pressure is way to high during distillation. Detected leak in distillation chamber."
                     else:
                         self._logger.error("Error, pressure reached {} during distillation".format(pressure))
                         self.FSM.fsmData["failure_mode"] = FailureMode.PUMP_NEEDS_CLEAN_OR_REPLACEMENT
-                        self.FSM.ToTransistion("toStateError")
+                        self.FSM.ToTransistion(StateId.ERROR)
                         self.FSM.fsmData["failure_description"] = "Error, pressure is way to high during distillation. Pump could not pull enough vacuum. Please refer to website for guide to cleaning your pump. If you have allready done so, the pump may be defective. Please contact support@drizzle.life"
             else:
                 self.FSM.fsmData["pressure_failure_counter"] = 0
 
         # Temperature check. If temperature stays more than ["FSM_EV"]["temperature_critical_level"] during more than
         # ["FSM_EV"]["temperature_check_interval"] seconds, device will enter error state
-        if (time.time() - self._last_run_time) > float(
-            self.FSM.machine._config["FSM_EV"]["temperature_check_interval"]
-        ):
+        if (clock.time() - self._last_run_time) > self.FSM.machine.config.FSM_EV.temperature_check_interval:
             temperature = self.FSM.machine.bottom_temperature
-            if temperature >= int(self.FSM.machine._config["FSM_EV"]["temperature_critical_level"]):
+            if temperature >= self.FSM.machine.config.FSM_EV.temperature_critical_level:
                 if self._temperature_critical_level_start is None:
-                    self._temperature_critical_level_start = time.time()
-                temperature_critical_level_time = time.time() - self._temperature_critical_level_start
+                    self._temperature_critical_level_start = clock.time()
+                temperature_critical_level_time = clock.time() - self._temperature_critical_level_start
                 self._logger.info(
                     "Warning, temperature reached {} during distillation".format(
                         temperature
                     )
                 )
-                if temperature_critical_level_time >= int(self.FSM.machine._config["FSM_EV"]["temperature_critical_level_max_interval"]):
+                if temperature_critical_level_time >= self.FSM.machine.config.FSM_EV.temperature_critical_level_max_interval:
                     self._logger.error(
                         "Error, temperature reached critical level {} during distillation".format(
                             temperature
@@ -2068,7 +2236,7 @@ class StateDistillBulk(State):
                     )
                     self.FSM.fsmData["failure_mode"] = FailureMode.THERMAL_RUNAWAY
                     self.FSM.fsmData["failure_description"] = "The temperature of the heater plate exceeded the maximum level. Please reset and try again. If the error occurs again, please contact support@drizzle.life"
-                    self.FSM.ToTransistion("toStateError")
+                    self.FSM.ToTransistion(StateId.ERROR)
                     return
             else:
                 self._temperature_critical_level_start = None
@@ -2078,9 +2246,7 @@ class StateDistillBulk(State):
             # if adjustment period has run, start next cycle
             if self.FSM.machine.update_PID(log=False):
                 current_power_average = self.FSM.machine._PID.current_window_power_average
-                cutoff_limit = float(
-                    self.FSM.machine._config["PID"]["wattage_decrease_limit"]
-                )
+                cutoff_limit = self.FSM.machine.config.PID.wattage_decrease_limit
                 output = self.FSM.machine.bottom_heater_percent
                 current_temp = self.FSM.machine.bottom_temperature
                 target = self.FSM.machine._PID.setpoint
@@ -2089,11 +2255,13 @@ class StateDistillBulk(State):
                 if self.FSM.fsmData['force_afterstill'] == True:
                     self.FSM.fsmData['force_afterstill'] = False
                     self._logger.info("User forced me to afterstill")
-                    self.FSM.ToTransistion("toStateAfterDistill")
-                if current_power_average:
-                    if current_power_average < cutoff_limit:
-                        self._logger.info("Bulk distillation done")
-                        self.FSM.ToTransistion("toStateAfterDistill")
+                    self.FSM.ToTransistion(StateId.AFTER_DISTILL)
+                if current_power_average and current_power_average < cutoff_limit:
+                    self._logger.info("Bulk distillation done")
+                    self.FSM.ToTransistion(StateId.AFTER_DISTILL)
+                elif self.is_boil_off_ended():
+                    self._logger.info("Bulk distillation done, boil-off has ended")
+                    self.FSM.ToTransistion(StateId.AFTER_DISTILL)
 
     def Exit(self):
         super(StateDistillBulk, self).Exit()
@@ -2117,9 +2285,7 @@ class StateAfterDistill(State):
         self.humanReadableLabel = "Removing trace solvent"
 
         # set PID target temp to target
-        self.FSM.machine.set_PID_target(
-            float(self.FSM.machine._config["FSM_EV"]["after_heat_temp"])
-        )
+        self.FSM.machine.set_PID_target(self.FSM.machine.config.FSM_EV.after_heat_temp)
 
         # start fan
         self.FSM.machine.fan_value = 100
@@ -2127,16 +2293,14 @@ class StateAfterDistill(State):
         # start pump
         self.FSM.machine.pump_value = 100
 
-        self._last_run_time = time.time()
+        self._last_run_time = clock.time()
 
     def Execute(self):
         super(StateAfterDistill, self).Execute()
         self.FSM.FSMOutputText = "Distilling"
         # frequency between each adjustment Fetch this from dictionary
 
-        self.FSM.machine.set_PID_target(
-            float(self.FSM.machine._config["FSM_EV"]["after_heat_temp"])
-        )
+        self.FSM.machine.set_PID_target(self.FSM.machine.config.FSM_EV.after_heat_temp)
 
         # if adjustment period has run, start next cycle
         self.FSM.machine.update_PID()
@@ -2144,11 +2308,11 @@ class StateAfterDistill(State):
         # check for initieal heater completion
         if (
             self._last_run_time
-            + float(self.FSM.machine._config["FSM_EV"]["after_heat_time"])
-            < time.time()
+            + self.FSM.machine.config.FSM_EV.after_heat_time
+            < clock.time()
         ):
             self._logger.info("After heat done")
-            self.FSM.ToTransistion("toStateFinalSolventRemoval")
+            self.FSM.ToTransistion(StateId.FINAL_SOLVENT_REMOVAL)
 
     def Exit(self):
         super(StateAfterDistill, self).Exit()
@@ -2167,9 +2331,7 @@ class StateFinalSolventRemoval(State):
         self.humanReadableLabel = "Removing trace solvent"
 
         # set PID target temp to target
-        self.FSM.machine.set_PID_target(
-            float(self.FSM.machine._config["FSM_EV"]["after_heat_temp"])
-        )
+        self.FSM.machine.set_PID_target(self.FSM.machine.config.FSM_EV.after_heat_temp)
 
         # start fan
         self.FSM.machine.fan_value = 100
@@ -2177,56 +2339,111 @@ class StateFinalSolventRemoval(State):
         # start pump
         self.FSM.machine.pump_value = 100
 
-        self._last_run_time = time.time()
+        self._last_run_time = clock.time()
 
         self._airing_counter = 0
-        self._final_air_cycles = int(
-            self.FSM.machine._config["FSM_EV"]["final_air_cycles"]
+        self._final_air_cycles = self.FSM.machine.config.FSM_EV.final_air_cycles
+
+        # with the pump stopped at the end of a closed phase the EVC is sealed, the pressure rise above the
+        # system leak is solvent still boiling off the residue
+        self._adaptive = self.FSM.machine.config.FSM_EV.final_air_cycles_adaptive
+        self._rebound_start_pressure = None
+        self._rebound_start_time = None
+        self._quiet_cycles = 0
+        self.FSM.fsmData["final_air_cycles_performed"] = 0
+
+    # Called at the end of every closed phase, True when the rebound has stayed below the threshold for
+    # final_air_quiet_cycles closed phases in a row
+    def is_solvent_removed(self):
+        settings = self.FSM.machine.config.FSM_EV
+        if self._rebound_start_pressure is None:
+            return False
+
+        rebound_time = clock.time() - self._rebound_start_time
+        rebound = (
+            self.FSM.machine.pressure
+            - self._rebound_start_pressure
+            - self.FSM.fsmData["system_leak"] * rebound_time
+        )
+        self._rebound_start_pressure = None
+
+        if rebound < settings.final_air_rebound_threshold:
+            self._quiet_cycles += 1
+        else:
+            self._quiet_cycles = 0
+        self._logger.info(
+            "Pressure rebound: {:.02f} mbar in {:.02f} seconds, {} quiet cycles".format(
+                rebound, rebound_time, self._quiet_cycles
+            )
         )
+        return self._quiet_cycles >= settings.final_air_quiet_cycles
 
     def Execute(self):
         super(StateFinalSolventRemoval, self).Execute()
         self.FSM.FSMOutputText = "Removing traces of solvent"
         # frequency between each adjustment Fetch this from dictionary
 
-        self.FSM.machine.set_PID_target(
-            float(self.FSM.machine._config["FSM_EV"]["after_heat_temp"])
-        )
+        self.FSM.machine.set_PID_target(self.FSM.machine.config.FSM_EV.after_heat_temp)
 
         # if adjustment period has run, start next cycle
         self.FSM.machine.update_PID(log=False)
 
         # open and close valves for the defined number of times
         if self._airing_counter % 2 == 0:
+            # seal the EVC for the last part of the closed phase
+            if (
+                self._adaptive
+                and self._rebound_start_pressure is None
+                and self._last_run_time
+                + self.FSM.machine.config.FSM_EV.final_air_cycles_time_closed
+                - self.FSM.machine.config.FSM_EV.final_air_rebound_time
+                < clock.time()
+            ):
+                self.FSM.machine.pump_value = 0
+                self._rebound_start_pressure = self.FSM.machine.pressure
+                self._rebound_start_time = clock.time()
+
             #check for next open state
             if (
                 self._last_run_time
-                + float(self.FSM.machine._config["FSM_EV"]["final_air_cycles_time_closed"])
-                < time.time()
+                + self.FSM.machine.config.FSM_EV.final_air_cycles_time_closed
+                < clock.time()
             ):
+                if self._adaptive and self.is_solvent_removed():
+                    self.FSM.fsmData["final_air_cycles_performed"] = self._airing_counter // 2
+                    self._logger.info(
+                        "Solvent removed after {} of {} air cycles".format(
+                            self.FSM.fsmData["final_air_cycles_performed"], self._final_air_cycles
+                        )
+                    )
+                    self.FSM.ToTransistion(StateId.READY)
+                    return
+
+                self.FSM.machine.pump_value = 100
                 self.FSM.machine.set_valve("valve4", 100)
                 # store last runtime
-                self._last_run_time = time.time()
+                self._last_run_time = clock.time()
                 # increase cycle counter
                 self._airing_counter += 1
         else:
             #check for next close state
             if (
                 self._last_run_time
-                + float(self.FSM.machine._config["FSM_EV"]["final_air_cycles_time_open"])
-                < time.time()
+                + self.FSM.machine.config.FSM_EV.final_air_cycles_time_open
+                < clock.time()
             ):
                 self.FSM.machine.set_valve("valve4", 0)
                 # store last runtime
-                self._last_run_time = time.time()
+                self._last_run_time = clock.time()
                 # increase cycle counter
                 self._airing_counter += 1
 
         if self._airing_counter >= (
-            int(self.FSM.machine._config["FSM_EV"]["final_air_cycles"]) * 2
+            self.FSM.machine.config.FSM_EV.final_air_cycles * 2
         ):
             # we check for double the amount of cycles because an cycle is open AND close
-            self.FSM.ToTransistion("toStateReady")
+            self.FSM.fsmData["final_air_cycles_performed"] = self._airing_counter // 2
+            self.FSM.ToTransistion(StateId.READY)
 
     def Exit(self):
         super(StateFinalSolventRemoval, self).Exit()
@@ -2260,12 +2477,11 @@ class StateVentPump(State):
         self.FSM.machine.set_alcohol_sensor_on()
 
         # close all valves
-        self.FSM.machine.set_valve("valve1", 0)
-        self.FSM.machine.set_valve("valve2", 0)
-        self.FSM.machine.set_valve("valve3", 0)
-        self.FSM.machine.set_valve("valve4", 0)
+        self.FSM.machine.set_valves(
+            [("valve1", 0), ("valve2", 0), ("valve3", 0), ("valve4", 0)]
+        )
 
-        self._last_run_time = time.time()
+        self._last_run_time = clock.time()
 
         self._current_vent_state = "depressurize"
         self._depressure_time = 20
@@ -2281,22 +2497,22 @@ class StateVentPump(State):
 
         if self._current_vent_state == "depressurize":
             # reduce pressure
-            if self._last_run_time + self._depressure_time < time.time():
+            if self._last_run_time + self._depressure_time < clock.time():
                 # switch to vent state
                 self._current_vent_state = "venting"
                 # open valve4
                 self.FSM.machine.set_valve("valve4", 100)
                 # reset state
-                self._last_run_time = time.time()
+                self._last_run_time = clock.time()
         elif self._current_vent_state == "venting":
             # vent untill done
-            if self._last_run_time + self._vent_time < time.time():
+            if self._last_run_time + self._vent_time < clock.time():
                 # switch to vent state
                 self._current_vent_state = "depressurize"
                 # open valve4
                 self.FSM.machine.set_valve("valve4", 0)
                 # reset state
-                self._last_run_time = time.time()
+                self._last_run_time = clock.time()
 
                 # increase cycle counter
                 self._airing_counter += 1
@@ -2305,9 +2521,9 @@ class StateVentPump(State):
             # if this flad is set, it means the pump vent was started during a run
             if self.FSM.startExtractAfterVent:
                 self.FSM.startExtractAfterVent = False
-                self.FSM.ToTransistion("toStateSystemCheck")
+                self.FSM.ToTransistion(StateId.SYSTEM_CHECK)
             else:
-                self.FSM.ToTransistion("toStateReady")
+                self.FSM.ToTransistion(StateId.READY)
 
     def Exit(self):
         super(StateVentPump, self).Exit()
@@ -2340,33 +2556,29 @@ class StateDecarb(State):
         self.FSM.machine.PID_on()
 
         # set PID target temp to decarb temp degrees
-        self.FSM.machine.set_PID_target(
-            float(self.FSM.machine._config["DECARB"]["temperature"])
-        )
+        self.FSM.machine.set_PID_target(self.FSM.machine.config.DECARB.temperature)
 
         # turn on warm light
         self.FSM.machine.light_warm()
 
-        self._decarb_start_time = time.time()
+        self._decarb_start_time = clock.time()
 
     def Execute(self):
         super(StateDecarb, self).Execute()
         self.FSM.FSMOutputText = "Decarboxylating"
 
-        self.FSM.machine.set_PID_target(
-            float(self.FSM.machine._config["DECARB"]["temperature"])
-        )
+        self.FSM.machine.set_PID_target(self.FSM.machine.config.DECARB.temperature)
 
         self.FSM.machine.update_PID()
 
         if (
             self._decarb_start_time
-            + (60 * float(self.FSM.machine._config["DECARB"]["time_minutes"]))
-            < time.time()
+            + (60 * self.FSM.machine.config.DECARB.time_minutes)
+            < clock.time()
         ):
             self._logger.info("Decarboxylation done")
             # we check for double the amount of cycles because an cycle is open AND close
-            self.FSM.ToTransistion("toStateReady")
+            self.FSM.ToTransistion(StateId.READY)
 
     def Exit(self):
         super(StateDecarb, self).Exit()
@@ -2376,6 +2588,82 @@ class StateDecarb(State):
         self.FSM.machine.bottom_heater_percent = 0
 
 
+# Autotune state, runs a relay experiment on the bottom heater and stores the resulting PID gains
+class StateAutotune(State):
+    def __init__(self, FSM):
+        super(StateAutotune, self).__init__(FSM)
+
+    def Enter(self):
+        super(StateAutotune, self).Enter()
+        self.FSM.FSMOutputText = "Init PID autotune"
+        self.humanReadableLabel = "Tuning heater"
+
+        # open all valves
+        self.FSM.machine.set_valves_in_relax_position()
+
+        # the heater is driven directly by the relay, not by the PID
+        self.FSM.machine.PID_off()
+
+        # turn on warm light
+        self.FSM.machine.light_warm()
+
+        config = self.FSM.machine.config.AUTOTUNE
+        self._tuning_rule = config.tuning_rule
+        self._max_variation = config.max_variation
+        self._max_gains = (
+            config.max_pterm,
+            config.max_iterm,
+            config.max_dterm,
+        )
+        self._autotuner = RelayAutotuner(
+            setpoint=config.setpoint,
+            output_high=min(config.output_high, self.FSM.machine.MAX_PID_POWER_OUTPUT),
+            output_low=config.output_low,
+            hysteresis=config.hysteresis,
+            cycles=config.cycles,
+            timeout_seconds=60 * config.timeout_minutes,
+            max_temperature=config.max_temperature,
+        )
+        self._logger.info(
+            "Starting relay autotune around {:.1f} degrees".format(self._autotuner.setpoint)
+        )
+
+    def Execute(self):
+        super(StateAutotune, self).Execute()
+        self.FSM.FSMOutputText = "Tuning heater"
+
+        output = self._autotuner.update(clock.time(), self.FSM.machine.bottom_temperature)
+        self.FSM.machine.bottom_heater_percent = output
+        self.progressPercentage = self._autotuner.progress
+
+        if self._autotuner.error:
+            self._logger.error("Autotune failed: {}".format(self._autotuner.error))
+            self.FSM.ToTransistion(StateId.READY)
+
+        elif self._autotuner.done:
+            try:
+                gains = self._autotuner.gains(self._tuning_rule)
+                self._autotuner.validate(gains, self._max_variation, self._max_gains)
+            except AutotuneError as error:
+                self._logger.error("Autotune result rejected, keeping current PID gains: {}".format(error))
+            else:
+                ultimate_gain, ultimate_period, amplitude, _, _ = self._autotuner.result()
+                self._logger.info(
+                    "Autotune done - Ku: {:.3f}; Pu: {:.1f}s; amplitude: {:.2f} degrees".format(
+                        ultimate_gain, ultimate_period, amplitude
+                    )
+                )
+                self.FSM.machine.store_PID_gains(*gains)
+
+            self.FSM.ToTransistion(StateId.READY)
+
+    def Exit(self):
+        super(StateAutotune, self).Exit()
+        self.FSM.machine.light_off()
+        self.FSM.machine.PID_off()
+        self.FSM.machine.bottom_heater_percent = 0
+
+
 # Cooldown state
 class StateCooldown(State):
     def __init__(self, FSM):
@@ -2410,30 +2698,26 @@ class StateMixOil(State):
         self.FSM.machine.light_warm()
 
         # set PID target temp to decarb temp degrees
-        self.FSM.machine.set_PID_target(
-            float(self.FSM.machine._config["OIL_MIX"]["temperature"])
-        )
+        self.FSM.machine.set_PID_target(self.FSM.machine.config.OIL_MIX.temperature)
 
-        self._oilmix_start_time = time.time()
+        self._oilmix_start_time = clock.time()
 
     def Execute(self):
         super(StateMixOil, self).Execute()
         self.FSM.FSMOutputText = "Oil mixing"
 
-        self.FSM.machine.set_PID_target(
-            float(self.FSM.machine._config["OIL_MIX"]["temperature"])
-        )
+        self.FSM.machine.set_PID_target(self.FSM.machine.config.OIL_MIX.temperature)
 
         self.FSM.machine.update_PID()
 
         if (
             self._oilmix_start_time
-            + (60 * float(self.FSM.machine._config["OIL_MIX"]["time_minutes"]))
-            < time.time()
+            + (60 * self.FSM.machine.config.OIL_MIX.time_minutes)
+            < clock.time()
         ):
             self._logger.info("Oil mixing done")
             # we check for double the amount of cycles because an cycle is open AND close
-            self.FSM.ToTransistion("toStateReady")
+            self.FSM.ToTransistion(StateId.READY)
 
     def Exit(self):
         super(StateMixOil, self).Exit()
@@ -2457,21 +2741,18 @@ class StateCleanPump(State):
 
         # turn on alcohol sensor
         self.FSM.machine.set_alcohol_sensor_on()
-        self._alcohol_sensor_start_time = int(time.time())
+        self._alcohol_sensor_start_time = int(clock.time())
         self._alcohol_sensor_level_phase_one_passed = False
 
         # close all valves
-        self.FSM.machine.set_valve("valve1", 0)
-        self.FSM.machine.set_valve("valve2", 0)
-        self.FSM.machine.set_valve("valve3", 0)
-        self.FSM.machine.set_valve("valve4", 0)
+        self.FSM.machine.set_valves(
+            [("valve1", 0), ("valve2", 0), ("valve3", 0), ("valve4", 0)]
+        )
 
         self.FSM.machine.PID_on()
 
         # set PID target temp to 90 degrees
-        self.FSM.machine.set_PID_target(
-            float(self.FSM.machine._config["FSM_EV"]["distillation_temperature"])
-        )
+        self.FSM.machine.set_PID_target(self.FSM.machine.config.FSM_EV.distillation_temperature)
 
         # start fan
         self.FSM.machine.fan_value = 100
@@ -2479,17 +2760,15 @@ class StateCleanPump(State):
         # start pump
         self.FSM.machine.pump_value = 100
 
-        self._distillation_temperature = float(
-            self.FSM.machine._config["FSM_EV"]["distillation_temperature"]
-        )
+        self._distillation_temperature = self.FSM.machine.config.FSM_EV.distillation_temperature
         self._last_log_time = None
         self._log_interval = 5
 
-        self._start_time = time.time()
+        self._start_time = clock.time()
         self._elapsed_time_seconds = 0
         self._last_time_measure_time = self._start_time
-        self._last_run_time = time.time()
-        self._last_heatplate_temperature_regulation = time.time()
+        self._last_run_time = clock.time()
+        self._last_heatplate_temperature_regulation = clock.time()
 
     def Execute(self):
         super(StateCleanPump, self).Execute()
@@ -2498,9 +2777,9 @@ class StateCleanPump(State):
         if self.FSM.fsmData["pause_flag"]:
             self.FSM.machine.set_PID_target(0)
             self.FSM.machine.pump_value = 0
-            self._last_run_time = time.time()
-            self._last_heatplate_temperature_regulation = time.time()
-            self._pause_time_start = time.time()
+            self._last_run_time = clock.time()
+            self._last_heatplate_temperature_regulation = clock.time()
+            self._pause_time_start = clock.time()
         else:
             self.FSM.machine.set_PID_target(self._distillation_temperature)
             self.FSM.machine.pump_value = 100
@@ -2510,9 +2789,7 @@ class StateCleanPump(State):
             # if adjustment period has run, start next cycle
             if self.FSM.machine.update_PID(log=False):
                 current_power_average = self.FSM.machine._PID.current_window_power_average
-                cutoff_limit = float(
-                    self.FSM.machine._config["PID"]["wattage_decrease_limit"]
-                )
+                cutoff_limit = self.FSM.machine.config.PID.wattage_decrease_limit
                 output = self.FSM.machine.bottom_heater_percent
                 current_temp = self.FSM.machine.bottom_temperature
                 target = self.FSM.machine._PID.setpoint
@@ -2521,18 +2798,104 @@ class StateCleanPump(State):
                 if current_power_average:
                     if current_power_average < cutoff_limit:
                         self._logger.info("Pump clean done")
-                        self.FSM.ToTransistion("toStateReady")
+                        self.FSM.ToTransistion(StateId.READY)
     def Exit(self):
         super(StateCleanPump, self).Exit()
         # set output power to zero
+        self.FSM.machine.PID_off()
         self.FSM.machine.set_PID_target(0)
         self.FSM.machine.bottom_heater_percent = 0
         self.FSM.machine.set_valves_in_relax_position()
         self.FSM.FSMOutputText = "Exiting clean pump"
         self._logger.info(self.FSM.FSMOutputText)
 
+
+# =====================================================
+##STATE GRAPH - every state with its human readable handle, class and the states it may go to.
+# Any state may go to the error state. Program states are entered from ready by commands.
+STATE_GRAPH = (
+    (StateId.ERROR, "Error", StateError, ()),
+    (
+        StateId.READY, "Ready", StateReady,
+        (
+            StateId.SYSTEM_CHECK,
+            StateId.DISTILL_BULK,
+            StateId.DECARB,
+            StateId.AUTOTUNE,
+            StateId.MIX_OIL,
+            StateId.VENT_PUMP,
+            StateId.CLEAN_PUMP,
+        ),
+    ),
+    (StateId.SYSTEM_CHECK, "Checking System", StateSystemCheck, (StateId.PRE_FILL_TUBES, StateId.VENT_PUMP)),
+    (StateId.PRE_FILL_TUBES, "Prefilling tubes", StatePreFillTubes, (StateId.FIRST_DEPRESSURIZE,)),
+    (StateId.FIRST_DEPRESSURIZE, "Depressurize", StateFirstDepressurize, (StateId.MEASURE_EXC_VOLUME,)),
+    (StateId.MEASURE_EXC_VOLUME, "Measure exc volume", StateMeasureEXCVolume, (StateId.SECOND_DEPRESSURIZE,)),
+    (StateId.SECOND_DEPRESSURIZE, "Depressurize", StateSecondDepressurize, (StateId.SECOND_LEAK_CHECK,)),
+    (StateId.SECOND_LEAK_CHECK, "Check leaks", StateSecondLeakCheck, (StateId.TOP_UP_EXC,)),
+    (StateId.TOP_UP_EXC, "Topping up", StateTopUpEXC, (StateId.SOAK,)),
+    (StateId.SOAK, "Soak", StateSoak, (StateId.THIRD_DEPRESSURIZE,)),
+    (StateId.THIRD_DEPRESSURIZE, "Depressurising", StateThirdDepressurize, (StateId.ASPIRATE,)),
+    (StateId.ASPIRATE, "Aspirate", StateAspirate, (StateId.FLUSH, StateId.DISTILL_BULK, StateId.READY)),
+    (
+        StateId.FLUSH, "Flushing", StateFlush,
+        (StateId.EXTRA_FLUSH_DEPRESSURIZE, StateId.DISTILL_BULK, StateId.READY),
+    ),
+    (StateId.EXTRA_FLUSH_DEPRESSURIZE, "Depressuring for flush", StateExtraFlushDepressurize, (StateId.TOP_UP_EXC,)),
+    (StateId.DISTILL_BULK, "DistillBulk", StateDistillBulk, (StateId.AFTER_DISTILL,)),
+    (StateId.AFTER_DISTILL, "AfterDistill", StateAfterDistill, (StateId.FINAL_SOLVENT_REMOVAL,)),
+    (StateId.FINAL_SOLVENT_REMOVAL, "FinalSolventRemoval", StateFinalSolventRemoval, (StateId.READY,)),
+    (StateId.DECARB, "Decarboxylating", StateDecarb, (StateId.READY,)),
+    (StateId.AUTOTUNE, "Autotune", StateAutotune, (StateId.READY,)),
+    (StateId.COOLDOWN, "Cooling down", StateCooldown, (StateId.READY,)),
+    (StateId.MIX_OIL, "Mixing Oil", StateMixOil, (StateId.READY,)),
+    (StateId.VENT_PUMP, "Venting Pump", StateVentPump, (StateId.READY, StateId.SYSTEM_CHECK)),
+    (StateId.CLEAN_PUMP, "CleanPump", StateCleanPump, (StateId.READY,)),
+)
+
+
+def build_transition_table(graph):
+    """Validate a state graph and return the allowed target states of every state.
+
+    :param graph: tuple of (StateId, handle, state class, target StateIds) tuples.
+    """
+    stateIds = [stateId for stateId, _, _, _ in graph]
+    if len(set(stateIds)) != len(stateIds):
+        raise InvalidTransitionError("State graph has duplicate states")
+    missing = set(StateId) - set(stateIds)
+    if missing:
+        raise InvalidTransitionError("State graph is missing {}".format(sorted(s.name for s in missing)))
+
+    table = {}
+    for stateId, _, stateClass, targets in graph:
+        if not issubclass(stateClass, State):
+            raise InvalidTransitionError("{} is not a State".format(stateClass))
+        for target in targets:
+            if not isinstance(target, StateId):
+                raise InvalidTransitionError("{} has invalid target {!r}".format(stateId.name, target))
+        table[stateId] = frozenset(targets) | {StateId.ERROR}
+    return table
+
+
+# Allowed target states per state, validated when the module is loaded
+ALLOWED_TRANSITIONS = build_transition_table(STATE_GRAPH)
+
+
+def export_state_graph_dot(graph=STATE_GRAPH):
+    """Returns the state graph in Graphviz DOT format, the error edges are left out"""
+    lines = ["digraph FSM {"]
+    for stateId, stateHandle, _, _ in graph:
+        lines.append('    {} [label="{}\\n{}"];'.format(stateId.name, stateId.name, stateHandle))
+    for stateId, _, _, targets in graph:
+        for target in targets:
+            lines.append("    {} -> {};".format(stateId.name, target.name))
+    lines.append("}")
+    return "\n".join(lines)
+
+
 ##=====================================================
 # FINITE STATE MACHINE
+# =====================================================
 class FSM(object):
     def __init__(self, machine):
         self._logger = get_app_logger(str(self.__class__))
@@ -2546,7 +2909,10 @@ class FSM(object):
         self.curState = None  # The current state object
         self.prevState = None  # refence to last state, not implemented
         self.trans = None  # Current transition
+        self._transitionsById = {}  # Transition objects by target StateId
         self.curHandle = None  # The current handle of the object
+        self.curStateId = None  # The StateId of the current state
+        self.transitionListeners = []  # Callbacks called with every state that is left
         self.startExtractAfterVent = False
         self.hasPumpErrorBeenChecked = False
         self.numberOfVentingRetries = 0
@@ -2556,6 +2922,10 @@ class FSM(object):
         self.init_FSM()
 
     def init_FSM(self):
+        # a reset leaves the current state for the ready state
+        if self.curStateId not in (None, StateId.READY):
+            self._notify_transition(StateId.READY)
+
         # runtime parameters
         self.SetFSMData("start_flag", False)
         self.SetFSMData("pause_flag", False)
@@ -2581,148 +2951,19 @@ class FSM(object):
         self.SetFSMData("mbar_change", 0)
         self.SetFSMData("run_full_extraction", 0)
         self.SetFSMData("flushes_performed", 0)
+        self.SetFSMData("final_air_cycles_performed", 0)
+        self.SetFSMData("wait_time_saved", 0)
         self.SetFSMData("failure_mode", FailureMode.NONE)
         self.SetFSMData("failure_description", "")
 
 
-        # FSM STATES
-        self.AddState(
-            stateName="stateError", stateHandle="Error", state=StateError(self)
-        )
-        self.AddState(
-            stateName="stateReady", stateHandle="Ready", state=StateReady(self)
-        )
-        self.AddState(
-            stateName="stateSystemCheck",
-            stateHandle="Checking System",
-            state=StateSystemCheck(self),
-        )
-        self.AddState(
-            stateName="statePreFillTubes",
-            stateHandle="Prefilling tubes",
-            state=StatePreFillTubes(self),
-        )
-        self.AddState(
-            stateName="stateMeasureEXCVolume",
-            stateHandle="Measure exc volume",
-            state=StateMeasureEXCVolume(self),
-        )
-
-        self.AddState(
-            stateName="stateTopUpEXC",
-            stateHandle="Topping up",
-            state=StateTopUpEXC(self),
-        )
-        self.AddState(
-            stateName="stateThirdDepressurize",
-            stateHandle="Depressurising",
-            state=StateThirdDepressurize(self),
-        )
-        self.AddState(
-            stateName="stateAspirate", stateHandle="Aspirate", state=StateAspirate(self)
-        )
-        self.AddState(
-            stateName="stateFlush", stateHandle="Flushing", state=StateFlush(self)
-        )
-        self.AddState(
-            stateName="stateExtraFlushDepressurize",
-            stateHandle="Depressuring for flush",
-            state=StateExtraFlushDepressurize(self),
-        )
-        self.AddState(
-            stateName="stateDistillBulk",
-            stateHandle="DistillBulk",
-            state=StateDistillBulk(self),
-        )
-        self.AddState(
-            stateName="stateAfterDistill",
-            stateHandle="AfterDistill",
-            state=StateAfterDistill(self),
-        )
-        self.AddState(
-            stateName="stateFinalSolventRemoval",
-            stateHandle="FinalSolventRemoval",
-            state=StateFinalSolventRemoval(self),
-        )
-        self.AddState(
-            stateName="stateDecarb",
-            stateHandle="Decarboxylating",
-            state=StateDecarb(self),
-        )
-        self.AddState(
-            stateName="stateCooldown",
-            stateHandle="Cooling down",
-            state=StateCooldown(self),
-        )
-        self.AddState(
-            stateName="stateMixOil", stateHandle="Mixing Oil", state=StateMixOil(self)
-        )
-        self.AddState(
-            stateName="stateFirstDepressurize",
-            stateHandle="Depressurize",
-            state=StateFirstDepressurize(self),
-        )
-        self.AddState(
-            stateName="stateSecondDepressurize",
-            stateHandle="Depressurize",
-            state=StateSecondDepressurize(self),
-        )
-        self.AddState(
-            stateName="stateSecondLeakCheck",
-            stateHandle="Check leaks",
-            state=StateSecondLeakCheck(self),
-        )
-        self.AddState(
-            stateName="stateVentPump",
-            stateHandle="Venting Pump",
-            state=StateVentPump(self),
-        )
-        self.AddState(
-            stateName="stateCleanPump",
-            stateHandle="CleanPump",
-            state=StateCleanPump(self),
-        )
-        self.AddState(
-            stateName="stateSoak",
-            stateHandle="Soak",
-            state=StateSoak(self),
-        )
-
-        # FSM Transitions
-        self.AddTransition("toStateError", Transition("stateError"))
-        self.AddTransition("toStateReady", Transition("stateReady"))
-        self.AddTransition("toStateSystemCheck", Transition("stateSystemCheck"))
-        self.AddTransition("toStatePreFillTubes", Transition("statePreFillTubes"))
-        self.AddTransition(
-            "toStateMeasureEXCVolume", Transition("stateMeasureEXCVolume")
-        )
-        self.AddTransition("toStateTopUpEXC", Transition("stateTopUpEXC"))
-        self.AddTransition(
-            "toStateThirdDepressurize", Transition("stateThirdDepressurize")
-        )
-        self.AddTransition("toStateAspirate", Transition("stateAspirate"))
-        self.AddTransition("toStateFlush", Transition("stateFlush"))
-        self.AddTransition("toStateDistillBulk", Transition("stateDistillBulk"))
-        self.AddTransition("toStateAfterDistill", Transition("stateAfterDistill"))
-        self.AddTransition(
-            "toStateFinalSolventRemoval", Transition("stateFinalSolventRemoval")
-        )
-        self.AddTransition("toStateDecarb", Transition("stateDecarb"))
-        self.AddTransition("toStateCooldown", Transition("stateCooldown"))
-        self.AddTransition("toStateMixOil", Transition("stateMixOil"))
-        self.AddTransition(
-            "toStateFirstDepressurize", Transition("stateFirstDepressurize")
-        )
-        self.AddTransition(
-            "toStateSecondDepressurize", Transition("stateSecondDepressurize")
-        )
-        self.AddTransition("toStateSecondLeakCheck", Transition("stateSecondLeakCheck"))
-        self.AddTransition(
-            "toStateExtraFlushDepressurize", Transition("stateExtraFlushDepressurize")
-        )
-        self.AddTransition("toStateVentPump", Transition("stateVentPump"))
-        self.AddTransition("toStateCleanPump", Transition("stateCleanPump"))
-        self.AddTransition("toStateSoak", Transition("stateSoak"))
+        # FSM states and transitions, built from the state graph
+        self.states = {}
+        self.stateHandles = {}
+        self.transitions = {}
+        for stateId, stateHandle, stateClass, _ in STATE_GRAPH:
+            self.AddState(stateName=stateId.value, stateHandle=stateHandle, state=stateClass(self))
+            self.AddTransition(stateId.transition, Transition(stateId))
 
         self.machine.pump_value = 0
         self.machine.bottom_heater_percent = 0
@@ -2730,22 +2971,54 @@ class FSM(object):
         self.intitialAlcoholCheckDone = None
 
         # Set FSM start state
-        self.SetState("stateReady")
+        self.SetState(StateId.READY)
 
     def AddTransition(self, transName, transition):
         self.transitions[transName] = transition
+        self._transitionsById[transition.toStateId] = transition
 
     def AddState(self, stateName, stateHandle, state):
         self.states[stateName] = state
         self.stateHandles[stateName] = stateHandle
 
     def SetState(self, stateName):
+        stateId = StateId(stateName)
         self.prevState = self.curState
-        self.curState = self.states[stateName]
-        self.curHandle = self.stateHandles[stateName]
+        self.curState = self.states[stateId.value]
+        self.curHandle = self.stateHandles[stateId.value]
+        self.curStateId = stateId
 
+    # Returns True if the state graph allows a transition from the current state to the given state
+    def CanTransition(self, toState):
+        return StateId(toState) in ALLOWED_TRANSITIONS[self.curStateId]
+
+    # Request a transition, executed at the start of the next tick. toTrans is the target StateId or
+    # a transition name like "toStateReady". Raises InvalidTransitionError if the graph has no such edge.
     def ToTransistion(self, toTrans):
-        self.trans = self.transitions[toTrans]
+        if isinstance(toTrans, StateId):
+            transition = self._transitionsById[toTrans]
+        elif toTrans in self.transitions:
+            transition = self.transitions[toTrans]
+        else:
+            raise InvalidTransitionError("Unknown transition {}".format(toTrans))
+
+        if transition.toStateId not in ALLOWED_TRANSITIONS[self.curStateId]:
+            raise InvalidTransitionError(
+                "Transition from {} to {} is not allowed".format(self.curStateId.name, transition.toStateId.name)
+            )
+        self.trans = transition
+
+    # Register a callback that is called on every transition with the StateId that is left, the
+    # next StateId, the State object that is left, its handle and fsmData
+    def AddTransitionListener(self, listener):
+        self.transitionListeners.append(listener)
+
+    def _notify_transition(self, toStateId):
+        for listener in self.transitionListeners:
+            try:
+                listener(self.curStateId, toStateId, self.curState, self.curHandle, self.fsmData)
+            except Exception:
+                self._logger.exception("Transition listener failed")
 
     def SetFSMData(self, sensor, value):
         self.fsmData[sensor] = value
@@ -2753,9 +3026,14 @@ class FSM(object):
     def Execute(self):
         if self.trans:
             self.curState.Exit()
+            self._notify_transition(self.trans.toStateId)
             self.trans.Execute()
-            self.SetState(self.trans.toState)
+            self.SetState(self.trans.toStateId)
             self.curState.Enter()
             self.trans = None
 
         self.curState.Execute()
+
+
+if __name__ == "__main__":
+    print(export_state_graph_dot())
@@ -0,0 +1,195 @@
+import math
+import statistics
+
+from common.module_logging import get_app_logger
+
+
+class AutotuneError(Exception):
+    """Raise when the relay experiment or the computed gains are not usable."""
+
+
+class RelayAutotuner:
+    """
+    Relay (Astrom-Hagglund) autotuner. The heater is switched between a high and a low
+    output with a small hysteresis around the setpoint, which makes the temperature
+    oscillate at the ultimate period of the system. The ultimate gain follows from the
+    relay amplitude and the temperature amplitude:
+
+        Ku = 4 * d / (pi * a)
+
+    PID gains are computed from Ku and the ultimate period Pu with the tuning rules below.
+    Gains are returned in the units used by PID.PID, ie. per second.
+    """
+
+    # Ziegler-Nichols style rules: (Kp / Ku, Ti / Pu, Td / Pu)
+    TUNING_RULES = {
+        "classic": (0.6, 0.5, 0.125),
+        "some_overshoot": (0.33, 0.5, 0.33),
+        "no_overshoot": (0.2, 0.5, 0.33),
+        "pi": (0.45, 0.83, 0),
+    }
+
+    def __init__(
+        self,
+        setpoint,
+        output_high,
+        output_low=0,
+        hysteresis=1,
+        cycles=4,
+        timeout_seconds=5400,
+        max_temperature=None,
+    ):
+        """
+        :param setpoint: temperature the relay switches around.
+        :param output_high: heater output in % while below the setpoint.
+        :param output_low: heater output in % while above the setpoint.
+        :param hysteresis: temperature band around the setpoint in which the relay does not switch.
+        :param cycles: number of full oscillations used for the result, the first one is always discarded.
+        :param timeout_seconds: the experiment fails if it is not done within this time.
+        :param max_temperature: the experiment fails if the temperature exceeds this value.
+        """
+        if output_high <= output_low:
+            raise AutotuneError("Relay high output must be above the low output")
+
+        self._logger = get_app_logger(str(self.__class__))
+        self.setpoint = setpoint
+        self.output_high = output_high
+        self.output_low = output_low
+        self.hysteresis = hysteresis
+        self.cycles = int(cycles)
+        self.timeout_seconds = timeout_seconds
+        self.max_temperature = max_temperature
+
+        self._start_time = None
+        self._relay_high = True
+        self._cycle_max = None
+        self._cycle_min = None
+        self._switch_times = []
+        self._peaks = []
+        self._troughs = []
+
+        self.done = False
+        self.error = None
+
+    @property
+    def output(self):
+        return self.output_high if self._relay_high else self.output_low
+
+    @property
+    def cycles_completed(self):
+        # a full oscillation starts every time the relay switches on
+        return max(0, len(self._switch_times) - 1)
+
+    @property
+    def progress(self):
+        return min(100, int(100 * self.cycles_completed / (self.cycles + 1)))
+
+    def update(self, now, temperature):
+        """Feed a temperature sample, returns the heater output in %
+
+        :param now: timestamp of the sample in seconds.
+        :param temperature: measured temperature.
+        """
+        if self.done or self.error:
+            return self.output_low
+
+        if self._start_time is None:
+            self._start_time = now
+
+        if self.max_temperature is not None and temperature > self.max_temperature:
+            self.error = "Temperature {:.1f} above limit {:.1f}".format(temperature, self.max_temperature)
+            return self.output_low
+
+        if (now - self._start_time) > self.timeout_seconds:
+            self.error = "No stable oscillation within {:.0f} seconds".format(self.timeout_seconds)
+            return self.output_low
+
+        # track the extremes of the current half cycle
+        self._cycle_max = temperature if self._cycle_max is None else max(self._cycle_max, temperature)
+        self._cycle_min = temperature if self._cycle_min is None else min(self._cycle_min, temperature)
+
+        if self._relay_high and temperature > self.setpoint + self.hysteresis:
+            self._relay_high = False
+            if self._cycle_min is not None:
+                self._troughs.append(self._cycle_min)
+            self._cycle_min = None
+            self._cycle_max = temperature
+
+        elif not self._relay_high and temperature < self.setpoint - self.hysteresis:
+            self._relay_high = True
+            if self._cycle_max is not None:
+                self._peaks.append(self._cycle_max)
+            self._cycle_max = None
+            self._cycle_min = temperature
+            self._switch_times.append(now)
+            self._logger.debug(
+                "Relay on at {:.1f}, {} of {} cycles completed".format(temperature, self.cycles_completed, self.cycles + 1)
+            )
+
+            if self.cycles_completed > self.cycles:
+                self.done = True
+                return self.output_low
+
+        return self.output
+
+    def result(self):
+        """Returns the ultimate gain, ultimate period and oscillation amplitude, skipping the first cycle"""
+        if not self.done:
+            raise AutotuneError("Relay experiment is not done")
+
+        periods = [b - a for a, b in zip(self._switch_times[1:], self._switch_times[2:])]
+        amplitudes = [(peak - trough) / 2 for peak, trough in zip(self._peaks[1:], self._troughs[1:])]
+        if not periods or not amplitudes:
+            raise AutotuneError("Not enough oscillations recorded")
+
+        amplitude = statistics.mean(amplitudes)
+        if amplitude <= 0:
+            raise AutotuneError("No temperature oscillation measured")
+
+        relay_amplitude = (self.output_high - self.output_low) / 2
+        ultimate_gain = 4 * relay_amplitude / (math.pi * amplitude)
+        ultimate_period = statistics.mean(periods)
+
+        return ultimate_gain, ultimate_period, amplitude, periods, amplitudes
+
+    def gains(self, rule="no_overshoot"):
+        """Returns (Kp, Ki, Kd) for the given tuning rule
+
+        :param rule: one of TUNING_RULES.
+        """
+        if rule not in self.TUNING_RULES:
+            raise AutotuneError("Unknown tuning rule: {}".format(rule))
+
+        ultimate_gain, ultimate_period, _, _, _ = self.result()
+        kp_factor, ti_factor, td_factor = self.TUNING_RULES[rule]
+
+        kp = kp_factor * ultimate_gain
+        ti = ti_factor * ultimate_period
+        td = td_factor * ultimate_period
+        return kp, kp / ti, kp * td
+
+    def validate(self, gains, max_variation=0.3, max_gains=(None, None, None)):
+        """Check that the experiment was consistent and the gains are usable, raises AutotuneError if not
+
+        :param gains: (Kp, Ki, Kd) to check.
+        :param max_variation: maximum relative standard deviation of the oscillation periods and amplitudes.
+        :param max_gains: upper limits for (Kp, Ki, Kd), None for no limit.
+        """
+        _, _, _, periods, amplitudes = self.result()
+
+        for name, values in (("period", periods), ("amplitude", amplitudes)):
+            if len(values) > 1:
+                variation = statistics.stdev(values) / statistics.mean(values)
+                if variation > max_variation:
+                    raise AutotuneError(
+                        "Oscillation {} varies {:.0%}, limit is {:.0%}".format(name, variation, max_variation)
+                    )
+
+        for name, gain, max_gain in zip(("Kp", "Ki", "Kd"), gains, max_gains):
+            # the derivative term may be switched off by the tuning rule
+            if not math.isfinite(gain) or gain < 0 or (gain == 0 and name != "Kd"):
+                raise AutotuneError("{} has invalid value {}".format(name, gain))
+            if max_gain is not None and gain > max_gain:
+                raise AutotuneError("{} {:.3f} above limit {:.3f}".format(name, gain, max_gain))
+
+        return True
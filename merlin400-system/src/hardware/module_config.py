@@ -0,0 +1,443 @@
+"""
+Typed configuration. The config.ini sections are compiled once per load into
+slotted section objects with parsed values, so the control loop reads plain
+attributes instead of parsing strings on every tick.
+"""
+import configparser
+import itertools
+
+
+class ConfigError(Exception):
+    """Raise when a setting is unknown, its value can't be parsed or is outside its safe range."""
+
+
+# Default configuration, values missing in the config file are taken from here
+DEFAULT_CONFIG = {
+    "SYSTEM": {
+        "pressure_slope_sample_time": "2000",
+        "data_log": "0",
+        "alcohol_data_log": "0",
+        "soak_time_seconds": "10",
+        # End the settling waits once their condition is met, the fixed delays are the upper bounds. The pressure
+        # has settled when its slope over settle_window_seconds is below settle_pressure_rate mbar/s.
+        "condition_waits": "0",
+        "settle_window_seconds": "1",
+        "settle_pressure_rate": "0.5",
+        "settle_sample_interval": "0.1",
+    },
+
+    "FSM_EX": {
+        "min_delta_pressure": "-2",
+        "maximum_vacuum_pressure": "300",
+        "maximum_vacuum_time": "120",
+        "tube_filling_vacuum": "300",
+        "max_pressure_loss_evc": "2.5",
+        "max_pressure_logg_full": "2.5",
+        "sample_time": "1",
+        "leak_sample_time": "3",
+        "leak_delay_time": "10",
+        "pressure_eq_time": "4",
+        "evc_volume": "290",
+        "valve_last_known_setting": "28",
+        "valve_start_close_value": "40",
+        "valve_start_close_time": "0.00",
+        "valve_adjust_amount": "0.25",
+        "valve_adjust_hysteresis": "0.1",
+        "valve_adjust_delay": "1",
+        "leak_detect_period": "30",
+        "leak_detect_duration": "2",
+        "calculated_exc_volume_calibration_data": "155.0, 170.0, 185.0",
+        "calculated_aspirated_volume_calibration_data": "175.0, 180.0, 185.0",
+        "EXC_volume_undershoot": "50",
+        "top_up_time": "8",
+        "top_up_afterfill_valve_setting": "60",
+        "aspirate_volume": "150",
+        "aspirate_speed": "2",
+        "number_of_flushes": "1",
+        "flush_time": "10",
+        "flowrate_fall_limit": "0.1",
+        # sequential leak test, ends the leak checks as soon as the pressure readings are conclusive
+        "leak_test_sequential": "0",
+        "leak_test_pass_fraction": "0.5",
+        "leak_test_alpha": "0.01",
+        "leak_test_beta": "0.01",
+        "leak_test_noise": "0.05",
+        "leak_test_sample_interval": "0.1",
+        # exponential pump-down model, predicts when maximum_vacuum_pressure is reached and fails a stalled pump early
+        "pump_down_model": "0",
+        "pump_down_sample_interval": "0.5",
+        "pump_down_forgetting": "0.9",
+        "pump_down_stall_time": "10",
+        # seconds a pump-down without time limit has to be predicted to miss the target before it is failed
+        "pump_down_stall_confirm_time": "5",
+    },
+
+    "FSM_EV": {
+        "min_temp": "0",
+        "max_temp": "160",
+        "error_pressure_during_distill": "375",
+        "pressure_limit_during_distill": "230",
+        "time_delay_before_pressure_check": "90",
+        "time_interval_between_temp_regulation": "300",
+        "valve_last_known_setting": "28",
+        "valve_start_close_value": "40",
+        "valve_start_close_time": "0.25",
+        "valve_adjust_delay": "1",
+        "valve_adjust_amount": "0.25",
+        "valve_adjust_hysteresis": "0.1",
+        "leak_detect_period": "30",
+        "leak_detect_duration": "2",
+        "distillation_temperature": "125",
+        "after_heat_time": "240",
+        "after_heat_temp": "107",
+        "final_air_cycles": "16",
+        "final_air_cycles_time_open": "2",
+        "final_air_cycles_time_closed": "88",
+        # stop the pump for the last final_air_rebound_time seconds of every closed phase and end the air cycles
+        # once the pressure rebound above the system leak stays below final_air_rebound_threshold mbar for
+        # final_air_quiet_cycles closed phases in a row, final_air_cycles is the upper bound
+        "final_air_cycles_adaptive": "0",
+        "final_air_rebound_time": "5",
+        "final_air_rebound_threshold": "2",
+        "final_air_quiet_cycles": "3",
+        "temperature_critical_level": "150",
+        "temperature_critical_level_max_interval": "30",
+        "temperature_check_interval": "20",
+        "temperature_increase_threshold": "5",
+        "temperature_check_threshold": "100",
+        "error_pressure_increase_threshold": "4",
+        "ambient_pressure_upper_bound": "1100",
+        "ambient_pressure_lower_bound": "750",
+        "peak_pressure_detection_interval_seconds": "20",
+        "peak_pressure_during_distill": "300",
+        "pressure_peak_handle_time_seconds": "600",
+        "pressure_peak_max_pressure": "600",
+        # end the bulk distillation once the heater power drops and the pressure drops or the plate temperature
+        # rises against their levels during the boil-off, detected with a CUSUM per signal once the plate has held
+        # the distillation temperature for distill_change_point_settle_time seconds. The noises are the normal
+        # fluctuations of the power in %, the pressure in mbar and the plate temperature in degrees.
+        "distill_change_point": "0",
+        "distill_change_point_settle_time": "300",
+        "distill_change_point_drift": "1",
+        "distill_change_point_threshold": "10",
+        "distill_change_point_reference_filter": "0.02",
+        "distill_power_noise": "2",
+        "distill_pressure_noise": "2",
+        "distill_temperature_noise": "0.5",
+        # Pipelined preheat of the heater plate during aspirate and flush of a full extraction
+        "preheat_enabled": "0",
+        "preheat_temperature": "70",
+        "preheat_max_output": "40",
+        "preheat_min_pressure": "150",
+    },
+
+    "DECARB": {
+        "temperature": "125",
+        "time_minutes": "30",
+    },
+
+    "OIL_MIX": {
+        "temperature": "60",
+        "time_minutes": "10",
+    },
+
+    "PID": {
+        "Pterm": "1",
+        "Iterm": "0.25",
+        "Dterm": "0.05",
+        "sample_time": "1",
+        "windup": "200",
+        "initial_window_delay": "300",
+        "current_window": "100",
+        "wattage_decrease_limit": "35",
+    },
+
+    "FLOW_ADJ": {
+        "pct_stage_1": "25",
+        "step_size_stage_1": "1",
+        "step_period_stage_1": "0.5",
+        "pct_stage_2": "50",
+        "step_size_stage_2": "0.5",
+        "step_period_stage_2": "1",
+        "pct_stage_3": "90",
+        "step_size_stage_3": "0.25",
+        "step_period_stage_3": "2",
+        "pct_stage_4": "110",
+        "step_size_stage_4": "0",
+        "step_period_stage_4": "3",
+        "pct_stage_5": "150",
+        "step_size_stage_5": "0.25",
+        "step_period_stage_5": "2",
+        "pct_stage_6": "200",
+        "step_size_stage_6": "0.5",
+        "step_period_stage_6": "1",
+        "pct_stage_7": "300",
+        "step_size_stage_7": "1",
+        "step_period_stage_7": "0.5",
+        "pct_stage_8": "400",
+        "step_size_stage_8": "4",
+        "step_period_stage_8": "0.5",
+        "pct_stage_9": "500",
+        "step_size_stage_9": "8",
+        "step_period_stage_9": "0.5",
+        "pct_stage_10": "600",
+        "step_size_stage_10": "8",
+        "step_period_stage_10": "0.5",
+    },
+
+    # PI control of the aspiration flow instead of the FLOW_ADJ table, see module_flowcontrol
+    "FLOW_PI": {
+        "enabled": "0",
+        "Kp": "0.5",
+        "Ki": "0.2",
+        "max_step": "5",
+        "valve_dead_band": "8",
+        "valve_exponent": "2",
+    },
+
+    # Relay autotuning of the heater PID, see module_autotune
+    "AUTOTUNE": {
+        "setpoint": "100",
+        "output_high": "65",
+        "output_low": "0",
+        "hysteresis": "1",
+        "cycles": "4",
+        "timeout_minutes": "90",
+        "max_temperature": "140",
+        "tuning_rule": "no_overshoot",
+        "max_variation": "0.3",
+        "max_pterm": "10",
+        "max_iterm": "1",
+        "max_dterm": "200",
+    },
+
+    # First order heater model used for feed-forward during heat-up, see module_thermalmodel.
+    # Fit gain, time_constant and dead_time to logged runs before enabling, log_samples logs every PID update
+    # for the fit instead of one line per status interval.
+    "HEATER_MODEL": {
+        "enabled": "0",
+        "log_samples": "0",
+        "gain": "1.6",
+        "time_constant": "300",
+        "dead_time": "40",
+        "ambient": "22",
+    },
+
+    # PWM backend per output channel: software or sysfs, fake is only for simulations
+    "PWM": {
+        "bottom_heater": "software",
+        "pump": "software",
+        "fan": "software",
+        "led": "software",
+    },
+}
+
+# Settings that are counts or flags, all other numeric settings are floats
+INTEGER_SETTINGS = {
+    "SYSTEM": ("data_log", "alcohol_data_log", "condition_waits"),
+    "FSM_EX": ("number_of_flushes", "leak_test_sequential", "pump_down_model"),
+    "FSM_EV": (
+        "final_air_cycles",
+        "final_air_cycles_adaptive",
+        "final_air_quiet_cycles",
+        "temperature_critical_level",
+        "temperature_critical_level_max_interval",
+        "temperature_check_interval",
+        "temperature_increase_threshold",
+        "temperature_check_threshold",
+        "preheat_enabled",
+        "distill_change_point",
+    ),
+    "PID": ("current_window",),
+    "AUTOTUNE": ("cycles",),
+    "FLOW_PI": ("enabled",),
+    "HEATER_MODEL": ("enabled", "log_samples"),
+}
+
+
+# Safe ranges of the settings that protect the machine, (lowest, highest) inclusive.
+# Temperatures are in degrees celsius, pressures are absolute in mbar.
+SETTING_LIMITS = {
+    "FSM_EX": {
+        "maximum_vacuum_pressure": (0, 1100),
+        "tube_filling_vacuum": (0, 1100),
+    },
+    "FSM_EV": {
+        "max_temp": (0, 200),
+        "distillation_temperature": (0, 200),
+        "after_heat_temp": (0, 200),
+        "preheat_temperature": (0, 200),
+        "temperature_critical_level": (0, 200),
+        "error_pressure_during_distill": (0, 1100),
+        "pressure_limit_during_distill": (0, 1100),
+        "peak_pressure_during_distill": (0, 1100),
+        "pressure_peak_max_pressure": (0, 1100),
+        "ambient_pressure_upper_bound": (0, 1200),
+        "ambient_pressure_lower_bound": (0, 1200),
+        "preheat_min_pressure": (0, 1100),
+    },
+}
+
+
+def _parse_float_list(value):
+    return tuple(float(item) for item in value.split(","))
+
+
+def _format_float_list(value):
+    return ", ".join(str(float(item)) for item in value)
+
+
+def _is_float(value):
+    try:
+        float(value)
+        return True
+    except ValueError:
+        return False
+
+
+def _get_parser(section, key, default):
+    """Returns (parse, format) functions for a setting, selected from its default value"""
+    if key in INTEGER_SETTINGS.get(section, ()):
+        return int, str
+    if "," in default:
+        return _parse_float_list, _format_float_list
+    if _is_float(default):
+        return float, str
+    return str, str
+
+
+class ConfigSection:
+    """Base class of the compiled sections, the subclasses define one slot per setting"""
+
+    __slots__ = ()
+
+    # setting name: (parse, format, default value, (lowest, highest) or None)
+    SETTINGS = {}
+
+    @classmethod
+    def parse(cls, name, text):
+        """Parse the text of a setting, raises ValueError when it can't be parsed or is outside its safe range"""
+        parse, _, _, limits = cls.SETTINGS[name]
+        value = parse(text)
+        if limits is not None and not limits[0] <= value <= limits[1]:
+            raise ValueError("{!r} is outside {}..{}".format(value, *limits))
+        return value
+
+    def __repr__(self):
+        return "{}({})".format(
+            self.__class__.__name__,
+            ", ".join("{}={!r}".format(name, getattr(self, name)) for name in self.__slots__),
+        )
+
+
+def _compile_section(section, defaults):
+    limits = SETTING_LIMITS.get(section, {})
+    settings = {}
+    for key, default in defaults.items():
+        parse, format_ = _get_parser(section, key, default)
+        settings[key.lower()] = (parse, format_, parse(default), limits.get(key))
+
+    return type(
+        section,
+        (ConfigSection,),
+        {"__slots__": tuple(settings), "SETTINGS": settings},
+    )
+
+
+# One section class per section in DEFAULT_CONFIG, built at import time
+SECTIONS = {
+    section: _compile_section(section, defaults)
+    for section, defaults in DEFAULT_CONFIG.items()
+}
+
+_versions = itertools.count(1)
+
+
+def _section_values(compiled):
+    return tuple(getattr(compiled, name) for name in compiled.__slots__)
+
+
+class Config:
+    """
+    Typed view of a ConfigParser. Every section of DEFAULT_CONFIG is an
+    attribute, eg. config.FSM_EV.valve_adjust_delay. Setting names are
+    lowercase, like in ConfigParser. Every section has a version number that
+    changes when one of its settings changes, by a reload or by set, so
+    consumers that derive data from a section can tell when to rebuild it.
+    version is the latest of the section versions.
+    """
+
+    def __init__(self, parser, previous=None):
+        """
+        :param parser: ConfigParser with the settings, it is not modified.
+        :param previous: Config this one replaces, sections with the same
+                         values keep their version.
+        :raises ConfigError: when a value can't be parsed or is outside its
+                             safe range, the message lists all of them.
+        """
+        self.versions = {}
+        errors = []
+
+        for section, section_class in SECTIONS.items():
+            compiled = section_class()
+            for name, (_, _, default, _) in section_class.SETTINGS.items():
+                value = default
+                if parser.has_option(section, name):
+                    try:
+                        value = section_class.parse(name, parser[section][name])
+                    except ValueError as e:
+                        errors.append("[{}] {} = {!r}: {}".format(section, name, parser[section][name], e))
+                setattr(compiled, name, value)
+            setattr(self, section, compiled)
+
+        if errors:
+            raise ConfigError("Invalid settings: {}".format("; ".join(errors)))
+
+        for section in SECTIONS:
+            values = _section_values(getattr(self, section))
+            if previous is not None and values == _section_values(getattr(previous, section)):
+                self.versions[section] = previous.versions[section]
+            else:
+                self.versions[section] = next(_versions)
+
+        self.version = max(self.versions.values())
+
+    def set(self, section, name, value):
+        """Parse and store a new value for a setting, returns the value formatted for the config file
+
+        :param section: section name, eg. "FSM_EV".
+        :param name: setting name.
+        :param value: new value, a string is parsed like a value in the config file.
+        """
+        name = name.lower()
+        if section not in SECTIONS or name not in SECTIONS[section].SETTINGS:
+            raise ConfigError("Unknown setting [{}] {}".format(section, name))
+
+        _, format_, _, _ = SECTIONS[section].SETTINGS[name]
+        try:
+            text = value if isinstance(value, str) else format_(value)
+            parsed = SECTIONS[section].parse(name, text)
+        except (TypeError, ValueError) as e:
+            raise ConfigError("Invalid value {!r} for [{}] {}: {}".format(value, section, name, e))
+
+        if parsed != getattr(getattr(self, section), name):
+            setattr(getattr(self, section), name, parsed)
+            self.versions[section] = self.version = next(_versions)
+        return text
+
+
+def load_config(config_file, previous=None):
+    """Read a config file on top of the defaults, returns the (ConfigParser, Config) pair
+
+    :param config_file: path to the config file, a missing file gives the defaults.
+    :param previous: Config the new one replaces on a reload.
+    :raises ConfigError: when a setting in the file is invalid.
+    """
+    parser = configparser.ConfigParser()
+
+    # Defaults are loaded first, so settings added in newer versions are
+    # also present when an existing config file is read.
+    parser.read_dict(DEFAULT_CONFIG)
+    parser.read(config_file)
+
+    return parser, Config(parser, previous)
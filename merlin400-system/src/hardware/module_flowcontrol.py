@@ -0,0 +1,102 @@
+if __name__ == "__main__":
+  #Add root folder (/src/) to paths for import if this script is run standalone
+  from pathlib import Path
+  import sys
+  sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+
+class ValveModel:
+    """
+    Static flow characteristic of a needle valve: no flow up to the dead band, above it the relative
+    flow area grows with the normalized position to the power of exponent. Used to turn a required
+    flow into a valve position, so the controller gain does not depend on where the valve operates.
+    """
+
+    def __init__(self, dead_band, exponent):
+        """
+        :param dead_band: valve position in % below which the valve is closed.
+        :param exponent: exponent of the flow area over the normalized position.
+        """
+        if not 0 <= dead_band < 100:
+            raise ValueError("Valve dead band must be between 0 and 100%")
+        if exponent <= 0:
+            raise ValueError("Valve exponent must be positive")
+        self.dead_band = dead_band
+        self.exponent = exponent
+
+    def opening(self, position):
+        """Relative flow area between 0 and 1 at a valve position in %"""
+        if position <= self.dead_band:
+            return 0.0
+        return ((min(position, 100) - self.dead_band) / (100 - self.dead_band)) ** self.exponent
+
+    def position(self, opening):
+        """Valve position in % that gives a relative flow area, the inverse of opening"""
+        if opening <= 0:
+            return 0.0
+        return self.dead_band + (100 - self.dead_band) * min(opening, 1.0) ** (1 / self.exponent)
+
+
+class FlowController:
+    """
+    PI controller of the aspiration flow through valve3. The output is a relative valve opening:
+
+        opening = (target + Kp * error + integral) / flow_gain
+
+    where flow_gain is the flow in mL/s at full opening. It starts from the valve position that gave
+    the target flow in the last run and is updated from every measurement, so the target is fed
+    forward through the valve model and the PI terms only correct what the model gets wrong. The
+    integral is not updated while the valve is at a limit and the error would drive it further into
+    the limit, and the position change per update is limited to max_step.
+    """
+
+    def __init__(self, valve_model, Kp, Ki, target, initial_position, max_step=5, gain_filter=0.5):
+        """
+        :param valve_model: ValveModel of the controlled valve.
+        :param Kp: proportional gain, dimensionless.
+        :param Ki: integral gain in 1/s.
+        :param target: flow setpoint in mL/s.
+        :param initial_position: valve position in % expected to give the target flow.
+        :param max_step: largest valve position change per update in %.
+        :param gain_filter: weight of a new measurement in the flow gain estimate, between 0 and 1.
+        """
+        self.valve_model = valve_model
+        self.Kp = Kp
+        self.Ki = Ki
+        self.target = target
+        self.max_step = max_step
+        self.gain_filter = gain_filter
+
+        # a closed valve in the last run gives no estimate, assume the flow at the smallest opening
+        self._min_opening = valve_model.opening(valve_model.dead_band + 1)
+        self.flow_gain = target / max(valve_model.opening(initial_position), self._min_opening)
+        self.position = initial_position
+        self._integral = 0.0
+
+    def update(self, flowrate, dt):
+        """Returns the new valve position in % for a measured flowrate
+
+        :param flowrate: flowrate measured since the last update in mL/s, with the valve at the last position.
+        :param dt: time since the last update in seconds.
+        """
+        # flow gain seen with the valve at the last position
+        opening = self.valve_model.opening(self.position)
+        if opening >= self._min_opening and flowrate > 0:
+            self.flow_gain += self.gain_filter * (flowrate / opening - self.flow_gain)
+
+        error = self.target - flowrate
+        integral = self._integral + self.Ki * error * dt
+
+        required_flow = self.target + self.Kp * error + integral
+        position = self.valve_model.position(required_flow / self.flow_gain)
+        position = min(max(position, self.position - self.max_step), self.position + self.max_step)
+        position = min(max(position, 0), 100)
+
+        # anti-windup, hold the integral while the valve can't follow it
+        saturated_high = position >= min(100, self.position + self.max_step)
+        saturated_low = position <= max(0, self.position - self.max_step)
+        if not ((saturated_high and error > 0) or (saturated_low and error < 0)):
+            self._integral = integral
+
+        self.position = position
+        return position
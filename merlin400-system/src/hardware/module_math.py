@@ -1,3 +1,6 @@
+import bisect
+from collections import deque
+
 import numpy as np
 
 
@@ -128,3 +131,481 @@ def calculate_distill_progress(elapsed_time_seconds, power_uptake):
         result_eta = 1
 
     return result_percentage, result_eta
+
+
+# Antoine coefficients are given for mmHg, pressures in this module are in mbar
+MBAR_PER_MMHG = 1.33322
+
+
+def get_vapour_pressure(temperature, antoine):
+    """Calculate the vapour pressure of a solvent in mbar with the Antoine equation.
+
+    :param temperature: liquid temperature in degrees celcius.
+    :param antoine: (A, B, C) Antoine coefficients for mmHg and degrees celcius.
+    """
+    a, b, c = antoine
+    return MBAR_PER_MMHG * 10 ** (a - b / (c + temperature))
+
+
+def get_boiling_temperature(pressure, antoine):
+    """Calculate the boiling temperature of a solvent in degrees celcius at the given pressure.
+
+    :param pressure: pressure above the liquid in mbar.
+    :param antoine: (A, B, C) Antoine coefficients for mmHg and degrees celcius.
+    """
+    a, b, c = antoine
+    return b / (a - float(np.log10(pressure / MBAR_PER_MMHG))) - c
+
+
+def compile_flow_adjustment_table(stages):
+    """Sort flow adjustment stages by their error threshold for lookups with bisect.
+
+    Returns a tuple of (thresholds, step sizes, step periods) tuples.
+
+    :param stages: iterable of (error threshold in %, step size, step period) tuples.
+    """
+    stages = sorted(stages)
+    if not stages:
+        raise ValueError("At least one flow adjustment stage is needed")
+    return tuple(tuple(float(value) for value in column) for column in zip(*stages))
+
+
+def get_step_and_period(flow_adjustment_table, error):
+    """Valve step size and period for a flow error: the first stage with a threshold above the error,
+    the last stage if the error is above all thresholds.
+
+    :param flow_adjustment_table: table from compile_flow_adjustment_table.
+    :param error: flow error in %.
+    """
+    thresholds, step_sizes, step_periods = flow_adjustment_table
+    index = min(bisect.bisect_right(thresholds, error), len(thresholds) - 1)
+    return step_sizes[index], step_periods[index]
+
+
+def get_steps_and_periods(flow_adjustment_table, errors):
+    """Batch version of get_step_and_period, returns arrays of step sizes and periods.
+
+    :param flow_adjustment_table: table from compile_flow_adjustment_table.
+    :param errors: array of flow errors in %.
+    """
+    thresholds, step_sizes, step_periods = flow_adjustment_table
+    index = np.minimum(np.searchsorted(thresholds, errors, side="right"), len(thresholds) - 1)
+    return np.asarray(step_sizes)[index], np.asarray(step_periods)[index]
+
+
+class SlidingWindow:
+    """Statistics of the samples from the last duration seconds.
+
+    Running sums are updated when samples are added and expire, so adding a sample and reading
+    the mean, variance or slope are O(1) amortised. Timestamps are taken relative to an offset
+    that is moved to the oldest sample once it lags more than a window behind, so the sums of
+    squares stay well conditioned in a long-lived window.
+    """
+
+    def __init__(self, duration):
+        """
+        :param duration: length of the window in seconds.
+        """
+        self.duration = duration
+        self._samples = deque()
+        self._reset_sums()
+
+    def _reset_sums(self):
+        self._time_offset = None
+        self._sum = 0.0
+        self._sum_squares = 0.0
+        self._sum_time = 0.0
+        self._sum_time_squares = 0.0
+        self._sum_time_value = 0.0
+
+    def _update_sums(self, t, value, sign):
+        self._sum += sign * value
+        self._sum_squares += sign * value * value
+        self._sum_time += sign * t
+        self._sum_time_squares += sign * t * t
+        self._sum_time_value += sign * t * value
+
+    def add(self, timestamp, value):
+        """Add a sample and drop the samples that are older than the window.
+
+        :param timestamp: time of the sample in seconds, samples must be added in time order.
+        :param value: sample value.
+        """
+        if self._time_offset is None:
+            self._time_offset = timestamp
+        self._samples.append((timestamp, value))
+        self._update_sums(timestamp - self._time_offset, value, 1)
+        self.expire(timestamp)
+
+    def expire(self, now):
+        """Drop the samples that are older than the window.
+
+        :param now: current time in seconds.
+        """
+        if self._time_offset is None:
+            return
+        oldest = now - self.duration
+        while self._samples and self._samples[0][0] < oldest:
+            timestamp, value = self._samples.popleft()
+            self._update_sums(timestamp - self._time_offset, value, -1)
+        if not self._samples:
+            # start over without the rounding errors of the removed samples
+            self._reset_sums()
+        elif self._samples[0][0] - self._time_offset > self.duration:
+            # move the offset to the oldest sample, at most once per window so it stays O(1) amortised
+            self._reset_sums()
+            self._time_offset = self._samples[0][0]
+            for timestamp, value in self._samples:
+                self._update_sums(timestamp - self._time_offset, value, 1)
+
+    def clear(self):
+        self._samples.clear()
+        self._reset_sums()
+
+    def __len__(self):
+        return len(self._samples)
+
+    @property
+    def values(self):
+        return [value for _, value in self._samples]
+
+    @property
+    def mean(self):
+        """Mean of the samples in the window, None if the window is empty"""
+        if not self._samples:
+            return None
+        return self._sum / len(self._samples)
+
+    @property
+    def variance(self):
+        """Population variance of the samples in the window, None if the window is empty"""
+        if not self._samples:
+            return None
+        mean = self._sum / len(self._samples)
+        return max(0.0, self._sum_squares / len(self._samples) - mean * mean)
+
+    @property
+    def slope(self):
+        """Least squares slope of the samples in units per second, None with less than two distinct timestamps"""
+        count = len(self._samples)
+        denominator = count * self._sum_time_squares - self._sum_time * self._sum_time
+        if count < 2 or denominator <= 1e-12 * count * self._sum_time_squares:
+            return None
+        return (count * self._sum_time_value - self._sum_time * self._sum) / denominator
+
+
+class SequentialLeakTest:
+    """Sequential probability ratio test (SPRT) of the leak rate of a closed chamber.
+
+    Pressure samples are fitted with a least squares line. With sensor noise sigma the slope estimate
+    is normally distributed around the true leak rate with variance sigma^2 / Sxx, which gives the
+    log likelihood ratio of a leak at the limit against a leak at pass_fraction times the limit:
+
+        llr = (r1 - r0) * Sxx / sigma^2 * (slope - (r0 + r1) / 2)
+
+    The test fails once llr reaches log((1 - beta) / alpha) and passes once it falls to
+    log(beta / (1 - alpha)), alpha being the probability of failing a tight chamber and beta the
+    probability of passing a leaking one. Sigma is the residual spread of the fit, but never below
+    the noise floor, so a few lucky samples can't end the test.
+    """
+
+    # samples needed before the residual spread is trusted
+    MIN_SAMPLES = 5
+
+    def __init__(self, limit, pass_fraction=0.5, alpha=0.01, beta=0.01, noise=0.05):
+        """
+        :param limit: leak rate in mbar/s that fails the test.
+        :param pass_fraction: leak rate that passes the test as a fraction of limit.
+        :param alpha: probability of failing a chamber that leaks pass_fraction * limit.
+        :param beta: probability of passing a chamber that leaks limit.
+        :param noise: noise floor of the pressure sensor in mbar.
+        """
+        if not 0 <= pass_fraction < 1:
+            raise ValueError("Pass fraction must be between 0 and 1")
+        self.limit = limit
+        self.pass_rate = limit * pass_fraction
+        self.noise = noise
+        self.fail_threshold = float(np.log((1 - beta) / alpha))
+        self.pass_threshold = float(np.log(beta / (1 - alpha)))
+        self.reset()
+
+    def reset(self):
+        """Drop all samples"""
+        self.last_sample_time = None
+        self._time_offset = None
+        self._count = 0
+        self._sum_time = 0.0
+        self._sum_time_squares = 0.0
+        self._sum = 0.0
+        self._sum_squares = 0.0
+        self._sum_time_value = 0.0
+
+    def add(self, timestamp, pressure):
+        """Add a pressure sample.
+
+        :param timestamp: time of the sample in seconds.
+        :param pressure: pressure in mbar.
+        """
+        if self._time_offset is None:
+            self._time_offset = timestamp
+        t = timestamp - self._time_offset
+        self.last_sample_time = timestamp
+        self._count += 1
+        self._sum_time += t
+        self._sum_time_squares += t * t
+        self._sum += pressure
+        self._sum_squares += pressure * pressure
+        self._sum_time_value += t * pressure
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def _sxx(self):
+        return self._sum_time_squares - self._sum_time * self._sum_time / self._count
+
+    @property
+    def slope(self):
+        """Least squares leak rate in mbar/s, None with less than two distinct timestamps"""
+        if self._count < 2 or self._sxx <= 1e-12:
+            return None
+        return (self._sum_time_value - self._sum_time * self._sum / self._count) / self._sxx
+
+    @property
+    def sigma(self):
+        """Pressure noise used by the test, the residual spread of the fit or the noise floor"""
+        if self._count < self.MIN_SAMPLES or self.slope is None:
+            return self.noise
+        syy = self._sum_squares - self._sum * self._sum / self._count
+        sxy = self._sum_time_value - self._sum_time * self._sum / self._count
+        residual_variance = max(0.0, syy - sxy * sxy / self._sxx) / (self._count - 2)
+        return max(self.noise, residual_variance ** 0.5)
+
+    @property
+    def log_likelihood_ratio(self):
+        """Log likelihood ratio of a leak at the limit against a leak at the pass rate, 0 without a slope"""
+        slope = self.slope
+        if slope is None:
+            return 0.0
+        return (
+            (self.limit - self.pass_rate) * self._sxx / self.sigma ** 2
+            * (slope - (self.limit + self.pass_rate) / 2)
+        )
+
+    def decide(self, allow_fail=True):
+        """True when the chamber leaks, False when it is tight and None while the evidence is not sufficient.
+
+        :param allow_fail: only decide a pass, eg. while the pressure is still settling.
+        """
+        if self._count < self.MIN_SAMPLES:
+            return None
+        llr = self.log_likelihood_ratio
+        if allow_fail and llr >= self.fail_threshold:
+            return True
+        if llr <= self.pass_threshold:
+            return False
+        return None
+
+
+class PumpDownModel:
+    """Online fit of an exponential pump-down towards a target pressure.
+
+    With a constant pump speed S and leak free volume V the pressure falls as
+
+        p(t) = p_end + (p_0 - p_end) * exp(-t / tau),   tau = V / S
+
+    or dp/dt = (p_end - p) / tau. The rate of every sample interval is fitted against the mean
+    pressure of the interval with a weighted least squares line, older intervals weighted down by
+    forgetting per interval, so the fit follows a pump that slows down near its ultimate pressure.
+    When the pressure hardly changes the line is undefined and the mean rate is extrapolated.
+    """
+
+    # rate samples needed before the fit is used
+    MIN_SAMPLES = 3
+    # pressure spread in mbar below which the rate is extrapolated instead of fitted
+    MIN_PRESSURE_SPREAD = 1.0
+
+    def __init__(self, target, interval=0.5, forgetting=0.9):
+        """
+        :param target: target pressure in mbar.
+        :param interval: shortest time between two samples in seconds.
+        :param forgetting: weight of the previous fit for every new sample, between 0 and 1.
+        """
+        if not 0 < forgetting <= 1:
+            raise ValueError("Forgetting factor must be between 0 and 1")
+        self.target = target
+        self.interval = interval
+        self.forgetting = forgetting
+        self.pressure = None
+        self._last_time = None
+        self._count = 0
+        self._weight = 0.0
+        self._sum_pressure = 0.0
+        self._sum_pressure_squares = 0.0
+        self._sum_rate = 0.0
+        self._sum_pressure_rate = 0.0
+        self._unreachable_since = None
+
+    def add(self, timestamp, pressure):
+        """Add a pressure sample, samples closer than interval to the last one are ignored
+
+        :param timestamp: time of the sample in seconds.
+        :param pressure: pressure in mbar.
+        """
+        if self._last_time is not None:
+            dt = timestamp - self._last_time
+            if dt < self.interval:
+                return
+            rate = (pressure - self.pressure) / dt
+            mean_pressure = (pressure + self.pressure) / 2
+            f = self.forgetting
+            self._count += 1
+            self._weight = f * self._weight + 1
+            self._sum_pressure = f * self._sum_pressure + mean_pressure
+            self._sum_pressure_squares = f * self._sum_pressure_squares + mean_pressure * mean_pressure
+            self._sum_rate = f * self._sum_rate + rate
+            self._sum_pressure_rate = f * self._sum_pressure_rate + mean_pressure * rate
+        self._last_time = timestamp
+        self.pressure = pressure
+
+    @property
+    def rate(self):
+        """Weighted mean pressure rate in mbar/s, None before the first interval"""
+        if self._count == 0:
+            return None
+        return self._sum_rate / self._weight
+
+    def _fit(self):
+        """Returns (time constant, end pressure) of the fit, None when the line is undefined or not falling"""
+        mean_pressure = self._sum_pressure / self._weight
+        spread = self._sum_pressure_squares / self._weight - mean_pressure * mean_pressure
+        if spread < self.MIN_PRESSURE_SPREAD ** 2:
+            return None
+        covariance = self._sum_pressure_rate / self._weight - mean_pressure * self.rate
+        slope = covariance / spread
+        if slope >= 0:
+            return None
+        return -1 / slope, mean_pressure - self.rate / slope
+
+    @property
+    def time_constant(self):
+        """Fitted time constant in seconds, None when there is no fit"""
+        if self._count < self.MIN_SAMPLES:
+            return None
+        fit = self._fit()
+        return None if fit is None else fit[0]
+
+    @property
+    def end_pressure(self):
+        """Fitted end pressure in mbar, None when there is no fit"""
+        if self._count < self.MIN_SAMPLES:
+            return None
+        fit = self._fit()
+        return None if fit is None else fit[1]
+
+    def time_to_target(self):
+        """Predicted seconds until the target is reached, None before the fit and inf if it won't be reached"""
+        if self.pressure is not None and self.pressure <= self.target:
+            return 0.0
+        if self._count < self.MIN_SAMPLES:
+            return None
+        fit = self._fit()
+        if fit is not None:
+            time_constant, end_pressure = fit
+            if end_pressure >= self.target:
+                return float("inf")
+            return time_constant * float(np.log((self.pressure - end_pressure) / (self.target - end_pressure)))
+        if self.rate >= 0:
+            return float("inf")
+        return (self.target - self.pressure) / self.rate
+
+    def is_stalled(self, elapsed_time, max_time):
+        """True when the target is predicted to be reached later than max_time
+
+        :param elapsed_time: time since the pump-down started in seconds.
+        :param max_time: time allowed for the pump-down in seconds.
+        """
+        time_to_target = self.time_to_target()
+        if time_to_target is None:
+            return elapsed_time > max_time
+        return elapsed_time + time_to_target > max_time
+
+    def is_unreachable(self, confirm_time):
+        """True when the target is predicted not to be reached, and has been since confirm_time seconds of samples
+
+        Near the end of a slow pump-down single fits can miss the target because of the sensor noise, the
+        prediction has to hold before a pump-down without time limit is given up.
+
+        :param confirm_time: seconds the prediction has to hold.
+        """
+        if self.time_to_target() != float("inf"):
+            self._unreachable_since = None
+            return False
+        if self._unreachable_since is None:
+            self._unreachable_since = self._last_time
+        return self._last_time - self._unreachable_since >= confirm_time
+
+
+class Cusum:
+    """One-sided CUSUM change detector for a shift of a signal away from its reference level.
+
+    With the deviation z = direction * (value - reference) / noise of every sample the statistic is
+
+        s = max(0, s + z - drift)
+
+    and the change is detected once s reaches threshold. The reference is an exponentially weighted
+    mean of the signal that lags 1 / reference_filter samples behind it, so a step or a trend faster
+    than drift * noise * reference_filter per sample adds up while slower trends are followed and
+    deviations below drift times the noise don't count.
+    """
+
+    def __init__(self, noise, direction=-1, drift=1.0, threshold=10, reference_filter=0.02):
+        """
+        :param noise: size of the normal fluctuations of the signal, in the units of the signal.
+        :param direction: -1 to detect a decrease, 1 to detect an increase.
+        :param drift: shift in units of noise that is ignored.
+        :param threshold: statistic in units of noise that detects the change.
+        :param reference_filter: weight of a new sample in the reference, between 0 and 1.
+        """
+        if noise <= 0:
+            raise ValueError("Noise must be positive")
+        if direction not in (-1, 1):
+            raise ValueError("Direction must be -1 or 1")
+        self.noise = noise
+        self.direction = direction
+        self.drift = drift
+        self.threshold = threshold
+        self.reference_filter = reference_filter
+        self.reset()
+
+    def reset(self):
+        """Drop the reference and the statistic"""
+        self.reference = None
+        self.statistic = 0.0
+        self.change_time = None
+
+    def add(self, timestamp, value):
+        """Add a sample, returns True when the change is detected.
+
+        :param timestamp: time of the sample in seconds.
+        :param value: sample value.
+        """
+        if self.reference is None:
+            self.reference = value
+            return False
+
+        deviation = self.direction * (value - self.reference) / self.noise
+        statistic = max(0.0, self.statistic + deviation - self.drift)
+        if statistic == 0:
+            self.change_time = None
+        elif self.statistic == 0:
+            # the change started where the statistic left zero
+            self.change_time = timestamp
+        self.statistic = statistic
+        self.reference += self.reference_filter * (value - self.reference)
+        return self.alarm
+
+    @property
+    def alarm(self):
+        """True when the change is detected"""
+        return self.statistic >= self.threshold
@@ -0,0 +1,238 @@
+if __name__ == "__main__":
+  #Add root folder (/src/) to paths for import if this script is run standalone
+  from pathlib import Path
+  import sys
+  sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+import itertools
+
+import numpy as np
+
+from hardware.module_thermalmodel import ThermalModel, fit_from_log
+
+
+def make_candidates(Kp, Ki, Kd, sample_time=(1,), output_limits=((0, 65),)):
+    """Build the full grid of candidate PID settings as a dict of equally long arrays.
+
+    :param Kp: iterable of proportional gains.
+    :param Ki: iterable of integral gains.
+    :param Kd: iterable of derivative gains.
+    :param sample_time: iterable of PID sample times in seconds.
+    :param output_limits: iterable of (lower, upper) output limits.
+    """
+    grid = list(itertools.product(Kp, Ki, Kd, sample_time, output_limits))
+    return {
+        "Kp": np.array([c[0] for c in grid], dtype=float),
+        "Ki": np.array([c[1] for c in grid], dtype=float),
+        "Kd": np.array([c[2] for c in grid], dtype=float),
+        "sample_time": np.array([c[3] for c in grid], dtype=float),
+        # a limit of None means no limit, like in PID.PID
+        "lower": np.array([-np.inf if c[4][0] is None else c[4][0] for c in grid], dtype=float),
+        "upper": np.array([np.inf if c[4][1] is None else c[4][1] for c in grid], dtype=float),
+    }
+
+
+class BatchPID:
+    """
+    Vectorized version of hardware.components.PID.PID, one controller per candidate. It keeps the
+    semantics of the device controller: the first call always updates, later calls only update
+    when sample_time has passed since the last update, the integral term is clamped to the output
+    limits and the derivative is taken on the measurement.
+    """
+
+    def __init__(self, candidates, setpoint):
+        self.Kp = candidates["Kp"]
+        self.Ki = candidates["Ki"]
+        self.Kd = candidates["Kd"]
+        self.sample_time = candidates["sample_time"]
+        self.lower = candidates["lower"]
+        self.upper = candidates["upper"]
+        self.setpoint = setpoint
+
+        count = len(self.Kp)
+        self._integral = np.zeros(count)
+        self._last_time = np.zeros(count)
+        self._last_input = np.full(count, np.nan)
+        self._last_output = np.full(count, np.nan)
+
+    def __call__(self, now, input_):
+        """Update all controllers at time now with the measurements input_, returns the outputs"""
+        first_run = np.isnan(self._last_output)
+        dt = now - self._last_time
+        dt = np.where(dt > 0, dt, 1e-16)
+        update = first_run | (dt >= self.sample_time)
+
+        error = self.setpoint - input_
+        d_input = np.where(first_run, 0.0, input_ - self._last_input)
+
+        integral = np.clip(self._integral + self.Ki * error * dt, self.lower, self.upper)
+        output = np.clip(self.Kp * error + integral - self.Kd * d_input / dt, self.lower, self.upper)
+
+        self._integral = np.where(update, integral, self._integral)
+        self._last_output = np.where(update, output, self._last_output)
+        self._last_input = np.where(update, input_, self._last_input)
+        self._last_time = np.where(update, now, self._last_time)
+
+        return self._last_output
+
+
+def simulate(candidates, model, setpoint, start_temperature=None, duration=3600, step=0.1):
+    """Simulate all candidates in closed loop against a ThermalModel plant.
+
+    Returns (times, temperatures, outputs), with temperatures and outputs shaped (steps, candidates).
+
+    :param candidates: dict of candidate arrays, see make_candidates.
+    :param model: ThermalModel of the plant.
+    :param setpoint: target temperature.
+    :param start_temperature: initial plant temperature, the model ambient if None.
+    :param duration: simulated time in seconds.
+    :param step: simulation step in seconds, the device control loop runs at about 10 ms.
+    """
+    if start_temperature is None:
+        start_temperature = model.ambient
+
+    count = len(candidates["Kp"])
+    steps = int(duration / step)
+    delay_steps = int(round(model.dead_time / step))
+
+    pid = BatchPID(candidates, setpoint)
+    temperature = np.full(count, float(start_temperature))
+    # outputs waiting for the dead time to pass, used as a ring buffer
+    delay_line = np.zeros((delay_steps + 1, count))
+    decay = np.exp(-step / model.time_constant)
+
+    times = np.arange(steps) * step
+    temperatures = np.empty((steps, count))
+    outputs = np.empty((steps, count))
+
+    for i, now in enumerate(times):
+        output = pid(now, temperature)
+        temperatures[i] = temperature
+        outputs[i] = output
+
+        delay_line[i % (delay_steps + 1)] = output
+        applied = delay_line[(i + 1) % (delay_steps + 1)] if delay_steps else output
+
+        # exact discretization of the first order plant for a constant input over the step
+        final_temperature = model.ambient + model.gain * applied
+        temperature = final_temperature + (temperature - final_temperature) * decay
+
+    return times, temperatures, outputs
+
+
+def replay(candidates, times, temperatures, setpoint):
+    """Replay a recorded temperature trace through all candidates in open loop.
+
+    Returns the outputs each candidate would have given, shaped (samples, candidates). This shows
+    how a candidate reacts to the real sensor signal, including noise, but not how the plant
+    would have responded.
+
+    :param candidates: dict of candidate arrays, see make_candidates.
+    :param times: sample timestamps in seconds.
+    :param temperatures: recorded temperatures.
+    :param setpoint: target temperature.
+    """
+    times = np.asarray(times, dtype=float) - times[0]
+    pid = BatchPID(candidates, setpoint)
+    count = len(candidates["Kp"])
+
+    outputs = np.empty((len(times), count))
+    for i, (now, temperature) in enumerate(zip(times, temperatures)):
+        outputs[i] = pid(now, np.full(count, float(temperature)))
+
+    return outputs
+
+
+def step_metrics(times, temperatures, setpoint, settling_band=1.0):
+    """Rise time, overshoot and settling time of step responses.
+
+    Returns a dict of arrays with one value per candidate, times are NaN when not reached.
+
+    :param times: sample timestamps in seconds.
+    :param temperatures: temperatures shaped (samples, candidates).
+    :param setpoint: target temperature.
+    :param settling_band: temperature band around the setpoint for the settling time.
+    """
+    start = temperatures[0]
+    span = setpoint - start
+    progress = (temperatures - start) / np.where(span != 0, span, np.nan)
+
+    def first_crossing(fraction):
+        reached = progress >= fraction
+        index = np.argmax(reached, axis=0)
+        return np.where(reached.any(axis=0), times[index], np.nan)
+
+    rise_time = first_crossing(0.9) - first_crossing(0.1)
+    overshoot = np.maximum(0.0, (temperatures.max(axis=0) - setpoint) / np.abs(span) * 100)
+
+    outside = np.abs(temperatures - setpoint) > settling_band
+    last_outside = len(times) - 1 - np.argmax(outside[::-1], axis=0)
+    settling_time = np.where(
+        ~outside.any(axis=0),
+        times[0],
+        np.where(last_outside < len(times) - 1, times[np.minimum(last_outside + 1, len(times) - 1)], np.nan),
+    )
+
+    return {
+        "rise_time": rise_time,
+        "overshoot": overshoot,
+        "settling_time": settling_time,
+    }
+
+
+def rank(metrics, limit=10):
+    """Returns the indexes of the best candidates: settled ones first, then by settling time and overshoot"""
+    settling_time = np.where(np.isnan(metrics["settling_time"]), np.inf, metrics["settling_time"])
+    return np.lexsort((metrics["overshoot"], settling_time))[:limit]
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Batch PID tuning against a heater model")
+    parser.add_argument("--log", help="fit the plant model to the PID lines of this log file")
+    parser.add_argument("--gain", type=float, default=1.6)
+    parser.add_argument("--time-constant", type=float, default=300)
+    parser.add_argument("--dead-time", type=float, default=40)
+    parser.add_argument("--ambient", type=float, default=22)
+    parser.add_argument("--setpoint", type=float, default=125)
+    parser.add_argument("--duration", type=float, default=3600)
+    args = parser.parse_args()
+
+    if args.log:
+        model = fit_from_log(args.log)
+    else:
+        model = ThermalModel(args.gain, args.time_constant, args.dead_time, args.ambient)
+    print(
+        "Plant: gain {:.3f}, time constant {:.0f}s, dead time {:.0f}s".format(
+            model.gain, model.time_constant, model.dead_time
+        )
+    )
+
+    candidates = make_candidates(
+        Kp=np.linspace(0.5, 5, 10),
+        Ki=np.geomspace(0.002, 0.25, 10),
+        Kd=(0, 0.05, 1, 10),
+        sample_time=(1,),
+    )
+    times, temperatures, _ = simulate(
+        candidates, model, args.setpoint, duration=args.duration, step=0.5
+    )
+    metrics = step_metrics(times, temperatures, args.setpoint)
+
+    print("{:>8} {:>8} {:>8} {:>10} {:>10} {:>10}".format("Kp", "Ki", "Kd", "rise", "overshoot", "settling"))
+    for i in rank(metrics):
+        print(
+            "{:8.3f} {:8.4f} {:8.3f} {:9.0f}s {:9.1f}% {:9.0f}s".format(
+                candidates["Kp"][i],
+                candidates["Ki"][i],
+                candidates["Kd"][i],
+                metrics["rise_time"][i],
+                metrics["overshoot"][i],
+                metrics["settling_time"][i],
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,691 @@
+"""
+Headless simulator of the drizzle extractor. The real FSM runs on module_simulator,
+a control system whose component drivers read and write a physics model of the
+machine instead of the i2c bus and GPIO pins, so complete programs can be run and
+timed on any Linux box. With a common.module_clock.VirtualClock installed a full
+program runs in about a minute.
+"""
+if __name__ == "__main__":
+  #Add root folder (/src/) to paths for import if this script is run standalone
+  from pathlib import Path
+  import sys
+  sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+import enum
+import random
+
+import hardware.module_math as math
+import hardware.module_FSM as module_FSM
+from hardware.module_FSM import FailureMode, StateId
+from hardware.module_ControlSystemBase import (
+    module_ControlSystemBase,
+    INIT_STATUS_OK,
+    HardwareFailure,
+)
+from common import module_clock as clock
+from common.module_logging import get_app_logger
+
+
+# Gas constant in mbar * mL / (mol * K)
+GAS_CONSTANT = 83144.6
+
+
+class SimulatedPlant:
+    """
+    Lumped model of the machine. The solvent bottle feeds the extraction chamber (EXC)
+    through valve1, valve2 lets air into the EXC, valve3 connects the EXC to the
+    distillation chamber (EVC) and valve4 lets air into the EVC. The pump evacuates
+    the EVC, which holds the pressure sensor, and the heater plate is the EVC bottom.
+
+    Gas is kept as pressure times volume in mbar * mL at constant temperature, so the
+    pressure of a chamber is the gas amount over the volume not taken by liquid. Liquid
+    leaves the EXC through valve3 while there is any, after that valve3 passes gas. The
+    flows of one step are limited to the amount that equalizes the pressures, which
+    keeps the explicit integration stable with fully open valves.
+
+    All model parameters are class attributes, they can be overridden per instance
+    with lowercase keyword arguments, eg. SimulatedPlant(evc_leak=2) for a leaky EVC.
+    """
+
+    # chambers
+    EVC_VOLUME = 290.0  # mL, matches the FSM_EX evc_volume setting
+    EXC_VOLUME = 110.0  # mL, free volume of the EXC with plant material
+    SOLVENT_VOLUME = 500.0  # mL of solvent in the bottle
+    AMBIENT_PRESSURE = 1013.0  # mbar
+    AMBIENT_TEMPERATURE = 22.0
+    RESERVOIR_HEAD = 30.0  # mbar, the bottle sits below the EXC so it drains back
+
+    # leak conductance from ambient in mL/s
+    EVC_LEAK = 0.1
+    EXC_LEAK = 0.05
+
+    # pump speed in mL/s at full duty, falling to zero at the ultimate pressure
+    PUMP_SPEED = 60.0
+    PUMP_ULTIMATE_PRESSURE = 40.0
+
+    # valve opening is ((position - dead band) / (100 - dead band)) ** exponent
+    VALVE_DEAD_BAND = 8.0
+    VALVE_EXPONENT = 2.0
+    VALVE_GAS_CONDUCTANCE = 1000.0  # mL/s fully open
+    VALVE1_LIQUID_CONDUCTANCE = 0.5  # mL/(s * mbar) fully open
+    VALVE3_LIQUID_CONDUCTANCE = 0.075  # mL/(s * mbar) fully open
+
+    # heater plate and liquid, powers in W
+    HEATER_WATTAGE = 60.0
+    PLATE_HEAT_CAPACITY = 110.0  # J/K
+    PLATE_LOSS = 0.18  # W/K to ambient
+    PLATE_TO_LIQUID = 0.2  # W/K with the plate fully wetted
+    WETTING_VOLUME = 5.0  # mL, below this the plate dries up and takes less heat
+    LIQUID_LOSS = 0.05  # W/K to ambient
+    FAN_LIQUID_LOSS = 0.1  # W/K to ambient extra with the fan at full speed
+
+    # solvent, ethanol
+    SOLVENT_DENSITY = 0.789  # g/mL
+    SOLVENT_HEAT_CAPACITY = 2.44  # J/(g * K)
+    SOLVENT_LATENT_HEAT = 846.0  # J/g
+    SOLVENT_MOLAR_MASS = 46.07  # g/mol
+    SOLVENT_ANTOINE = (8.20417, 1642.89, 230.3)
+
+    # sensor noise, standard deviation
+    PRESSURE_NOISE = 0.02  # mbar
+    TEMPERATURE_NOISE = 0.05
+
+    # longest integration step in seconds
+    MAX_STEP = 0.05
+
+    # liquid volumes below this are treated as empty, in mL
+    LIQUID_EPSILON = 0.01
+
+    def __init__(self, timer=clock.monotonic, seed=0, **parameters):
+        """
+        :param timer: function returning the time in seconds, the model advances with it.
+        :param seed: seed of the sensor noise.
+        :param parameters: overrides of the model parameters.
+        """
+        for name, value in parameters.items():
+            attribute = name.upper()
+            if not hasattr(SimulatedPlant, attribute):
+                raise ValueError("Unknown plant parameter: {}".format(name))
+            setattr(self, attribute, value)
+
+        self._timer = timer
+        self._random = random.Random(seed)
+
+        # the machine was switched off with the valves in relax position
+        self.valves = {"valve1": 0.0, "valve2": 100.0, "valve3": 100.0, "valve4": 100.0}
+        self.pump = 0
+        self.heater = 0.0
+        self.fan = 0
+
+        self.solvent = self.SOLVENT_VOLUME
+        self.exc_liquid = 0.0
+        self.evc_liquid = 0.0
+        self.evaporated = 0.0
+        self.exc_gas = self.AMBIENT_PRESSURE * self.EXC_VOLUME
+        self.evc_gas = self.AMBIENT_PRESSURE * self.EVC_VOLUME
+        self.plate_temperature = self.AMBIENT_TEMPERATURE
+        self.liquid_temperature = self.AMBIENT_TEMPERATURE
+
+        # simulated seconds
+        self.time = 0.0
+        self._last_update = timer()
+
+    @property
+    def exc_gas_volume(self):
+        return max(1.0, self.EXC_VOLUME - self.exc_liquid)
+
+    @property
+    def evc_gas_volume(self):
+        return max(1.0, self.EVC_VOLUME - self.evc_liquid)
+
+    @property
+    def exc_pressure(self):
+        return self.exc_gas / self.exc_gas_volume
+
+    @property
+    def evc_pressure(self):
+        return self.evc_gas / self.evc_gas_volume
+
+    @property
+    def gas_temperature(self):
+        return self.AMBIENT_TEMPERATURE + 0.1 * (self.liquid_temperature - self.AMBIENT_TEMPERATURE)
+
+    def read_pressure(self):
+        """EVC pressure as measured by the pressure sensor"""
+        self.update()
+        return self.evc_pressure + self._random.gauss(0, self.PRESSURE_NOISE)
+
+    def read_plate_temperature(self):
+        """Heater plate temperature as measured by the thermistor"""
+        self.update()
+        return self.plate_temperature + self._random.gauss(0, self.TEMPERATURE_NOISE)
+
+    def opening(self, valve):
+        """Relative flow area of a valve, between 0 and 1
+
+        :param valve: valve name, eg. "valve3".
+        """
+        position = self.valves[valve]
+        if position <= self.VALVE_DEAD_BAND:
+            return 0.0
+        return ((position - self.VALVE_DEAD_BAND) / (100 - self.VALVE_DEAD_BAND)) ** self.VALVE_EXPONENT
+
+    def update(self):
+        """Advance the model to the current time of the clock"""
+        now = self._timer()
+        elapsed = now - self._last_update
+        self._last_update = now
+        while elapsed > 1e-9:
+            dt = min(elapsed, self.MAX_STEP)
+            self._step(dt)
+            elapsed -= dt
+
+    def _step(self, dt):
+        self.time += dt
+
+        # leaks and air valves
+        self.exc_gas += self._gas_from_ambient(
+            self.EXC_LEAK + self.VALVE_GAS_CONDUCTANCE * self.opening("valve2"),
+            self.exc_pressure, self.exc_gas_volume, dt,
+        )
+        self.evc_gas += self._gas_from_ambient(
+            self.EVC_LEAK + self.VALVE_GAS_CONDUCTANCE * self.opening("valve4"),
+            self.evc_pressure, self.evc_gas_volume, dt,
+        )
+
+        self._step_valve1(dt)
+        self._step_valve3(dt)
+        self._step_pump(dt)
+        self._step_heat(dt)
+
+    def _gas_from_ambient(self, conductance, pressure, volume, dt):
+        difference = self.AMBIENT_PRESSURE - pressure
+        amount = conductance * difference * dt
+        limit = difference * volume
+        return min(amount, limit) if difference > 0 else max(amount, limit)
+
+    # Solvent flows from the bottle into the EXC, or drains back when the EXC is at ambient pressure
+    def _step_valve1(self, dt):
+        opening = self.opening("valve1")
+        if not opening:
+            return
+
+        pressure = self.exc_pressure
+        difference = self.AMBIENT_PRESSURE - self.RESERVOIR_HEAD - pressure
+        conductance = self.VALVE1_LIQUID_CONDUCTANCE * opening
+        # liquid volume that brings the EXC to the bottle pressure
+        limit = abs(difference) / (pressure / self.exc_gas_volume)
+
+        if difference > 0:
+            volume = min(conductance * difference * dt, limit, self.solvent, self.exc_gas_volume - 1.0)
+            self.solvent -= volume
+            self.exc_liquid += volume
+        elif self.exc_liquid > self.LIQUID_EPSILON:
+            volume = min(-conductance * difference * dt, limit, self.exc_liquid)
+            self.exc_liquid -= volume
+            self.solvent += volume
+
+    # Liquid, or gas once the EXC is empty, between the EXC and the EVC
+    def _step_valve3(self, dt):
+        opening = self.opening("valve3")
+        if not opening:
+            return
+
+        exc_pressure = self.exc_pressure
+        evc_pressure = self.evc_pressure
+        difference = exc_pressure - evc_pressure
+
+        if self.exc_liquid > self.LIQUID_EPSILON and difference > 0:
+            limit = difference / (exc_pressure / self.exc_gas_volume + evc_pressure / self.evc_gas_volume)
+            volume = min(
+                self.VALVE3_LIQUID_CONDUCTANCE * opening * difference * dt,
+                limit,
+                self.exc_liquid,
+                self.evc_gas_volume - 1.0,
+            )
+            if volume <= 0:
+                return
+            # the solvent comes in at ambient temperature
+            self.liquid_temperature = (
+                self.liquid_temperature * self.evc_liquid + self.AMBIENT_TEMPERATURE * volume
+            ) / (self.evc_liquid + volume)
+            self.exc_liquid -= volume
+            self.evc_liquid += volume
+        else:
+            limit = difference / (1 / self.exc_gas_volume + 1 / self.evc_gas_volume)
+            amount = self.VALVE_GAS_CONDUCTANCE * opening * difference * dt
+            amount = min(amount, limit) if difference > 0 else max(amount, limit)
+            self.exc_gas -= amount
+            self.evc_gas += amount
+
+    def _step_pump(self, dt):
+        pressure = self.evc_pressure
+        if not self.pump or pressure <= self.PUMP_ULTIMATE_PRESSURE:
+            return
+        speed = self.PUMP_SPEED * self.pump / 100 * (1 - self.PUMP_ULTIMATE_PRESSURE / pressure)
+        self.evc_gas -= min(speed * pressure * dt, (pressure - self.PUMP_ULTIMATE_PRESSURE) * self.evc_gas_volume)
+
+    # Heater plate, liquid temperature and boil-off into the EVC gas
+    def _step_heat(self, dt):
+        ambient = self.AMBIENT_TEMPERATURE
+        heater_power = self.heater / 100 * self.HEATER_WATTAGE
+        wetted = min(1.0, self.evc_liquid / self.WETTING_VOLUME)
+        to_liquid = self.PLATE_TO_LIQUID * wetted * (self.plate_temperature - self.liquid_temperature)
+
+        self.plate_temperature += (
+            heater_power - self.PLATE_LOSS * (self.plate_temperature - ambient) - to_liquid
+        ) * dt / self.PLATE_HEAT_CAPACITY
+
+        if self.evc_liquid <= self.LIQUID_EPSILON:
+            self.liquid_temperature = self.plate_temperature
+            return
+
+        # a floor on the heat capacity keeps the last drops stable
+        mass = self.evc_liquid * self.SOLVENT_DENSITY
+        heat_capacity = max(mass, 1.0) * self.SOLVENT_HEAT_CAPACITY
+        liquid_loss = (self.LIQUID_LOSS + self.FAN_LIQUID_LOSS * self.fan / 100) * (self.liquid_temperature - ambient)
+        self.liquid_temperature += (to_liquid - liquid_loss) * dt / heat_capacity
+
+        # Boil off the heat above the boiling temperature, but no more vapour than brings the EVC to the
+        # vapour pressure of the liquid, the rest of the heat stays in the liquid
+        pressure = self.evc_pressure
+        boiling_temperature = math.get_boiling_temperature(pressure, self.SOLVENT_ANTOINE)
+        if self.liquid_temperature > boiling_temperature:
+            vapour_temperature = self.liquid_temperature + 273.15
+            vapour_limit = (
+                (math.get_vapour_pressure(self.liquid_temperature, self.SOLVENT_ANTOINE) - pressure)
+                * self.evc_gas_volume
+            )
+            evaporated_mass = min(
+                (self.liquid_temperature - boiling_temperature) * heat_capacity / self.SOLVENT_LATENT_HEAT,
+                vapour_limit / (GAS_CONSTANT * vapour_temperature) * self.SOLVENT_MOLAR_MASS,
+                mass,
+            )
+            self.liquid_temperature -= evaporated_mass * self.SOLVENT_LATENT_HEAT / heat_capacity
+            self.evc_liquid -= evaporated_mass / self.SOLVENT_DENSITY
+            self.evaporated += evaporated_mass / self.SOLVENT_DENSITY
+            self.evc_gas += evaporated_mass / self.SOLVENT_MOLAR_MASS * GAS_CONSTANT * vapour_temperature
+
+    @property
+    def status(self):
+        return {
+            "time": self.time,
+            "evc_pressure": self.evc_pressure,
+            "exc_pressure": self.exc_pressure,
+            "evc_liquid": self.evc_liquid,
+            "exc_liquid": self.exc_liquid,
+            "solvent": self.solvent,
+            "evaporated": self.evaporated,
+            "plate_temperature": self.plate_temperature,
+            "liquid_temperature": self.liquid_temperature,
+            "valves": dict(self.valves),
+            "pump": self.pump,
+            "heater": self.heater,
+        }
+
+
+###---===SIMULATED COMPONENT DRIVERS===---###
+# Same interfaces as the drivers in hardware.components, backed by a SimulatedPlant
+
+
+class SimulatedValveController:
+    STEPS_PER_FULL_SWING = 265
+    FULLSTEP_DELAY = 1.6 / 1000
+    STEP_COUNT_FULL_STEP = 4
+    STEPPER_POS_START = 0
+    STEPPER_POS_END = 100
+
+    class ValveList(enum.Enum):
+        VALVE1 = "valve1"
+        VALVE2 = "valve2"
+        VALVE3 = "valve3"
+        VALVE4 = "valve4"
+
+    def __init__(self, plant):
+        self._plant = plant
+        self._current_position = {
+            valve: int(plant.valves[valve.value] * self.STEPS_PER_FULL_SWING / 100) for valve in self.ValveList
+        }
+        self._current_position_pct = {valve: plant.valves[valve.value] for valve in self.ValveList}
+
+    @property
+    def valve_list(self):
+        return [v for v in self.ValveList]
+
+    def get_valve_position(self, valve):
+        return self._current_position_pct[valve]
+
+    def estimate_move_time(self, steps):
+        return steps * self.STEP_COUNT_FULL_STEP * self.FULLSTEP_DELAY
+
+    # The valve takes its new position at the start of the move, the move time passes after
+    def move_to_pos_fullstep(self, valve_name, pos):
+        pos = min(max(pos, self.STEPPER_POS_START), self.STEPPER_POS_END)
+        absolute_pos = int(pos * self.STEPS_PER_FULL_SWING / 100)
+        steps = abs(absolute_pos - self._current_position[valve_name])
+        if steps == 0:
+            return
+
+        self._plant.update()
+        self._plant.valves[valve_name.value] = absolute_pos * 100 / self.STEPS_PER_FULL_SWING
+        self._current_position[valve_name] = absolute_pos
+        self._current_position_pct[valve_name] = pos
+        clock.sleep(self.estimate_move_time(steps))
+
+    def move_batch(self, targets):
+        final_targets = {}
+        for valve_name, pos in targets:
+            final_targets.pop(valve_name, None)
+            final_targets[valve_name] = pos
+
+        # close before open, like the stepper valve controller
+        moves = sorted(final_targets.items(), key=lambda move: move[1] > self._current_position_pct[move[0]])
+        estimated_time = 0
+        for valve_name, pos in moves:
+            absolute_pos = int(min(max(pos, 0), 100) * self.STEPS_PER_FULL_SWING / 100)
+            estimated_time += self.estimate_move_time(abs(absolute_pos - self._current_position[valve_name]))
+            self.move_to_pos_fullstep(valve_name, pos)
+        return estimated_time
+
+    def shutdown(self):
+        pass
+
+
+class SimulatedPressureSensor:
+    def __init__(self, plant):
+        self._plant = plant
+
+    @property
+    def pressure(self):
+        return self._plant.read_pressure()
+
+    @property
+    def temperature(self):
+        self._plant.update()
+        return self._plant.gas_temperature
+
+
+class SimulatedThermistors:
+    def __init__(self, plant):
+        self._plant = plant
+
+    def get_temperature(self, thermistor_channel):
+        if thermistor_channel == "thermistor0":
+            return self._plant.read_plate_temperature()
+        if thermistor_channel == "thermistor1":
+            return self._plant.AMBIENT_TEMPERATURE
+        raise LookupError("Pin not found in object")
+
+    @property
+    def get_all_temperatures(self):
+        return {key: float(self.get_temperature(key)) for key in ("thermistor0", "thermistor1")}
+
+
+class SimulatedBottomHeater:
+    def __init__(self, plant, max_wattage):
+        self._plant = plant
+        self._max_wattage = max_wattage
+
+    @property
+    def max_wattage(self):
+        return self._max_wattage
+
+    @property
+    def wattage(self):
+        return self._max_wattage / 100 * self._plant.heater
+
+    @wattage.setter
+    def wattage(self, wattage):
+        self.power_percent = (wattage / self._max_wattage) * 100
+
+    @property
+    def power_percent(self):
+        return self._plant.heater
+
+    @power_percent.setter
+    def power_percent(self, power_pct):
+        if not 0 <= power_pct <= 100:
+            raise AttributeError("Wattage must be between 0 and 100%")
+        self._plant.update()
+        self._plant.heater = power_pct
+
+
+class SimulatedPump:
+    @property
+    def pump_pwm(self):
+        return self._plant.pump
+
+    @pump_pwm.setter
+    def pump_pwm(self, value):
+        if not isinstance(value, int) or not 0 <= value <= 100:
+            raise Exception("Error, pwm value must be an integer between 0 and 100")
+        self._plant.update()
+        self._plant.pump = value
+
+    def __init__(self, plant):
+        self._plant = plant
+
+
+class SimulatedFan:
+    FAN_ADC_LEVEL_ON = 1
+    FAN_ADC_LEVEL_OFF = 0
+    FAN_ADC_LEVEL_ERROR = -1
+
+    def __init__(self, plant):
+        self._plant = plant
+
+    @property
+    def fan_adc_check(self):
+        return self.FAN_ADC_LEVEL_ON if self._plant.fan else self.FAN_ADC_LEVEL_OFF
+
+    @property
+    def fan_adc_value(self):
+        return self._plant.fan
+
+    @property
+    def fan_pwm(self):
+        return self._plant.fan
+
+    @fan_pwm.setter
+    def fan_pwm(self, value):
+        if not isinstance(value, int) or not 0 <= value <= 100:
+            raise Exception("Error, pwm value must be an integer between 0 and 100")
+        self._plant.update()
+        self._plant.fan = value
+
+
+class SimulatedLight:
+    def __init__(self):
+        self.light = (0, 0, 0, 0)
+
+    def light_warm(self):
+        self.light = (100, 0, 0, 0)
+
+    def light_red(self):
+        self.light = (0, 100, 0, 0)
+
+    def light_off(self):
+        self.light = (0, 0, 0, 0)
+
+    def toggle_white_light(self):
+        if self.light == (0, 0, 0, 0):
+            self.light_warm()
+        else:
+            self.light_off()
+
+
+class SimulatedPhysicalInterface:
+    def __init__(self):
+        self.error_indicator = [False, False, False, False]
+        self.program = 1
+        self.state = None
+        self.red_light = False
+
+    def set_error_indicator(self, LED1=False, LED2=False, LED3=False, LED4=False):
+        self.error_indicator = [LED1, LED2, LED3, LED4]
+
+    def set_program_and_state(self, new_program, new_state):
+        self.program = new_program
+        self.state = new_state
+
+    def set_program(self, new_program):
+        self.program = new_program
+
+    def set_state(self, new_state, force_physical_update=False):
+        self.state = new_state
+
+    def toggle_reg_light(self):
+        self.red_light = not self.red_light
+
+    @property
+    def button_pressed(self):
+        return None
+
+    @property
+    def button_pressed_force(self):
+        return None
+
+    def shutdown(self):
+        pass
+
+
+class module_simulator(module_ControlSystemBase):
+    """
+    Control system backed by a SimulatedPlant. It runs the same FSM, PID and config code
+    as module_HardwareControlSystem, only the component drivers are simulated.
+    """
+
+    CONFIG_FILE = "simulator.ini"
+    BOTTOM_HEATER_WATTAGE = 60
+
+    # period of the control loop in seconds, like the controlthread
+    LOOP_PERIOD = 0.01
+
+    def __init__(self, plant=None, config_file=None):
+        """
+        :param plant: SimulatedPlant to run against, a default plant if None.
+        :param config_file: config file to use, written with the defaults if missing.
+        """
+        self._logger = get_app_logger(str(self.__class__))
+        self.device_version = "simulator"
+        if config_file is not None:
+            self.CONFIG_FILE = config_file
+
+        self._first_run = True
+        self.init_status = None
+        self.init_errors = []
+
+        self.init_config()
+
+        self.plant = plant if plant is not None else SimulatedPlant()
+
+        self._valve_controller = SimulatedValveController(self.plant)
+        self._myvalves = self._valve_controller.valve_list
+        self._valves = self._valve_controller.ValveList
+        self.set_valves_in_relax_position()
+
+        self._mythermistors = SimulatedThermistors(self.plant)
+        self._mypressuresensor = SimulatedPressureSensor(self.plant)
+        self._fan_control = SimulatedFan(self.plant)
+        self._myphysicalinterface = SimulatedPhysicalInterface()
+        self._mybottomheater = SimulatedBottomHeater(self.plant, self.BOTTOM_HEATER_WATTAGE)
+        self._mypump = SimulatedPump(self.plant)
+        self._my_rgbw_light = SimulatedLight()
+
+        self.FSM = module_FSM.FSM(self)
+        self.reload_PID()
+
+        self._pid_status_log_interval = 10
+        self._pid_last_log_time = None
+
+        self.init_status = INIT_STATUS_OK
+
+    def flush_pwm_outputs(self):
+        pass
+
+    def shutdown(self):
+        self._logger.info("Simulator - shutdown completed.")
+
+    def run_program(self, run_full_extraction=True, timeout=None):
+        """Start an extraction and run the FSM like the control loop does, until the machine is
+        back in the ready state or in the error state. Returns the StateId it ended in.
+
+        :param run_full_extraction: distill after the extraction, like Command_StartExtraction.
+        :param timeout: give up after this many seconds, None to run until done.
+        """
+        self.FSM.SetFSMData("run_full_extraction", 1 if run_full_extraction else 0)
+        self.FSM.SetFSMData("running_flag", True)
+        self.FSM.SetFSMData("start_flag", True)
+
+        start_time = clock.time()
+        started = False
+        while True:
+            try:
+                self.FSM.Execute()
+            except HardwareFailure:
+                self._logger.exception("Electrical error. Entering error state...")
+                self.FSM.ToTransistion(StateId.ERROR)
+            except Exception as e:
+                self._logger.exception("FSM state transition failed: {!r}".format(e))
+                self.FSM.fsmData["failure_mode"] = FailureMode.UNKNOWN_ERROR
+                self.FSM.ToTransistion(StateId.ERROR)
+
+            if self.FSM.curStateId is not StateId.READY:
+                started = True
+            if self.FSM.trans is None and (
+                self.FSM.curStateId is StateId.ERROR or (started and self.FSM.curStateId is StateId.READY)
+            ):
+                return self.FSM.curStateId
+
+            if timeout is not None and clock.time() - start_time > timeout:
+                self._logger.error("Program did not finish within {} seconds".format(timeout))
+                return self.FSM.curStateId
+
+            clock.sleep(self.LOOP_PERIOD)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run a program on the simulated extraction machine")
+    parser.add_argument("--config", default=module_simulator.CONFIG_FILE, help="config file of the simulated machine")
+    parser.add_argument("--extract-only", action="store_true", help="stop after the extraction, do not distill")
+    parser.add_argument("--timeout", type=float, default=None, help="give up after this many seconds of machine time")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the sensor noise")
+    parser.add_argument("--realtime", action="store_true", help="run at wall clock speed instead of a virtual clock")
+    args = parser.parse_args()
+
+    if not args.realtime:
+        clock.set_clock(clock.VirtualClock())
+
+    machine = module_simulator(SimulatedPlant(seed=args.seed), config_file=args.config)
+
+    durations = []
+    last_transition = [clock.time()]
+
+    def record_transition(from_state, to_state, state, handle, fsm_data):
+        now = clock.time()
+        durations.append((from_state.name, now - last_transition[0]))
+        last_transition[0] = now
+        print("{:<26} {:>8.0f}s  {:>7.1f} mbar  {:>6.1f} C".format(
+            from_state.name, durations[-1][1], machine.plant.evc_pressure, machine.plant.plate_temperature
+        ))
+
+    machine.FSM.AddTransitionListener(record_transition)
+
+    start_time = clock.time()
+    final_state = machine.run_program(run_full_extraction=not args.extract_only, timeout=args.timeout)
+
+    print("Finished in {} after {:.0f}s".format(final_state.name, clock.time() - start_time))
+    if final_state is StateId.ERROR:
+        print("Failure: {} - {}".format(
+            machine.FSM.fsmData["failure_mode"].name, machine.FSM.fsmData["failure_description"]
+        ))
+    status = machine.plant.status
+    print("Aspirated {:.1f} mL, evaporated {:.1f} mL, {:.1f} mL left in the EVC".format(
+        machine.FSM.fsmData["aspirate_volume_actual"], status["evaporated"], status["evc_liquid"]
+    ))
+
+
+if __name__ == "__main__":
+    main()
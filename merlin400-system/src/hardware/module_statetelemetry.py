@@ -0,0 +1,221 @@
+if __name__ == "__main__":
+  #Add root folder (/src/) to paths for import if this script is run standalone
+  from pathlib import Path
+  import sys
+  sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+import enum
+import json
+import sqlite3
+import statistics
+
+from common import module_clock as clock
+from common.module_logging import get_app_logger
+from hardware.module_FSM import StateId
+
+
+class module_statetelemetry:
+    """
+    Append-only log of FSM state durations in the stats database. A row is written every time
+    a state is left, with the wall clock and monotonic exit time, the duration, the pause
+    adjusted duration and a snapshot of the main fsmData values. A run starts when the machine
+    leaves the ready state and ends when it is back in ready, rows of states outside a run have
+    no run id.
+    """
+
+    DB_FILE = "stats.db"
+
+    # fsmData values stored with every transition
+    FSM_DATA_KEYS = (
+        "run_full_extraction",
+        "exc_volume",
+        "exc_volume_liquid",
+        "aspirate_volume_target",
+        "aspirate_volume_actual",
+        "average_aspirate_speed",
+        "system_leak",
+        "flushes_performed",
+        "final_air_cycles_performed",
+        "wait_time_saved",
+        "target_temp",
+        "failure_mode",
+    )
+
+    def __init__(self, db_file=DB_FILE):
+        self._logger = get_app_logger(str(self.__class__))
+        self._db_file = db_file
+        self._state_enter_time = clock.monotonic()
+
+        with sqlite3.connect(self._db_file) as conn:
+            conn.execute(
+                "create table if not exists state_log("
+                "run_id int, ts real, ts_monotonic real, state varchar, handle varchar, next_state varchar, "
+                "duration real, duration_with_pause real, data text)"
+            )
+            conn.execute("create index if not exists state_log_run_id on state_log(run_id)")
+            row = conn.execute("select max(run_id) from state_log").fetchone()
+
+        self._last_run_id = row[0] or 0
+        self._run_id = None
+
+    @property
+    def run_id(self):
+        return self._run_id
+
+    def _get_fsm_data(self, fsm_data):
+        data = {}
+        for key in self.FSM_DATA_KEYS:
+            value = fsm_data.get(key)
+            data[key] = value.name if isinstance(value, enum.Enum) else value
+        return data
+
+    def record_transition(self, from_state, to_state, state, handle, fsm_data):
+        """Store the state that is left, called by the FSM on every transition.
+
+        :param from_state: StateId of the state that is left.
+        :param to_state: StateId of the next state.
+        :param state: the State object that is left.
+        :param handle: human readable handle of the state that is left.
+        :param fsm_data: FSM data dictionary.
+        """
+        now = clock.monotonic()
+        duration = now - self._state_enter_time
+        self._state_enter_time = now
+
+        if from_state is StateId.READY:
+            self._last_run_id += 1
+            self._run_id = self._last_run_id
+            run_id = None
+        else:
+            run_id = self._run_id
+
+        try:
+            with sqlite3.connect(self._db_file) as conn:
+                conn.execute(
+                    "insert into state_log values (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        run_id,
+                        clock.time(),
+                        now,
+                        from_state.name,
+                        handle,
+                        to_state.name,
+                        duration,
+                        state.eventDurationWithPause,
+                        json.dumps(self._get_fsm_data(fsm_data), default=str),
+                    ),
+                )
+        except sqlite3.Error:
+            # telemetry must never stop the machine
+            self._logger.exception("Failed to store state transition")
+
+        if to_state is StateId.READY:
+            self._run_id = None
+
+    def state_durations(self, runs=10):
+        """Duration distribution per state over the last runs, sorted by the total time spent.
+
+        :param runs: number of most recent runs to include.
+        """
+        with sqlite3.connect(self._db_file) as conn:
+            rows = conn.execute(
+                "select run_id, state, duration, duration_with_pause from state_log "
+                "where run_id in (select distinct run_id from state_log where run_id is not null "
+                "order by run_id desc limit ?)",
+                (int(runs),),
+            ).fetchall()
+
+        durations = {}
+        run_ids = set()
+        for run_id, state, duration, duration_with_pause in rows:
+            run_ids.add(run_id)
+            durations.setdefault(state, []).append((duration, duration_with_pause))
+
+        total = sum(duration for values in durations.values() for duration, _ in values)
+        result = []
+        for state, values in durations.items():
+            state_durations = sorted(duration for duration, _ in values)
+            result.append(
+                {
+                    "state": state,
+                    "count": len(state_durations),
+                    "mean": statistics.mean(state_durations),
+                    "median": statistics.median(state_durations),
+                    "p90": state_durations[min(len(state_durations) - 1, int(0.9 * len(state_durations)))],
+                    "min": state_durations[0],
+                    "max": state_durations[-1],
+                    "meanWithPause": statistics.mean(duration for _, duration in values),
+                    "share": sum(state_durations) / total if total else 0,
+                }
+            )
+
+        result.sort(key=lambda item: item["mean"] * item["count"], reverse=True)
+        return {"runs": len(run_ids), "states": result}
+
+    def time_saved(self, runs=10):
+        """Time saved by the condition waits per program over the last runs. A program is told by the first
+        state of its runs and whether it ran a full extraction, the time saved of a run is the wait_time_saved
+        of its last state.
+
+        :param runs: number of most recent runs to include.
+        """
+        with sqlite3.connect(self._db_file) as conn:
+            rows = conn.execute(
+                "select run_id, state, data from state_log "
+                "where run_id in (select distinct run_id from state_log where run_id is not null "
+                "order by run_id desc limit ?) order by run_id, ts_monotonic",
+                (int(runs),),
+            ).fetchall()
+
+        run_programs = {}
+        run_time_saved = {}
+        for run_id, state, data in rows:
+            data = json.loads(data)
+            run_programs.setdefault(run_id, (state, bool(data.get("run_full_extraction"))))
+            run_time_saved[run_id] = data.get("wait_time_saved") or 0
+
+        time_saved = {}
+        for run_id, program in run_programs.items():
+            time_saved.setdefault(program, []).append(run_time_saved[run_id])
+
+        result = [
+            {
+                "program": program,
+                "runFullExtraction": run_full_extraction,
+                "count": len(values),
+                "total": sum(values),
+                "mean": statistics.mean(values),
+            }
+            for (program, run_full_extraction), values in time_saved.items()
+        ]
+        result.sort(key=lambda item: item["total"], reverse=True)
+        return {"runs": len(run_programs), "programs": result}
+
+
+def main():
+    import sys
+
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    stats = module_statetelemetry().state_durations(runs)
+    print("State durations over the last {} runs".format(stats["runs"]))
+    print("{:<26} {:>6} {:>9} {:>9} {:>9} {:>7}".format("state", "count", "mean", "median", "p90", "share"))
+    for item in stats["states"]:
+        print(
+            "{:<26} {:>6} {:>8.0f}s {:>8.0f}s {:>8.0f}s {:>6.1%}".format(
+                item["state"], item["count"], item["mean"], item["median"], item["p90"], item["share"]
+            )
+        )
+
+    stats = module_statetelemetry().time_saved(runs)
+    print("Time saved by condition waits over the last {} runs".format(stats["runs"]))
+    print("{:<26} {:>5} {:>6} {:>9} {:>9}".format("program", "full", "count", "total", "mean"))
+    for item in stats["programs"]:
+        print(
+            "{:<26} {:>5} {:>6} {:>8.0f}s {:>8.1f}s".format(
+                item["program"], "yes" if item["runFullExtraction"] else "no", item["count"], item["total"], item["mean"]
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+if __name__ == "__main__":
+  #Add root folder (/src/) to paths for import if this script is run standalone
+  from pathlib import Path
+  import sys
+  sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+import datetime
+import math
+import re
+
+import numpy as np
+
+
+class ThermalModel:
+    """
+    First order plus dead time (FOPDT) model of the bottom heater plate and chamber:
+
+        tau * dT/dt = -(T - ambient) + gain * u(t - dead_time)
+
+    with u the heater output in %. The model is used to plan a feed-forward power trajectory
+    that reaches a setpoint as fast as the output limit allows without overshoot.
+    """
+
+    def __init__(self, gain, time_constant, dead_time, ambient=20.0):
+        """
+        :param gain: steady state temperature rise in degrees per % heater output.
+        :param time_constant: time constant in seconds.
+        :param dead_time: dead time in seconds.
+        :param ambient: ambient temperature.
+        """
+        self.gain = gain
+        self.time_constant = time_constant
+        self.dead_time = dead_time
+        self.ambient = ambient
+
+    def steady_state_output(self, temperature):
+        """Heater output in % that holds the given temperature"""
+        return max(0.0, (temperature - self.ambient) / self.gain)
+
+    def time_to_reach(self, start_temperature, target_temperature, output):
+        """Time in seconds the undelayed response with a constant output needs to get from start to target.
+        Returns math.inf if the target is never reached.
+
+        :param start_temperature: temperature at the start.
+        :param target_temperature: temperature to reach.
+        :param output: constant heater output in %.
+        """
+        final_temperature = self.ambient + self.gain * output
+        if (target_temperature - start_temperature) * (final_temperature - start_temperature) <= 0:
+            return 0.0 if target_temperature == start_temperature else math.inf
+        if abs(final_temperature - start_temperature) <= abs(target_temperature - start_temperature):
+            return math.inf
+        return self.time_constant * math.log(
+            (final_temperature - start_temperature) / (final_temperature - target_temperature)
+        )
+
+    def plan(self, start_temperature, setpoint, max_output):
+        """Plan a time optimal heat-up: max_output until the switch time, then the steady state output.
+        Both output changes act after the dead time, so the temperature reaches the setpoint exactly
+        when the switch to the steady state output takes effect and there is no overshoot. At or above
+        the setpoint the steady state output is held from the start. Returns a HeatupPlan.
+
+        :param start_temperature: current temperature.
+        :param setpoint: target temperature.
+        :param max_output: maximum heater output in %.
+        """
+        hold_output = min(self.steady_state_output(setpoint), max_output)
+        if start_temperature >= setpoint:
+            switch_time = 0.0
+        else:
+            switch_time = self.time_to_reach(start_temperature, setpoint, max_output)
+        return HeatupPlan(self, start_temperature, setpoint, max_output, hold_output, switch_time)
+
+    def response(self, start_temperature, segments, elapsed):
+        """Temperature after elapsed seconds for a piecewise constant output.
+
+        :param start_temperature: temperature at time 0, the system is assumed to be in rest.
+        :param segments: list of (start time, output) tuples, sorted by start time.
+        :param elapsed: time since start in seconds.
+        """
+        temperature = start_temperature
+        # the output only acts on the temperature after the dead time
+        t = self.dead_time
+        if elapsed <= t:
+            return temperature
+
+        for i, (segment_start, output) in enumerate(segments):
+            segment_end = segments[i + 1][0] + self.dead_time if i + 1 < len(segments) else math.inf
+            segment_end = min(segment_end, elapsed)
+            if segment_end <= t:
+                continue
+            final_temperature = self.ambient + self.gain * output
+            temperature = final_temperature + (temperature - final_temperature) * math.exp(
+                -(segment_end - t) / self.time_constant
+            )
+            t = segment_end
+            if t >= elapsed:
+                break
+
+        return temperature
+
+
+class HeatupPlan:
+    """Feed-forward output and reference temperature over time for one heat-up"""
+
+    def __init__(self, model, start_temperature, setpoint, max_output, hold_output, switch_time):
+        self.model = model
+        self.start_temperature = start_temperature
+        self.setpoint = setpoint
+        self.max_output = max_output
+        self.hold_output = hold_output
+        self.switch_time = switch_time
+        self._segments = [(0.0, max_output), (switch_time, hold_output)]
+
+    def output(self, elapsed):
+        """Feed-forward heater output in % at elapsed seconds after the start of the plan"""
+        return self.max_output if elapsed < self.switch_time else self.hold_output
+
+    def reference(self, elapsed):
+        """Temperature the model predicts for the planned output, never above the setpoint"""
+        return min(self.setpoint, self.model.response(self.start_temperature, self._segments, elapsed))
+
+
+def fit(times, temperatures, outputs, ambient=None, max_dead_time=120, dead_time_step=None, max_interval=60):
+    """Fit a ThermalModel to a recorded run with least squares.
+
+    The derivative of the temperature is regressed on the temperature and the delayed output,
+    the dead time is selected by scanning candidates and keeping the one with the lowest residual.
+
+    :param times: sample timestamps in seconds.
+    :param temperatures: measured temperatures.
+    :param outputs: heater output in % applied from each sample until the next.
+    :param ambient: ambient temperature, the first temperature sample if None.
+    :param max_dead_time: largest dead time in seconds to try.
+    :param dead_time_step: resolution of the dead time scan, the median sample interval if None.
+    :param max_interval: samples further apart than this, eg. between two runs, are not used.
+    """
+    times = np.asarray(times, dtype=float)
+    temperatures = np.asarray(temperatures, dtype=float)
+    outputs = np.asarray(outputs, dtype=float)
+    if len(times) < 4:
+        raise ValueError("At least 4 samples are needed to fit the model")
+
+    if ambient is None:
+        ambient = temperatures[0]
+
+    intervals = np.diff(times)
+    valid = (intervals > 0) & (intervals <= max_interval)
+    derivative = np.diff(temperatures)[valid] / intervals[valid]
+    sample_times = times[:-1][valid]
+    excess_temperature = temperatures[:-1][valid] - ambient
+
+    if dead_time_step is None:
+        dead_time_step = float(np.median(intervals[valid]))
+
+    best = None
+    for dead_time in np.arange(0.0, max_dead_time + dead_time_step / 2, dead_time_step):
+        # output that was applied dead_time seconds before each sample, zero before the record starts
+        index = np.searchsorted(times, sample_times - dead_time, side="right") - 1
+        delayed_output = np.where(index >= 0, outputs[np.clip(index, 0, None)], 0.0)
+
+        regressors = np.column_stack((excess_temperature, delayed_output))
+        coefficients, _, _, _ = np.linalg.lstsq(regressors, derivative, rcond=None)
+        residual = float(np.sum((regressors @ coefficients - derivative) ** 2))
+        if best is None or residual < best[0]:
+            best = (residual, dead_time, coefficients)
+
+    _, dead_time, (a, b) = best
+    if a >= 0 or b <= 0:
+        raise ValueError("Recorded run does not fit a stable first order model")
+
+    return ThermalModel(gain=-b / a, time_constant=-1 / a, dead_time=float(dead_time), ambient=float(ambient))
+
+
+# Matches the PID status lines written by module_HardwareControlSystem.update_PID
+PID_LOG_PATTERN = re.compile(
+    r"^(?P<time>\d{4}-\d\d-\d\d \d\d:\d\d:\d\d,\d+) .*PID: Kp: [-\d.]+; Ki: [-\d.]+; Kd: [-\d.]+; "
+    r"output: (?P<output>[-\d.]+); current temperature: (?P<temperature>[-\d.]+)"
+)
+
+
+def read_pid_log(lines):
+    """Extract (timestamps, temperatures, outputs) from PID status lines in a log file.
+
+    :param lines: iterable of log lines.
+    """
+    times, temperatures, outputs = [], [], []
+    for line in lines:
+        match = PID_LOG_PATTERN.match(line)
+        if not match:
+            continue
+        timestamp = datetime.datetime.strptime(match.group("time"), "%Y-%m-%d %H:%M:%S,%f")
+        times.append(timestamp.timestamp())
+        temperatures.append(float(match.group("temperature")))
+        outputs.append(float(match.group("output")))
+
+    return times, temperatures, outputs
+
+
+def fit_from_log(log_file, **kwargs):
+    """Fit a ThermalModel to the PID status lines of a log file. The status lines are throttled and
+    not written during the distillation, record the log with [HEATER_MODEL] log_samples set to 1 so
+    every PID update is in it.
+
+    :param log_file: path to the log file.
+    """
+    with open(log_file, "r") as log:
+        times, temperatures, outputs = read_pid_log(log)
+    return fit(times, temperatures, outputs, **kwargs)
+
+
+def main():
+    import sys
+
+    if len(sys.argv) < 2:
+        print("Usage: module_thermalmodel.py <log file>")
+        exit(1)
+
+    model = fit_from_log(sys.argv[1])
+    print("[HEATER_MODEL]")
+    print("gain = {:.4f}".format(model.gain))
+    print("time_constant = {:.1f}".format(model.time_constant))
+    print("dead_time = {:.1f}".format(model.dead_time))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,11 @@
-from flask import Flask, jsonify, send_from_directory
+from flask import Flask, jsonify, request, send_from_directory
 import sys, time
 import controlthread as controlthread
 from hardware.commands.start_extraction import Command_StartExtraction
 from hardware.commands.start_heat_oil import Command_StartHeatOil
 from hardware.commands.start_clean_pump import Command_StartCleanPump
 from hardware.commands.start_decarb import Command_StartDecarb
+from hardware.commands.start_autotune import Command_StartAutotune
 from hardware.commands.start_distill import Command_StartDistill
 from hardware.commands.start_vent_pump import Command_StartVentPump
 from hardware.commands.pause_program import Command_PauseProgram
@@ -33,26 +34,43 @@ def get_machine_status():
     global control_thread 
     return control_thread.get_machine_json_status()
 
+@app.route("/api/statedurations", methods = ['GET'])
+def get_state_durations():
+    global control_thread
+    runs = request.args.get("runs", default=10, type=int)
+    return jsonify(control_thread.get_state_duration_stats(runs))
+
+@app.route("/api/timesaved", methods = ['GET'])
+def get_time_saved():
+    global control_thread
+    runs = request.args.get("runs", default=10, type=int)
+    return jsonify(control_thread.get_time_saved_stats(runs))
+
 @app.route("/api/start/<int:programId>", methods = ['POST'])
 def start(programId: int):
-    if programId==1:
-        #parameters: Full, SoakTime
-        command = Command_StartExtraction(runFull=True)
-    elif programId==2:
-        command = Command_StartDecarb()
-    elif programId==3:
-        command = Command_StartHeatOil()
-    elif programId==4:
-        command = Command_StartDistill()
-    elif programId==5:
-        command = Command_StartExtraction(runFull=False)
-    elif programId==6:
-        command = Command_StartVentPump()
-    else:
-        return jsonify({"type": "","description": "Invalid programId: " + programId }), 409
+    command = _create_start_command(programId)
+    if command is None:
+        return jsonify({"type": "","description": "Invalid programId: " + str(programId) }), 409
 
     return _process_command(command)
 
+#Body: {"programs": [1, 2, 3]}, program ids as for /api/start. Each program starts as soon as the one before has completed.
+@app.route("/api/startsequence", methods = ['POST'])
+def start_sequence():
+    body = request.get_json(silent=True) or {}
+    programIds = body.get("programs")
+    if not isinstance(programIds, list) or not programIds:
+        return jsonify({"type": "","description": "Expected a non-empty list of programs" }), 409
+
+    stages = []
+    for programId in programIds:
+        command = _create_start_command(programId)
+        if command is None:
+            return jsonify({"type": "","description": "Invalid programId: " + str(programId) }), 409
+        stages.append((programId, command))
+
+    return _schedule(lambda: control_thread.schedule_program_sequence(stages))
+
 @app.route("/api/pause", methods = ['POST'])
 def pause():
     return _process_command(Command_PauseProgram())
@@ -69,14 +87,38 @@ def reset():
 def start_clean_pump():
     return _process_command(Command_StartCleanPump())
 
+@app.route("/api/startautotune", methods = ['POST'])
+def start_autotune():
+    return _process_command(Command_StartAutotune())
+
 @app.route("/api/cleanvalve/<int:valvenumber>", methods = ['POST'])
 def clean_valve(valvenumber: int):
     return _process_command(Command_CleanValve(valvenumber))
 
+def _create_start_command(programId):
+    if programId==1:
+        #parameters: Full, SoakTime
+        return Command_StartExtraction(runFull=True)
+    elif programId==2:
+        return Command_StartDecarb()
+    elif programId==3:
+        return Command_StartHeatOil()
+    elif programId==4:
+        return Command_StartDistill()
+    elif programId==5:
+        return Command_StartExtraction(runFull=False)
+    elif programId==6:
+        return Command_StartVentPump()
+    return None
+
 def _process_command(command):
+    global control_thread 
+    return _schedule(lambda: control_thread.schedule_command_for_execution(command))
+
+def _schedule(schedule):
     global control_thread 
     try:
-        control_thread.schedule_command_for_execution(command)
+        schedule()
         #Give the controlthread time to execute command and update status
         time.sleep(.04)
         return control_thread.get_machine_json_status()